@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main.codec.ChunkValidator import ChunkValidator, HASH_ALGORITHMS
+
+BUFFER_SIZES = [64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+
+
+def measure(algorithm: str, buffer: bytes, total_bytes: int) -> float:
+    # 每个缓冲区单独计算一次摘要，与按块校验的用法一致；返回 MB/s
+    rounds = max(1, total_bytes // len(buffer))
+    factory = HASH_ALGORITHMS[algorithm]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        hasher = factory()
+        hasher.update(buffer)
+        hasher.digest()
+    elapsed = time.perf_counter() - start
+    return rounds * len(buffer) / elapsed / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checksum throughput per algorithm and buffer size")
+    parser.add_argument('--total', type=int, default=256, help="MiB hashed per measurement")
+    parser.add_argument('--algorithms', nargs='*', default=ChunkValidator.available_algorithms())
+    args = parser.parse_args()
+
+    total_bytes = args.total * 1024 * 1024
+    buffers = {size: os.urandom(size) for size in BUFFER_SIZES}
+
+    print(f"{'algorithm':<10}" + ''.join(f"{size // 1024:>10} KiB" for size in BUFFER_SIZES))
+    for algorithm in args.algorithms:
+        if algorithm not in HASH_ALGORITHMS:
+            print(f"{algorithm:<10}  not available")
+            continue
+        # 先预热一次，避免首次调用的开销计入结果
+        measure(algorithm, buffers[BUFFER_SIZES[0]], BUFFER_SIZES[0])
+        row = ''.join(f"{measure(algorithm, buffers[size], total_bytes):>9.0f} MB/s"
+                      for size in BUFFER_SIZES)
+        print(f"{algorithm:<10}{row}")
+
+
+if __name__ == '__main__':
+    main()
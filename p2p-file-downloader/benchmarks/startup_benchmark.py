@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Tuple
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+
+def serve(data: bytes, port: int) -> asyncio.AbstractEventLoop:
+    # 在后台线程里起一个支持 Range 的本地 HTTP 源
+    async def handle(request: web.Request) -> web.StreamResponse:
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Length': str(len(data)), 'Accept-Ranges': 'bytes'})
+        start, stop, _ = request.http_range.indices(len(data))
+        return web.Response(status=206, body=data[start:stop],
+                            headers={'Content-Range': f'bytes {start}-{stop - 1}/{len(data)}'})
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    async def start():
+        app = web.Application()
+        app.router.add_route('*', '/{name}', handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        ready.set()
+
+    def run():
+        loop.run_until_complete(start())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return loop
+
+
+def measure_first_byte(url: str, workdir: str) -> Tuple[float, float]:
+    # 运行一次无界面下载，返回 (进程启动到首字节的时间, 整个进程的运行时间)，单位秒
+    start = time.perf_counter()
+    output = os.path.join(workdir, 'download.bin')
+    if os.path.exists(output):
+        os.remove(output)
+    result = subprocess.run([sys.executable, MAIN, 'get', url, '-o', output, '--max-speed', '0'],
+                            cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    for line in result.stdout.splitlines():
+        event = json.loads(line)
+        if event['event'] == 'first_byte':
+            return event['cold_start_seconds'], elapsed
+    raise RuntimeError("download produced no data")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start to first byte of the headless downloader")
+    parser.add_argument('--url', help="file to download (default: a local test server)")
+    parser.add_argument('--size', type=int, default=8, help="MiB served by the local test server")
+    parser.add_argument('--port', type=int, default=18890)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    url = args.url
+    if url is None:
+        serve(os.urandom(args.size * 1024 * 1024), args.port)
+        url = f'http://127.0.0.1:{args.port}/file.bin'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # 先运行一次，让操作系统缓存好模块文件
+        measure_first_byte(url, workdir)
+        runs = [measure_first_byte(url, workdir) for _ in range(args.runs)]
+
+    print(f"{'':<24}{'min':>10}{'median':>10}")
+    for label, values in (('cold start to 1st byte', [run[0] for run in runs]),
+                          ('whole process', [run[1] for run in runs])):
+        print(f"{label:<24}{min(values) * 1000:>8.0f}ms{statistics.median(values) * 1000:>8.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,59 +1,300 @@
+import time
+
+# 进程启动时间，无界面模式用它计算冷启动到首字节的时间
+STARTED = time.time()
+
+import argparse
 import asyncio
+import contextlib
+import json
+import os
+import signal
 import sys
+import threading
 from src.main.utils.Config import Config
 from src.main.utils.Logger import Logger
 from src.main.utils.FileUtils import FileUtils
-from src.main.download.DownloadManager import DownloadManager
-from src.main.network.NetworkMonitor import NetworkMonitor
-from src.main.network.BandwidthManager import BandwidthManager
-from src.main.ui.GUI import GUI
 
-async def shutdown(gui):
-    gui.stop()
+# 下载器（numpy）、aiohttp、做种和控制接口都在各子命令里按需导入，ctl 启动时只加载控制客户端
+
+# 纠删码参数：每个条带 k 个数据分片、m 个校验分片，分片大小为 download.chunk_size
+ERASURE_K = 4
+ERASURE_M = 2
+
+async def shutdown(download_manager, peer_server=None):
+    if peer_server is not None:
+        await peer_server.stop()
+    await download_manager.close()
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
     for task in tasks:
         task.cancel()
     await asyncio.gather(*tasks, return_exceptions=True)
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="p2p-downloader", description="P2P File Downloader")
+    commands = parser.add_subparsers(dest="command")
+
+    commands.add_parser("gui", help="start the graphical interface (default)")
+
+    get = commands.add_parser("get", help="download without a GUI, printing JSON progress lines to stdout")
+    get.add_argument("urls", nargs="+")
+    get.add_argument("-o", "--output", help="output file (single URL only)")
+    get.add_argument("-d", "--directory", help="output directory (default: storage.download_path)")
+    get.add_argument("--mirror", action="append", default=[], help="additional source, may be repeated")
+    get.add_argument("--priority", type=int, default=0)
+    get.add_argument("--max-speed", type=int, help="bytes/s per download, 0 for unlimited")
+    get.add_argument("--interval", type=float, default=1.0, help="seconds between progress lines")
+
+    daemon = commands.add_parser("daemon", help="keep running and accept commands on the control socket")
+    daemon.add_argument("--socket", help="control socket path (default: control.socket)")
+    daemon.add_argument("--port", type=int, help="listen on this TCP port on 127.0.0.1 instead of a socket file")
+    daemon.add_argument("--api-port", type=int,
+                        help="HTTP control API port on 127.0.0.1 (default: control.api_port, 0 = disabled)")
+    daemon.add_argument("--seed", action=argparse.BooleanOptionalAction,
+                        help="serve completed downloads to other peers (default: network.seeding_enabled)")
+
+    parity = commands.add_parser("parity", help="encode the parity files other peers use as parity sources")
+    parity.add_argument("file")
+    parity.add_argument("-o", "--output", help="output directory (default: <file>.parity)")
+    parity.add_argument("--workers", type=int, help="encoder processes (default: number of CPUs)")
+
+    ctl = commands.add_parser("ctl", help="send one command to a running daemon")
+    ctl.add_argument("cmd", help="submit, list, status, pause, resume, cancel, priority, weight, max_speed, "
+                                 "stats, watch or shutdown")
+    ctl.add_argument("params", nargs="?", default="{}", help="command arguments as a JSON object")
+    ctl.add_argument("--socket", help="control socket path (default: control.socket)")
+    ctl.add_argument("--port", type=int, help="connect to this TCP port on 127.0.0.1 instead of a socket file")
+
+    args = parser.parse_args(argv)
+    if args.command == "get" and args.output and len(args.urls) > 1:
+        parser.error("--output can only be used with a single URL")
+    return args
+
+def control_address(config, args):
+    # 指定 --port 时走 TCP，否则用 --socket 或配置里的套接字文件
+    if args.port:
+        return {"socket_path": None, "host": config.get("control.host", "127.0.0.1"), "port": args.port}
+    return {"socket_path": args.socket or config.get("control.socket"),
+            "host": config.get("control.host", "127.0.0.1"),
+            "port": config.get("control.port", 8002)}
+
+def create_download_manager(config):
+    from src.main.download.DownloadManager import DownloadManager
+    from src.main.network.BandwidthManager import BandwidthManager
+
+    bandwidth_manager = BandwidthManager(
+        max_bandwidth=config.get("network.max_bandwidth"),
+        max_peer_bandwidth=config.get("network.max_peer_bandwidth"),
+        max_upload_bandwidth=config.get("network.max_upload_bandwidth")
+    )
+    return DownloadManager(
+        k=ERASURE_K,
+        m=ERASURE_M,
+        chunk_size=config.get("download.chunk_size"),
+        bandwidth_manager=bandwidth_manager
+    )
+
+def run_gui(config, logger) -> bool:
+    # 只有需要界面时才导入 tkinter
+    from src.main.ui.GUI import GUI
+    from src.main.network.NetworkMonitor import NetworkMonitor
+    from src.main.network.PeerServer import PeerServer
+
+    network_monitor = NetworkMonitor()
+    download_manager = create_download_manager(config)
+
+    # 整个程序只有一个事件循环，跑在后台线程；Tk 留在主线程
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, name="asyncio-loop", daemon=True)
+    loop_thread.start()
+
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    run(download_manager.initialize())
+    asyncio.run_coroutine_threadsafe(network_monitor.start_monitoring(), loop)
+
+    # 做种：已完成的下载通过 HTTP 和二进制协议提供给其他节点，上传按 max_upload_bandwidth 限速
+    peer_server = None
+    if config.get("network.seeding_enabled"):
+        peer_server = PeerServer.from_config(config, download_manager.bandwidth_manager)
+        if not run(peer_server.start()):
+            peer_server = None
+
+    gui = GUI(download_manager, loop)
+    logger.info("P2P File Downloader started")
+
+    # 处理退出信号
+    try:
+        gui.run()
+    except KeyboardInterrupt:
+        logger.info("Application interrupted by user")
+    finally:
+        gui.stop()
+        run(shutdown(download_manager, peer_server))
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+    return True
+
+async def run_get(config, args, stream) -> bool:
+    from src.main.cli.CLI import CLI
+
+    download_manager = create_download_manager(config)
+    await download_manager.initialize()
+    if args.max_speed is not None:
+        download_manager.max_speed = args.max_speed
+
+    directory = args.directory or config.get("storage.download_path")
+    downloads = []
+    for url in args.urls:
+        download = {
+            "url": url,
+            "output_path": args.output or CLI.default_output(url, directory),
+            "priority": args.priority
+        }
+        if args.mirror:
+            download["mirrors"] = args.mirror
+        downloads.append(download)
+
+    cli = CLI(download_manager, stream=stream, interval=args.interval, started=STARTED)
+    try:
+        return await cli.run(downloads)
+    finally:
+        await download_manager.close()
+
+async def run_daemon(config, args, logger) -> bool:
+    from src.main.cli.ControlAPI import ControlAPI
+    from src.main.cli.Daemon import Daemon
+    from src.main.network.PeerServer import PeerServer
+
+    download_manager = create_download_manager(config)
+    await download_manager.initialize()
+
+    peer_server = None
+    seeding = args.seed if args.seed is not None else config.get("network.seeding_enabled")
+    if seeding:
+        peer_server = PeerServer.from_config(config, download_manager.bandwidth_manager)
+        if not await peer_server.start():
+            peer_server = None
+
+    daemon = Daemon(download_manager, peer_server=peer_server,
+                    download_dir=config.get("storage.download_path"), **control_address(config, args))
+    if not await daemon.start():
+        await shutdown(download_manager, peer_server)
+        return False
+
+    # HTTP 控制接口：批量提交、暂停/继续/取消、任务统计和 SSE 进度流
+    api = None
+    api_port = args.api_port if args.api_port is not None else config.get("control.api_port")
+    if api_port:
+        api = ControlAPI.from_config(config, download_manager, peer_server)
+        api.port = api_port
+        if not await api.start():
+            api = None
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.create_task(daemon.stop()))
+        except (NotImplementedError, AttributeError):
+            # Windows 的事件循环不支持信号处理，Ctrl+C 仍会中断 asyncio.run
+            pass
+    logger.info(f"P2P File Downloader daemon started on {daemon.address}")
+
+    try:
+        await daemon.serve_forever()
+    finally:
+        if api is not None:
+            await api.stop()
+        await daemon.stop()
+        await shutdown(download_manager, peer_server)
+    return True
+
+def run_parity(config, args) -> bool:
+    # 做种节点生成校验文件 shard_k ... shard_{n-1}，下载方按顺序把它们的 URL 作为 parity_urls；
+    # 条带在多个进程里并行编码，内存占用与文件大小无关。
+    # parity_hashes.json 记录每个校验文件里每个条带分片的哈希，下载方作为 parity_hashes 传入用于校验分片
+    from src.main.codec.ChunkValidator import ChunkValidator
+    from src.main.codec.ParallelCodec import ParallelCodec
+
+    chunk_size = config.get("download.chunk_size")
+    output_dir = args.output or args.file + ".parity"
+    with ParallelCodec(ERASURE_K, ERASURE_M, workers=args.workers) as codec:
+        paths = codec.encode_file(args.file, output_dir, chunk_size,
+                                  range(ERASURE_K, ERASURE_K + ERASURE_M))
+    if not paths:
+        print(json.dumps({"ok": False, "parity_files": paths}))
+        return False
+
+    try:
+        validator = ChunkValidator(chunk_size, algorithm=config.get("download.chunk_hash_algorithm", "sha256"))
+    except ValueError as e:
+        print(json.dumps({"ok": False, "error": str(e)}))
+        return False
+    stripe_count = os.path.getsize(paths[0]) // chunk_size
+    parity_hashes = [[f"{validator.algorithm}:{digest}" for digest in validator.hash_file_chunks(path, range(stripe_count))]
+                     for path in paths]
+    hashes_path = os.path.join(output_dir, "parity_hashes.json")
+    with open(hashes_path, "w") as f:
+        json.dump(parity_hashes, f)
+    print(json.dumps({"ok": True, "parity_files": paths, "parity_hashes": hashes_path}))
+    return True
+
+async def run_ctl(config, args) -> bool:
+    from src.main.cli.ControlClient import ControlClient
+
+    try:
+        params = json.loads(args.params)
+        if not isinstance(params, dict):
+            raise ValueError("arguments must be a JSON object")
+    except ValueError as e:
+        print(json.dumps({"ok": False, "error": f"invalid arguments: {str(e)}"}))
+        return False
+
+    try:
+        async with ControlClient(**control_address(config, args)) as client:
+            if args.cmd == "watch":
+                async for event in client.watch(params.get("job_ids")):
+                    print(json.dumps(event), flush=True)
+                return True
+            reply = await client.request(dict(params, cmd=args.cmd))
+            print(json.dumps(reply))
+            return bool(reply.get("ok"))
+    except (OSError, asyncio.TimeoutError) as e:
+        print(json.dumps({"ok": False, "error": f"cannot reach daemon: {str(e) or type(e).__name__}"}))
+        return False
+
+def main(argv=None):
+    args = parse_args(argv)
     config = Config()
+
+    # ctl 只是一个短命的客户端，不写日志也不创建目录
+    if args.command == "ctl":
+        sys.exit(0 if asyncio.run(run_ctl(config, args)) else 1)
+    if args.command == "parity":
+        sys.exit(0 if run_parity(config, args) else 1)
+
     logger = Logger(
         "P2P-Downloader",
         config.get("logging.file"),
         config.get("logging.level")
     )
 
+    ok = True
     try:
         FileUtils.ensure_dir(config.get("storage.download_path"))
         FileUtils.ensure_dir(config.get("storage.temp_path"))
 
-        network_monitor = NetworkMonitor()
-        bandwidth_manager = BandwidthManager(
-            max_bandwidth=config.get("network.max_bandwidth")
-        )
-
-        download_manager = DownloadManager(
-            k=4,
-            m=2,
-            chunk_size=config.get("download.chunk_size")
-        )
-
-        loop = asyncio.get_event_loop()
-        gui = GUI(download_manager)
-
-        # 处理退出信号
-        try:
-            loop.run_until_complete(asyncio.gather(
-                network_monitor.start_monitoring(),
-                download_manager.initialize(),
-                gui.run()
-            ))
-        except KeyboardInterrupt:
-            logger.info("Application interrupted by user")
-        finally:
-            loop.run_until_complete(shutdown(gui))
-
-        logger.info("P2P File Downloader started")
+        if args.command == "get":
+            # stdout 只输出 JSON 进度，下载过程中的其他输出改到 stderr
+            stream = sys.stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                ok = asyncio.run(run_get(config, args, stream))
+        elif args.command == "daemon":
+            ok = asyncio.run(run_daemon(config, args, logger))
+        else:
+            ok = run_gui(config, logger)
 
     except Exception as e:
         logger.error(f"Application error: {str(e)}")  # 记录错误信息
@@ -63,5 +304,8 @@ def main():
         logger.info("P2P File Downloader stopped")
         logger.close()
 
+    if not ok:
+        sys.exit(1)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
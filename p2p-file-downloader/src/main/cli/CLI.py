@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, TextIO
+from urllib.parse import unquote, urlparse
+from ..download.DownloadManager import DownloadManager
+
+# 控制接口提交任务时可以指定的 DownloadManager.submit 参数
+SUBMIT_OPTIONS = ('priority', 'weight', 'mirrors', 'parity_urls', 'parity_hashes', 'chunk_hashes',
+                  'manifest_url', 'manifest_root')
+
+
+class CLI:
+    # 无界面下载：直接驱动 DownloadManager，向 stream 输出一行一个 JSON 事件。
+    # 每 interval 秒只为有变化的任务输出一次 progress，任务结束时输出 completed / failed；
+    # first_byte 事件和结束事件带有冷启动到首字节的时间（从进程启动 started 算起）。
+    # 库内部的 print 由调用方重定向到 stderr，stdout 上只有 JSON
+    def __init__(self, download_manager: DownloadManager, stream: Optional[TextIO] = None,
+                 interval: float = 1.0, started: Optional[float] = None):
+        self.download_manager = download_manager
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.started = started or time.time()
+        self._first_bytes = set()
+
+    @staticmethod
+    def default_output(url: str, directory: str) -> str:
+        name = os.path.basename(unquote(urlparse(url).path)) or 'download'
+        return os.path.join(directory, name)
+
+    @staticmethod
+    def confined_path(path: str, directory: str) -> str:
+        # 控制接口的客户端只能写下载目录里的文件：相对路径相对于下载目录，
+        # 解析符号链接和 .. 之后仍在目录外的路径抛出 ValueError
+        root = os.path.realpath(directory)
+        resolved = os.path.realpath(os.path.join(root, path))
+        if resolved == root or os.path.commonpath([root, resolved]) != root:
+            raise ValueError("output_path must be inside the download directory")
+        return resolved
+
+    @staticmethod
+    def submit_arguments(request: Dict, directory: str) -> Dict:
+        # 把控制接口收到的任务对象转换成 submit 的参数，缺少 url、参数类型不对或输出路径不在下载目录里时
+        # 抛出 KeyError / TypeError / ValueError
+        if not isinstance(request, dict):
+            raise TypeError("job must be a JSON object")
+        url = request['url']
+        if not isinstance(url, str) or not url:
+            raise ValueError("url must be a non-empty string")
+        output_path = request.get('output_path')
+        if output_path is not None and not isinstance(output_path, str):
+            raise TypeError("output_path must be a string")
+        arguments = {key: request[key] for key in SUBMIT_OPTIONS if key in request}
+        arguments['url'] = url
+        arguments['output_path'] = CLI.confined_path(output_path or CLI.default_output(url, directory), directory)
+        if 'priority' in arguments:
+            arguments['priority'] = int(arguments['priority'])
+        if 'weight' in arguments:
+            arguments['weight'] = float(arguments['weight'])
+        return arguments
+
+    @staticmethod
+    def job_event(job: Dict) -> Dict:
+        # 进度事件的字段，Daemon 的 list 和 watch 命令输出同样的格式；首字节时间从提交算起
+        return {
+            'job': job['id'],
+            'status': job['status'],
+            'progress': round(job['progress'], 4),
+            'downloaded_bytes': job['downloaded_bytes'],
+            'file_size': job['file_size'],
+            'speed': round(job['speed'], 1),
+            'first_byte_seconds': round(job['first_byte'] - job['created'], 3) if job['first_byte'] else None
+        }
+
+    def cold_start(self, job: Dict) -> Dict:
+        if not job['first_byte']:
+            return {}
+        return {'cold_start_seconds': round(job['first_byte'] - self.started, 3)}
+
+    def emit(self, event: str, **fields):
+        fields = dict(fields, event=event, time=round(time.time(), 3))
+        self.stream.write(json.dumps(fields, default=str) + '\n')
+        self.stream.flush()
+
+    async def run(self, downloads: List[Dict]) -> bool:
+        # downloads 每项是 DownloadManager.submit 的参数：url、output_path，
+        # 以及可选的 priority、weight、mirrors、chunk_hashes 等
+        job_ids = [self.download_manager.submit(**download) for download in downloads]
+        for job_id in job_ids:
+            self.emit('submitted', job=job_id, url=self.download_manager.jobs[job_id]['url'])
+        reporter = asyncio.create_task(self._report(job_ids))
+        try:
+            results = await asyncio.gather(*(self.download_manager.wait(job_id) for job_id in job_ids))
+        finally:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+        for job_id in job_ids:
+            job = self.download_manager.jobs[job_id]
+            # 任务在第一个节拍之前就结束时也补上 first_byte 事件
+            self._emit_first_byte(job)
+            self.emit(job['status'], **self.job_event(job), **self.cold_start(job),
+                      elapsed=round((job['finished'] or time.time()) - job['created'], 3))
+        return all(results)
+
+    def _emit_first_byte(self, job: Dict):
+        if job['id'] not in self._first_bytes and job['first_byte']:
+            self._first_bytes.add(job['id'])
+            self.emit('first_byte', job=job['id'],
+                      first_byte_seconds=round(job['first_byte'] - job['created'], 3),
+                      **self.cold_start(job))
+
+    async def _report(self, job_ids: List[str]):
+        last_events: Dict[str, Dict] = {}
+        while True:
+            for job_id in job_ids:
+                job = self.download_manager.jobs.get(job_id)
+                if job is None:
+                    continue
+                self._emit_first_byte(job)
+                event = self.job_event(job)
+                if event != last_events.get(job_id):
+                    last_events[job_id] = event
+                    self.emit('progress', **event)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from aiohttp import web
+from .CLI import CLI
+from ..download.DownloadManager import DownloadManager
+from ..network.PeerServer import PeerServer
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+class ControlAPI:
+    # 本地 HTTP/JSON 控制接口，默认只监听 127.0.0.1：
+    #   GET  /jobs                      任务列表，?status= 按状态过滤
+    #   POST /jobs                      批量提交：一个任务对象、任务数组或 {"jobs": [...]}，一次请求可以提交上万个任务
+    #   GET  /job?id=<任务 ID>           单个任务的完整记录和统计（已用时间、平均速度、剩余时间）
+    #   POST /jobs/pause|resume|cancel  {"job_ids": [...]} 或 {"all": true}
+    #   GET  /events                    SSE 进度流，每个节拍只发有变化的任务；?id= 只看指定任务（有未知 ID 时返回 404），它们结束后发 done
+    #   GET  /stats                     全局统计
+    # 所有请求都要带 Authorization: Bearer <token>；没有配置 token 时启动时生成一个，写入 token_file（仅属主可读）。
+    # Host 头必须是本机地址，挡住 DNS 重绑定的网页；POST 只接受 application/json；
+    # 提交的 output_path 必须在下载目录里
+    def __init__(self, download_manager: DownloadManager, host: str = '127.0.0.1', port: int = 8003,
+                 download_dir: str = 'downloads', token: Optional[str] = None, interval: float = 1.0,
+                 peer_server: Optional[PeerServer] = None, keepalive_interval: float = 15.0,
+                 token_file: Optional[str] = None):
+        self.download_manager = download_manager
+        self.host = host
+        self.port = port
+        self.download_dir = download_dir
+        self.token = token
+        self.token_file = token_file
+        self.interval = interval
+        self.peer_server = peer_server
+        self.keepalive_interval = keepalive_interval
+        self._runner: Optional[web.AppRunner] = None
+
+    @classmethod
+    def from_config(cls, config, download_manager: DownloadManager,
+                    peer_server: Optional[PeerServer] = None) -> 'ControlAPI':
+        return cls(download_manager,
+                   host=config.get('control.host', '127.0.0.1'),
+                   port=config.get('control.api_port', 8003),
+                   download_dir=config.get('storage.download_path', 'downloads'),
+                   token=config.get('control.api_token') or None,
+                   peer_server=peer_server,
+                   token_file=config.get('control.api_token_file'))
+
+    @property
+    def is_running(self) -> bool:
+        return self._runner is not None
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._guard], client_max_size=64 * 1024 * 1024)
+        app.router.add_get('/jobs', self._handle_list)
+        app.router.add_post('/jobs', self._handle_submit)
+        app.router.add_get('/job', self._handle_job)
+        app.router.add_post('/jobs/{action:pause|resume|cancel}', self._handle_action)
+        app.router.add_get('/events', self._handle_events)
+        app.router.add_get('/stats', self._handle_stats)
+        return app
+
+    async def start(self) -> bool:
+        if self.is_running:
+            return True
+        try:
+            if not self.token:
+                self.token = self._generate_token()
+            self._runner = web.AppRunner(self.create_app())
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            print(f"Control API listening on http://{self.host}:{self.port}")
+            return True
+        except Exception as e:
+            print(f"Failed to start control API: {str(e)}")
+            await self.stop()
+            return False
+
+    def _generate_token(self) -> str:
+        token = secrets.token_urlsafe(32)
+        if self.token_file:
+            os.makedirs(os.path.dirname(self.token_file) or '.', exist_ok=True)
+            fd = os.open(self.token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(token + '\n')
+            print(f"Control API token written to {self.token_file}")
+        else:
+            print(f"Control API token: {token}")
+        return token
+
+    def _host_allowed(self, host: Optional[str]) -> bool:
+        try:
+            hostname = urlsplit('//' + (host or '')).hostname
+        except ValueError:
+            return False
+        return hostname in LOOPBACK_HOSTS or (hostname is not None and hostname == self.host)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _guard(self, request: web.Request, handler):
+        if not self._host_allowed(request.headers.get('Host')):
+            return self._error(403, 'unexpected Host header')
+        expected = f'Bearer {self.token}'.encode('utf-8')
+        if not self.token or not secrets.compare_digest(
+                request.headers.get('Authorization', '').encode('utf-8'), expected):
+            return self._error(401, 'missing or invalid token')
+        if request.method == 'POST' and request.content_type != 'application/json':
+            return self._error(415, 'expected application/json')
+        return await handler(request)
+
+    @staticmethod
+    def _error(status: int, message: str) -> web.Response:
+        return web.json_response({'ok': False, 'error': message}, status=status)
+
+    @staticmethod
+    async def _read_json(request: web.Request):
+        try:
+            return await request.json()
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=json.dumps({'ok': False, 'error': f"invalid JSON: {str(e)}"}),
+                                     content_type='application/json')
+
+    def job_stats(self, job_id: str) -> Optional[Dict]:
+        job = self.download_manager.get_job(job_id)
+        if job is None:
+            return None
+        now = time.time()
+        elapsed = ((job['finished'] or now) - job['started']) if job['started'] else 0.0
+        remaining = max(0, job['file_size'] - job['downloaded_bytes'])
+        job.update(elapsed=elapsed,
+                   average_speed=job['downloaded_bytes'] / elapsed if elapsed > 0 else 0.0,
+                   eta=remaining / job['speed'] if job['speed'] > 0 and job['status'] == 'downloading' else None,
+                   first_byte_seconds=job['first_byte'] - job['created'] if job['first_byte'] else None)
+        return job
+
+    async def _handle_list(self, request: web.Request) -> web.Response:
+        status = request.query.get('status')
+        jobs = [CLI.job_event(job) for job in self.download_manager.jobs.values()
+                if status is None or job['status'] == status]
+        return web.json_response({'ok': True, 'jobs': jobs})
+
+    async def _handle_submit(self, request: web.Request) -> web.Response:
+        body = await self._read_json(request)
+        entries = body.get('jobs') if isinstance(body, dict) and 'jobs' in body else body
+        if isinstance(entries, dict):
+            entries = [entries]
+        if not isinstance(entries, list):
+            return self._error(400, 'expected a job object, a list of jobs or {"jobs": [...]}')
+
+        manager = self.download_manager
+        results, errors = [], []
+        for index, entry in enumerate(entries):
+            try:
+                arguments = CLI.submit_arguments(entry, self.download_dir)
+                previous = manager.jobs.get(os.path.abspath(arguments['output_path']))
+                job_id = manager.submit(**arguments)
+                # 同一输出文件已在队列、下载中或暂停时不会新建任务
+                results.append({'job_id': job_id, 'created': manager.jobs[job_id] is not previous})
+            except (KeyError, TypeError, ValueError) as e:
+                errors.append({'index': index, 'error': f"{type(e).__name__}: {str(e)}"})
+        return web.json_response({
+            'ok': not errors,
+            'submitted': sum(1 for result in results if result['created']),
+            'jobs': results,
+            'errors': errors
+        }, status=200 if results or not errors else 400)
+
+    async def _handle_job(self, request: web.Request) -> web.Response:
+        job_id = request.query.get('id')
+        stats = self.job_stats(job_id) if job_id else None
+        if stats is None:
+            return self._error(404, 'unknown job')
+        return web.json_response({'ok': True, 'job': stats})
+
+    async def _handle_action(self, request: web.Request) -> web.Response:
+        body = await self._read_json(request)
+        if not isinstance(body, dict):
+            return self._error(400, 'expected {"job_ids": [...]} or {"all": true}')
+        manager = self.download_manager
+        job_ids = list(manager.jobs) if body.get('all') else body.get('job_ids')
+        if not isinstance(job_ids, list) or not all(isinstance(job_id, str) for job_id in job_ids):
+            return self._error(400, 'job_ids must be a list of job IDs')
+
+        action = request.match_info['action']
+        if action == 'pause':
+            results = await asyncio.gather(*(manager.pause_job(job_id) for job_id in job_ids))
+        elif action == 'resume':
+            results = [manager.resume_job(job_id) for job_id in job_ids]
+        else:
+            remove_partial = bool(body.get('remove_partial', True))
+            results = await asyncio.gather(*(manager.cancel_job(job_id, remove_partial) for job_id in job_ids))
+        # 状态不允许该操作（例如继续一个没有暂停的任务）或 ID 不存在的任务列在 unchanged 里
+        return web.json_response({
+            'ok': True,
+            'changed': sum(1 for result in results if result),
+            'unchanged': [job_id for job_id, result in zip(job_ids, results) if not result]
+        })
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        stats = self.download_manager.get_stats()
+        if self.peer_server is not None:
+            stats['seeding'] = self.peer_server.get_stats()
+        return web.json_response({'ok': True, 'stats': stats})
+
+    async def _handle_events(self, request: web.Request) -> web.StreamResponse:
+        job_ids: Optional[List[str]] = request.query.getall('id', None)
+        try:
+            interval = max(0.05, float(request.query.get('interval', self.interval)))
+        except ValueError:
+            return self._error(400, 'interval must be a number')
+        if job_ids is not None:
+            unknown = [job_id for job_id in job_ids if job_id not in self.download_manager.jobs]
+            if unknown:
+                return web.json_response({'ok': False, 'error': 'unknown job', 'job_ids': unknown}, status=404)
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream',
+                                               'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        manager = self.download_manager
+        last_events: Dict[str, Dict] = {}
+        finished = set()
+        idle = 0.0
+        try:
+            while True:
+                if job_ids is None:
+                    jobs = list(manager.jobs.values())
+                else:
+                    jobs = [manager.jobs[job_id] for job_id in job_ids if job_id in manager.jobs]
+                frames = []
+                for job in jobs:
+                    # 已经报告过结束状态的任务不再比较，上万个任务时每个节拍只处理未结束的
+                    if job['id'] in finished and job['status'] in FINISHED_STATUSES:
+                        continue
+                    event = CLI.job_event(job)
+                    if event != last_events.get(job['id']):
+                        last_events[job['id']] = event
+                        frames.append(f"event: progress\ndata: {json.dumps(event)}\n\n")
+                    if job['status'] in FINISHED_STATUSES:
+                        finished.add(job['id'])
+                    else:
+                        finished.discard(job['id'])
+
+                if frames:
+                    await response.write(''.join(frames).encode('utf-8'))
+                    idle = 0.0
+                elif idle >= self.keepalive_interval:
+                    await response.write(b': keepalive\n\n')
+                    idle = 0.0
+                if job_ids is not None and all(job['status'] in FINISHED_STATUSES for job in jobs):
+                    await response.write(b'event: done\ndata: {}\n\n')
+                    break
+                await asyncio.sleep(interval)
+                idle += interval
+        except ConnectionError:
+            # 客户端断开
+            pass
+        return response
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import socket
+from typing import AsyncIterator, Dict, Optional
+
+
+class ControlClient:
+    # Daemon 控制套接字的客户端：request 发一条命令读一行回复，watch 逐行读取进度事件直到 done
+    def __init__(self, socket_path: Optional[str] = None, host: str = '127.0.0.1', port: int = 8002,
+                 timeout: float = 10.0):
+        self.socket_path = socket_path if socket_path and hasattr(socket, 'AF_UNIX') else None
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    @classmethod
+    def from_config(cls, config) -> 'ControlClient':
+        return cls(socket_path=config.get('control.socket'),
+                   host=config.get('control.host', '127.0.0.1'),
+                   port=config.get('control.port', 8002))
+
+    async def connect(self):
+        if self.writer is not None:
+            return
+        if self.socket_path:
+            connection = asyncio.open_unix_connection(self.socket_path)
+        else:
+            connection = asyncio.open_connection(self.host, self.port)
+        self.reader, self.writer = await asyncio.wait_for(connection, self.timeout)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.reader = self.writer = None
+
+    async def __aenter__(self) -> 'ControlClient':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _send(self, command: Dict):
+        await self.connect()
+        self.writer.write(json.dumps(command).encode('utf-8') + b'\n')
+        await self.writer.drain()
+
+    async def _receive(self, timeout: Optional[float]) -> Dict:
+        line = await asyncio.wait_for(self.reader.readline(), timeout)
+        if not line:
+            raise ConnectionError("control socket closed")
+        return json.loads(line)
+
+    async def request(self, command: Dict) -> Dict:
+        await self._send(command)
+        return await self._receive(self.timeout)
+
+    async def watch(self, job_ids=None) -> AsyncIterator[Dict]:
+        await self._send({'cmd': 'watch', 'job_ids': job_ids})
+        while True:
+            event = await self._receive(None)
+            yield event
+            if event.get('event') == 'done':
+                return
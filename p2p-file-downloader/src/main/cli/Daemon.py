@@ -0,0 +1,159 @@
+import asyncio
+import json
+import os
+import socket
+from typing import Dict, List, Optional
+from .CLI import CLI
+from ..download.DownloadManager import DownloadManager
+from ..network.PeerServer import PeerServer
+
+
+class Daemon:
+    # 常驻下载服务，没有界面。本地控制套接字上一行一个 JSON 命令，每个命令回复一行 JSON：
+    #   {"cmd": "submit", "url": ..., "output_path": ..., "priority": 0, ...} -> {"ok": true, "job_id": ...}
+    #   list / status(job_id) / pause(job_id) / resume(job_id) / cancel(job_id) /
+    #   priority(job_id, priority) / weight(job_id, weight) / max_speed(speed) / stats / shutdown；watch(job_ids 可选) 持续输出与 CLI 相同的 progress 事件，直到任务全部结束。
+    # 支持 AF_UNIX 的系统监听 socket_path（权限 600，只有本机同一用户能连），否则监听 127.0.0.1:port
+    def __init__(self, download_manager: DownloadManager, socket_path: Optional[str] = None,
+                 host: str = '127.0.0.1', port: int = 8002, peer_server: Optional[PeerServer] = None,
+                 download_dir: str = 'downloads', interval: float = 1.0):
+        self.download_manager = download_manager
+        self.socket_path = socket_path if socket_path and hasattr(socket, 'AF_UNIX') else None
+        self.host = host
+        self.port = port
+        self.peer_server = peer_server
+        self.download_dir = download_dir
+        self.interval = interval
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._stopped = asyncio.Event()
+        self._clients = set()
+
+    @classmethod
+    def from_config(cls, config, download_manager: DownloadManager,
+                    peer_server: Optional[PeerServer] = None) -> 'Daemon':
+        return cls(download_manager,
+                   socket_path=config.get('control.socket'),
+                   host=config.get('control.host', '127.0.0.1'),
+                   port=config.get('control.port', 8002),
+                   peer_server=peer_server,
+                   download_dir=config.get('storage.download_path', 'downloads'))
+
+    @property
+    def address(self) -> str:
+        return self.socket_path or f"{self.host}:{self.port}"
+
+    async def start(self) -> bool:
+        try:
+            if self.socket_path:
+                # 上次异常退出留下的套接字文件
+                if os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+                os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+                self._server = await asyncio.start_unix_server(self._handle_client, self.socket_path)
+                os.chmod(self.socket_path, 0o600)
+            else:
+                self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+            print(f"Control socket listening on {self.address}")
+            return True
+        except Exception as e:
+            print(f"Failed to start control socket: {str(e)}")
+            return False
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        self._stopped.set()
+
+    async def serve_forever(self):
+        await self._stopped.wait()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    command = json.loads(line)
+                    if not isinstance(command, dict):
+                        raise ValueError("command must be a JSON object")
+                except ValueError as e:
+                    await self._send(writer, {'ok': False, 'error': f"invalid command: {str(e)}"})
+                    continue
+                if command.get('cmd') == 'watch':
+                    await self._watch(writer, command.get('job_ids'))
+                    continue
+                await self._send(writer, await self.handle_command(command))
+                if command.get('cmd') == 'shutdown':
+                    asyncio.create_task(self.stop())
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, message: Dict):
+        writer.write(json.dumps(message, default=str).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def handle_command(self, command: Dict) -> Dict:
+        manager = self.download_manager
+        cmd = command.get('cmd')
+        try:
+            if cmd == 'submit':
+                return {'ok': True, 'job_id': manager.submit(**CLI.submit_arguments(command, self.download_dir))}
+            if cmd == 'list':
+                return {'ok': True, 'jobs': [CLI.job_event(job) for job in manager.jobs.values()]}
+            if cmd == 'status':
+                job = manager.get_job(command['job_id'])
+                if job is None:
+                    return {'ok': False, 'error': 'unknown job'}
+                return {'ok': True, 'job': job}
+            if cmd == 'pause':
+                return {'ok': await manager.pause_job(command['job_id'])}
+            if cmd == 'resume':
+                return {'ok': manager.resume_job(command['job_id'])}
+            if cmd == 'cancel':
+                return {'ok': await manager.cancel_job(command['job_id'], command.get('remove_partial', True))}
+            if cmd == 'priority':
+                return {'ok': manager.set_job_priority(command['job_id'], int(command['priority']))}
+            if cmd == 'weight':
+                return {'ok': manager.set_job_weight(command['job_id'], float(command['weight']))}
+            if cmd == 'max_speed':
+                manager.set_max_speed(int(command['speed']))
+                return {'ok': True}
+            if cmd == 'stats':
+                stats = manager.get_stats()
+                if self.peer_server is not None:
+                    stats['seeding'] = self.peer_server.get_stats()
+                return {'ok': True, 'stats': stats}
+            if cmd == 'shutdown':
+                return {'ok': True}
+            return {'ok': False, 'error': f"unknown command: {cmd}"}
+        except (KeyError, TypeError, ValueError) as e:
+            return {'ok': False, 'error': f"bad arguments for {cmd}: {str(e)}"}
+
+    async def _watch(self, writer: asyncio.StreamWriter, job_ids: Optional[List[str]] = None):
+        # 与 CLI 相同：每个节拍只输出有变化的任务，指定的任务（或全部任务）结束后输出 done
+        last_events: Dict[str, Dict] = {}
+        while True:
+            ids = job_ids or list(self.download_manager.jobs)
+            jobs = [self.download_manager.jobs[job_id] for job_id in ids if job_id in self.download_manager.jobs]
+            for job in jobs:
+                event = CLI.job_event(job)
+                if event != last_events.get(job['id']):
+                    last_events[job['id']] = event
+                    await self._send(writer, dict(event, event='progress'))
+            if all(job['status'] in ('completed', 'failed', 'cancelled', 'paused') for job in jobs):
+                await self._send(writer, {'event': 'done'})
+                return
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,22 @@
+import importlib
+import sys
+import types
+
+__all__ = ['CLI', 'ControlAPI', 'ControlClient', 'Daemon']
+
+
+class _LazyPackage(types.ModuleType):
+    # 按需导入：ctl 只用到 ControlClient，导入包时不加载下载器、numpy 和 aiohttp.web
+    def __getattr__(self, name):
+        if name in __all__:
+            return getattr(importlib.import_module(f'.{name}', self.__name__), name)
+        raise AttributeError(f"module {self.__name__!r} has no attribute {name!r}")
+
+    def __setattr__(self, name, value):
+        # 导入子模块时会把模块对象绑定到包的同名属性上，这里换成模块里的同名类
+        if name in __all__ and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _LazyPackage
@@ -1,36 +1,166 @@
 import hashlib
 import os
-from typing import List, Tuple, Optional
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple, Optional
+
+
+class _ChecksumHasher:
+    # 把 crc32(data, value) 形式的校验和函数包装成与 hashlib 相同的接口
+    def __init__(self, function: Callable[[bytes, int], int]):
+        self.function = function
+        self.value = 0
+
+    def update(self, data):
+        self.value = self.function(data, self.value)
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(4, 'big')
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+
+# 算法名 -> 无参构造函数。sha256/blake2b 为密码学哈希，用于清单和最终校验；
+# crc32/crc32c/xxh* 为快速校验和，只用于检测传输错误
+HASH_ALGORITHMS = {
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+    'crc32': lambda: _ChecksumHasher(zlib.crc32),
+}
+
+try:
+    import crc32c
+    HASH_ALGORITHMS['crc32c'] = lambda: _ChecksumHasher(crc32c.crc32c)
+except ImportError:
+    pass
+
+try:
+    import xxhash
+    HASH_ALGORITHMS['xxh64'] = xxhash.xxh64
+    HASH_ALGORITHMS['xxh3_64'] = xxhash.xxh3_64
+except ImportError:
+    pass
+
+# 可用的最快校验和：优先硬件加速的 CRC32C，其次 xxHash，最后是 zlib 自带的 CRC32
+FAST_ALGORITHM = next(name for name in ('crc32c', 'xxh3_64', 'crc32') if name in HASH_ALGORITHMS)
+
 
 class ChunkValidator:
-    def __init__(self, chunk_size: int = 1024 * 1024):
+    def __init__(self, chunk_size: int = 1024 * 1024, max_workers: Optional[int] = None,
+                 read_size: int = 1024 * 1024, algorithm: str = 'sha256'):
+        algorithm = self.resolve_algorithm(algorithm)
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unsupported hash algorithm: {algorithm}")
         self.chunk_size = chunk_size
-        self.hash_algorithm = hashlib.sha256
+        self.algorithm = algorithm
+        self.hash_algorithm = HASH_ALGORITHMS[algorithm]
+        # hashlib 计算大块数据时会释放 GIL，多线程校验可以用满多个核心
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.read_size = read_size
+
+    @staticmethod
+    def available_algorithms() -> List[str]:
+        return list(HASH_ALGORITHMS)
 
-    def calculate_chunk_hash(self, chunk_data: bytes) -> str:
-        return self.hash_algorithm(chunk_data).hexdigest()
+    @staticmethod
+    def resolve_algorithm(algorithm: str) -> str:
+        # "fast" 表示当前环境中可用的最快校验和
+        return FAST_ALGORITHM if algorithm == 'fast' else algorithm
+
+    def split_hash(self, expected_hash: str) -> Tuple[str, str]:
+        # 期望值可以写成 "算法:摘要"（如 "crc32c:1a2b3c4d"），否则使用默认算法
+        algorithm, separator, digest = expected_hash.partition(':')
+        if separator and algorithm in HASH_ALGORITHMS:
+            return algorithm, digest.lower()
+        return self.algorithm, expected_hash.lower()
+
+    def new_hasher(self, expected_hash: Optional[str] = None):
+        # 增量哈希对象：数据边到达边 update，块结束时不需要再整体计算一遍
+        if expected_hash:
+            return HASH_ALGORITHMS[self.split_hash(expected_hash)[0]]()
+        return self.hash_algorithm()
+
+    def hash_matches(self, hasher, expected_hash: str) -> bool:
+        return hasher.hexdigest() == self.split_hash(expected_hash)[1]
+
+    def calculate_chunk_hash(self, chunk_data: bytes, algorithm: Optional[str] = None) -> str:
+        hasher = HASH_ALGORITHMS[algorithm or self.algorithm]()
+        hasher.update(chunk_data)
+        return hasher.hexdigest()
 
     def validate_chunk(self, chunk_data: bytes, expected_hash: str) -> bool:
         if not chunk_data or not expected_hash:
             return False
-        return self.calculate_chunk_hash(chunk_data) == expected_hash
+        hasher = self.new_hasher(expected_hash)
+        hasher.update(chunk_data)
+        return self.hash_matches(hasher, expected_hash)
 
     def validate_chunk_size(self, chunk_data: bytes) -> bool:
         return len(chunk_data) <= self.chunk_size
 
-    def validate_file_chunks(self, file_path: str, chunk_hashes: List[str]) -> List[bool]:
+    def _hash_run(self, file_path: str, chunk_ids: List[int], algorithm: Optional[str] = None,
+                  new_hasher: Optional[Callable] = None) -> List[Optional[str]]:
+        # 每个线程独立打开文件，按顺序读取一段连续的块，读缓冲区重复使用
+        digests = []
+        buffer = bytearray(min(self.read_size, self.chunk_size))
+        view = memoryview(buffer)
+        with open(file_path, 'rb', buffering=0) as file:
+            file.seek(chunk_ids[0] * self.chunk_size)
+            position = chunk_ids[0]
+            for chunk_id in chunk_ids:
+                if chunk_id != position:
+                    file.seek(chunk_id * self.chunk_size)
+                hasher = (new_hasher or HASH_ALGORITHMS[algorithm or self.algorithm])()
+                remaining = self.chunk_size
+                while remaining > 0:
+                    count = file.readinto(view[:min(remaining, len(buffer))])
+                    if not count:
+                        break
+                    hasher.update(view[:count])
+                    remaining -= count
+                digests.append(hasher.hexdigest() if remaining < self.chunk_size else None)
+                position = chunk_id + 1
+        return digests
+
+    def hash_file_chunks(self, file_path: str, chunk_ids: List[int], algorithm: Optional[str] = None,
+                         new_hasher: Optional[Callable] = None) -> List[Optional[str]]:
+        # 按块号切成连续的几段交给线程池，速度受磁盘限制而不是单个核心；
+        # new_hasher 给出时用它创建哈希对象（例如带前缀的 Merkle 叶子哈希），不按算法名查找
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return []
+        run_count = min(len(chunk_ids), self.max_workers * 4)
+        run_size = (len(chunk_ids) + run_count - 1) // run_count
+        runs = [chunk_ids[i:i + run_size] for i in range(0, len(chunk_ids), run_size)]
+
+        digests = []
+        if len(runs) == 1 or self.max_workers == 1:
+            for run in runs:
+                digests.extend(self._hash_run(file_path, run, algorithm, new_hasher))
+            return digests
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(runs))) as executor:
+            for run_digests in executor.map(lambda run: self._hash_run(file_path, run, algorithm, new_hasher), runs):
+                digests.extend(run_digests)
+        return digests
+
+    def validate_file_chunks(self, file_path: str, chunk_hashes: List[str],
+                             chunk_ids: Optional[List[int]] = None) -> List[bool]:
+        # chunk_ids 为空时校验全部块，否则只校验指定的块（按 chunk_ids 的顺序返回）
+        if chunk_ids is None:
+            chunk_ids = list(range(len(chunk_hashes)))
         if not os.path.exists(file_path):
-            return [False] * len(chunk_hashes)
+            return [False] * len(chunk_ids)
 
-        results = []
-        with open(file_path, 'rb') as file:
-            for expected_hash in chunk_hashes:
-                chunk = file.read(self.chunk_size)
-                if not chunk:
-                    results.append(False)
-                    continue
-                results.append(self.validate_chunk(chunk, expected_hash))
-        return results
+        # 同一份哈希列表使用同一种算法，以第一个期望值为准
+        expected = [self.split_hash(expected_hash) for expected_hash in chunk_hashes]
+        algorithm = expected[0][0] if expected else self.algorithm
+        try:
+            digests = self.hash_file_chunks(file_path, chunk_ids, algorithm)
+        except OSError:
+            return [False] * len(chunk_ids)
+        return [digest is not None and chunk_id < len(expected) and digest == expected[chunk_id][1]
+                for chunk_id, digest in zip(chunk_ids, digests)]
 
     def merge_chunks(self, chunks: List[bytes], output_path: str) -> bool:
         try:
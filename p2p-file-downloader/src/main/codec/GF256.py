@@ -0,0 +1,138 @@
+import numpy as np
+
+# GF(2^8)，本原多项式 x^8 + x^4 + x^3 + x^2 + 1 (0x11D)，生成元为 2
+PRIMITIVE_POLY = 0x11D
+FIELD_SIZE = 256
+
+
+def _build_tables():
+    exp_table = np.zeros(FIELD_SIZE * 2, dtype=np.uint8)
+    log_table = np.zeros(FIELD_SIZE, dtype=np.int32)
+    x = 1
+    for i in range(FIELD_SIZE - 1):
+        exp_table[i] = x
+        log_table[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= PRIMITIVE_POLY
+    # 指数表重复一遍，乘法时 log(a) + log(b) 无需取模
+    exp_table[FIELD_SIZE - 1:FIELD_SIZE * 2 - 1] = exp_table[:FIELD_SIZE]
+
+    # 256x256 完整乘法表，每一行都是“乘以常数 c”的查找表
+    logs = log_table[1:]
+    mul_table = np.zeros((FIELD_SIZE, FIELD_SIZE), dtype=np.uint8)
+    mul_table[1:, 1:] = exp_table[logs[:, None] + logs[None, :]]
+    return exp_table, log_table, mul_table
+
+
+EXP_TABLE, LOG_TABLE, MUL_TABLE = _build_tables()
+
+
+def gf_mul(a: int, b: int) -> int:
+    return int(MUL_TABLE[a, b])
+
+
+def gf_pow(a: int, power: int) -> int:
+    if power == 0:
+        return 1
+    if a == 0:
+        return 0
+    return int(EXP_TABLE[(int(LOG_TABLE[a]) * power) % (FIELD_SIZE - 1)])
+
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return int(EXP_TABLE[(FIELD_SIZE - 1) - int(LOG_TABLE[a])])
+
+
+# 每次查表处理的元素个数，保证索引和结果都留在 CPU 缓存中
+BLOCK_ELEMENTS = 32 * 1024
+
+_wide_tables = {}
+
+
+def _wide_table(coefficient: int) -> np.ndarray:
+    # 65536 项的 16 位查找表：一次查表同时完成两个字节与常数的乘法
+    table = _wide_tables.get(coefficient)
+    if table is None:
+        row = MUL_TABLE[coefficient].astype(np.uint16)
+        pairs = np.arange(FIELD_SIZE * FIELD_SIZE, dtype=np.uint32)
+        table = row[pairs & 0xFF] | (row[pairs >> 8] << 8)
+        _wide_tables[coefficient] = table
+    return table
+
+
+def matrix_multiply(matrix: np.ndarray, shards: np.ndarray) -> np.ndarray:
+    # matrix: (r, k) 系数矩阵；shards: (..., k, L) 数据分片，前面的维度可以是多个条带
+    # 每个系数对应一次整块查表 + 异或，全部在 NumPy 中完成
+    rows, cols = matrix.shape
+    length = shards.shape[-1]
+    flat = np.ascontiguousarray(shards).reshape((-1, cols, length))
+    output = np.zeros((flat.shape[0], rows, length), dtype=np.uint8)
+
+    wide = length % 2 == 0
+    source = flat.view(np.uint16) if wide else flat
+    target = output.view(np.uint16) if wide else output
+    width = source.shape[-1]
+    column_step = min(width, BLOCK_ELEMENTS)
+    row_step = max(1, BLOCK_ELEMENTS // width)
+
+    for row_start in range(0, source.shape[0], row_step):
+        for column_start in range(0, width, column_step):
+            block = source[row_start:row_start + row_step, :, column_start:column_start + column_step]
+            out_block = target[row_start:row_start + row_step, :, column_start:column_start + column_step]
+            for i in range(rows):
+                acc = out_block[:, i]
+                for j in range(cols):
+                    coefficient = int(matrix[i, j])
+                    if coefficient == 0:
+                        continue
+                    if coefficient == 1:
+                        acc ^= block[:, j]
+                    elif wide:
+                        acc ^= np.take(_wide_table(coefficient), block[:, j], mode='clip')
+                    else:
+                        acc ^= np.take(MUL_TABLE[coefficient], block[:, j], mode='clip')
+
+    return output.reshape(shards.shape[:-2] + (rows, length))
+
+
+def small_matrix_multiply(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # 小矩阵之间的乘法（构造编码矩阵时使用）
+    result = np.zeros((a.shape[0], b.shape[1]), dtype=np.uint8)
+    for i in range(a.shape[0]):
+        for j in range(b.shape[1]):
+            value = 0
+            for t in range(a.shape[1]):
+                value ^= int(MUL_TABLE[a[i, t], b[t, j]])
+            result[i, j] = value
+    return result
+
+
+def invert_matrix(matrix: np.ndarray) -> np.ndarray:
+    # GF(256) 上的 Gauss-Jordan 消元，矩阵不可逆时抛出 ValueError
+    size = matrix.shape[0]
+    if matrix.shape != (size, size):
+        raise ValueError("Only square matrices can be inverted")
+
+    augmented = np.zeros((size, size * 2), dtype=np.uint8)
+    augmented[:, :size] = matrix
+    augmented[:, size:] = np.eye(size, dtype=np.uint8)
+
+    for column in range(size):
+        pivot_rows = np.nonzero(augmented[column:, column])[0]
+        if len(pivot_rows) == 0:
+            raise ValueError("Matrix is singular in GF(256)")
+        pivot = column + int(pivot_rows[0])
+        if pivot != column:
+            augmented[[column, pivot]] = augmented[[pivot, column]]
+
+        # 主元归一化后，用整行查表消去其它行的该列
+        augmented[column] = MUL_TABLE[gf_inv(int(augmented[column, column]))][augmented[column]]
+        for row in range(size):
+            factor = int(augmented[row, column])
+            if row != column and factor:
+                augmented[row] ^= MUL_TABLE[factor][augmented[column]]
+
+    return augmented[:, size:].copy()
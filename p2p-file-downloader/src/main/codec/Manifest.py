@@ -0,0 +1,167 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .ChunkValidator import ChunkValidator
+from .MerkleTree import MerkleTree
+
+
+class BlockVerifier:
+    # 对从 start 开始（块对齐）的连续数据流逐块计算哈希，数据到达即校验
+    def __init__(self, manifest: 'Manifest', start: int):
+        self.manifest = manifest
+        self.block = start // manifest.block_size
+        self.block_start = start
+        self.offset = start
+        self.hasher = MerkleTree.new_leaf_hasher()
+        self.bad_blocks = []
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            if self.block >= self.manifest.block_count:
+                raise ValueError("Data beyond the end of the manifest")
+            block_end = self.manifest.block_range(self.block)[1] + 1
+            take = min(len(view), block_end - self.offset)
+            self.hasher.update(view[:take])
+            view = view[take:]
+            self.offset += take
+            if self.offset == block_end:
+                if self.hasher.digest() != self.manifest.block_hashes[self.block]:
+                    self.bad_blocks.append(self.block)
+                self.block += 1
+                self.block_start = self.offset
+                self.hasher = MerkleTree.new_leaf_hasher()
+
+    def finish(self) -> List[int]:
+        # 返回校验失败的块号；最后一个块只收到一部分时也算失败
+        if self.offset != self.block_start:
+            self.bad_blocks.append(self.block)
+            self.block_start = self.offset
+        return self.bad_blocks
+
+
+class Manifest:
+    # 清单：文件按 block_size 切成小块，每块一个叶子哈希 SHA-256(0x00 || 块)，根哈希由 Merkle 树给出。
+    # 块大小整除下载块大小，一个下载块由若干校验块组成，损坏时只需重新获取出错的小块。
+    # 版本 2 起叶子带域分隔前缀，版本 1 的清单（叶子为裸 SHA-256）不再接受
+    VERSION = 2
+
+    def __init__(self, file_size: int, chunk_size: int, block_size: int, block_hashes: List[bytes]):
+        if block_size <= 0 or chunk_size % block_size:
+            raise ValueError("chunk_size must be a multiple of block_size")
+        block_count = (file_size + block_size - 1) // block_size
+        if len(block_hashes) != block_count:
+            raise ValueError(f"Expected {block_count} block hashes, got {len(block_hashes)}")
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.block_hashes = list(block_hashes)
+        self.tree = MerkleTree(self.block_hashes)
+
+    @property
+    def block_count(self) -> int:
+        return len(self.block_hashes)
+
+    @property
+    def root(self) -> str:
+        return self.tree.root.hex()
+
+    def block_range(self, index: int) -> Tuple[int, int]:
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.file_size) - 1
+
+    def chunk_blocks(self, chunk_id: int) -> range:
+        blocks_per_chunk = self.chunk_size // self.block_size
+        first = chunk_id * blocks_per_chunk
+        return range(first, min(first + blocks_per_chunk, self.block_count))
+
+    def verifier(self, start: int) -> BlockVerifier:
+        return BlockVerifier(self, start)
+
+    def verify_block(self, index: int, data: bytes) -> bool:
+        if not 0 <= index < self.block_count:
+            return False
+        start, end = self.block_range(index)
+        return len(data) == end - start + 1 and MerkleTree.hash_leaf(data) == self.block_hashes[index]
+
+    def proof(self, index: int) -> List[str]:
+        return [node.hex() for node in self.tree.proof(index)]
+
+    @staticmethod
+    def verify_block_proof(data: bytes, index: int, block_count: int,
+                           proof: List[str], root: str) -> bool:
+        # 只凭根哈希和 O(log n) 个兄弟节点验证单个块，不需要完整的哈希列表
+        try:
+            nodes = [bytes.fromhex(node) for node in proof]
+            return MerkleTree.verify_proof(data, index, block_count, nodes, bytes.fromhex(root))
+        except ValueError:
+            return False
+
+    def verify_file(self, file_path: str, chunk_ids: Optional[List[int]] = None,
+                    max_workers: Optional[int] = None) -> Dict[int, List[int]]:
+        # 并行校验指定块（默认全部）中的每个小块，返回 块号 -> 损坏的小块号
+        if chunk_ids is None:
+            chunk_ids = range((self.file_size + self.chunk_size - 1) // self.chunk_size)
+        block_ids = [block for chunk_id in chunk_ids for block in self.chunk_blocks(chunk_id)]
+        validator = ChunkValidator(self.block_size, max_workers, algorithm='sha256')
+        try:
+            digests = validator.hash_file_chunks(file_path, block_ids, new_hasher=MerkleTree.new_leaf_hasher)
+        except OSError:
+            digests = [None] * len(block_ids)
+
+        bad_blocks = {}
+        blocks_per_chunk = self.chunk_size // self.block_size
+        for block, digest in zip(block_ids, digests):
+            if digest is None or bytes.fromhex(digest) != self.block_hashes[block]:
+                bad_blocks.setdefault(block // blocks_per_chunk, []).append(block)
+        return bad_blocks
+
+    @classmethod
+    def build(cls, file_path: str, chunk_size: int = 1024 * 1024, block_size: int = 256 * 1024,
+              max_workers: Optional[int] = None) -> 'Manifest':
+        file_size = os.path.getsize(file_path)
+        block_count = (file_size + block_size - 1) // block_size
+        validator = ChunkValidator(block_size, max_workers, algorithm='sha256')
+        digests = validator.hash_file_chunks(file_path, range(block_count), new_hasher=MerkleTree.new_leaf_hasher)
+        return cls(file_size, chunk_size, block_size, [bytes.fromhex(digest) for digest in digests])
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': self.VERSION,
+            'hash': 'sha256',
+            'file_size': self.file_size,
+            'chunk_size': self.chunk_size,
+            'block_size': self.block_size,
+            'root': self.root,
+            'blocks': [block_hash.hex() for block_hash in self.block_hashes]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, expected_root: Optional[str] = None) -> 'Manifest':
+        # 根哈希必须与块哈希列表重新计算的结果一致；给出 expected_root 时还要与之相同
+        if data.get('version') != cls.VERSION or data.get('hash', 'sha256') != 'sha256':
+            raise ValueError("Unsupported manifest format")
+        manifest = cls(int(data['file_size']), int(data['chunk_size']), int(data['block_size']),
+                       [bytes.fromhex(block_hash) for block_hash in data['blocks']])
+        if data.get('root') and data['root'] != manifest.root:
+            raise ValueError("Manifest root does not match its block hashes")
+        if expected_root and expected_root.lower() != manifest.root:
+            raise ValueError("Manifest root does not match the expected root")
+        return manifest
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text: str, expected_root: Optional[str] = None) -> 'Manifest':
+        return cls.from_dict(json.loads(text), expected_root)
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+
+    @classmethod
+    def load(cls, path: str, expected_root: Optional[str] = None) -> 'Manifest':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_json(f.read(), expected_root)
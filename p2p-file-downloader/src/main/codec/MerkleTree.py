@@ -0,0 +1,87 @@
+import hashlib
+from typing import List, Optional
+
+
+class MerkleTree:
+    # 叶子为 SHA-256(0x00 || 数据块)，内部节点为 SHA-256(0x01 || 左 || 右)（同 RFC 6962），
+    # 前缀不同，64 字节的两个子节点拼接不会与某个数据块的叶子哈希相同；
+    # 奇数个节点时最后一个直接提升到上一层
+    LEAF_PREFIX = b'\x00'
+    NODE_PREFIX = b'\x01'
+
+    def __init__(self, leaves: List[bytes]):
+        self.leaves = list(leaves)
+        self.levels = [self.leaves]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            parents = [self.hash_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                parents.append(level[-1])
+            self.levels.append(parents)
+
+    @classmethod
+    def new_leaf_hasher(cls):
+        # 增量计算叶子哈希：边接收数据边 update
+        return hashlib.sha256(cls.LEAF_PREFIX)
+
+    @classmethod
+    def hash_leaf(cls, data: bytes) -> bytes:
+        hasher = cls.new_leaf_hasher()
+        hasher.update(data)
+        return hasher.digest()
+
+    @classmethod
+    def hash_node(cls, left: bytes, right: bytes) -> bytes:
+        return hashlib.sha256(cls.NODE_PREFIX + left + right).digest()
+
+    @property
+    def leaf_count(self) -> int:
+        return len(self.leaves)
+
+    @property
+    def root(self) -> bytes:
+        if not self.leaves:
+            return hashlib.sha256(b'').digest()
+        return self.levels[-1][0]
+
+    def proof(self, index: int) -> List[bytes]:
+        # 从叶子到根依次给出兄弟节点，没有兄弟的层（被提升）不占位置
+        if not 0 <= index < self.leaf_count:
+            raise IndexError(f"Leaf {index} out of range")
+        path = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                path.append(level[sibling])
+            index >>= 1
+        return path
+
+    @classmethod
+    def root_from_proof(cls, leaf_hash: bytes, index: int, leaf_count: int,
+                        proof: List[bytes]) -> Optional[bytes]:
+        # 左右位置由叶子编号和每层节点数决定，证明不能被挪用到其他块上
+        if not 0 <= index < leaf_count:
+            return None
+        node = leaf_hash
+        width = leaf_count
+        position = 0
+        while width > 1:
+            sibling = index ^ 1
+            if sibling < width:
+                if position >= len(proof):
+                    return None
+                if index & 1:
+                    node = cls.hash_node(proof[position], node)
+                else:
+                    node = cls.hash_node(node, proof[position])
+                position += 1
+            index >>= 1
+            width = (width + 1) // 2
+        if position != len(proof):
+            return None
+        return node
+
+    @classmethod
+    def verify_proof(cls, data: bytes, index: int, leaf_count: int,
+                     proof: List[bytes], root: bytes) -> bool:
+        return cls.root_from_proof(cls.hash_leaf(data), index, leaf_count, proof) == root
@@ -0,0 +1,213 @@
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .RSCodec import RSCodec
+
+# 工作进程内的编解码器，由进程池初始化函数创建
+_worker_codec: Optional[RSCodec] = None
+
+
+def _init_worker(k: int, m: int):
+    global _worker_codec
+    _worker_codec = RSCodec(k, m)
+
+
+def _open_output(path: str) -> int:
+    return os.open(path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+
+
+def _pwrite(fd: int, data, offset: int):
+    view = memoryview(data)
+    written = 0
+    if hasattr(os, 'pwrite'):
+        while written < len(view):
+            written += os.pwrite(fd, view[written:], offset + written)
+    else:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while written < len(view):
+            written += os.write(fd, view[written:])
+
+
+def _read_region(path: str, offset: int, length: int) -> np.ndarray:
+    # 读取 [offset, offset + length)，超出文件末尾的部分补零。
+    # 各进程直接映射同一个文件，数据通过共享的页缓存传递，不经过 pickle；
+    # 映射和文件描述符在本批结束时关闭，任务返回后工作进程不再持有任何文件
+    buffer = np.zeros(length, dtype=np.uint8)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset >= size:
+            return buffer
+        available = min(length, size - offset)
+        # 映射起点必须按分配粒度对齐
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(f.fileno(), offset - start + available, access=mmap.ACCESS_READ, offset=start) as mapped:
+            view = np.frombuffer(mapped, dtype=np.uint8, count=available, offset=offset - start)
+            buffer[:available] = view
+            del view
+    return buffer
+
+
+def _encode_batch(input_path: str, shard_paths: Dict[int, str], first_stripe: int,
+                  stripe_count: int, chunk_size: int) -> int:
+    codec = _worker_codec
+    stripe_size = codec.k * chunk_size
+    data = _read_region(input_path, first_stripe * stripe_size, stripe_count * stripe_size)
+    stripes = codec.encode_stripes(data.reshape(stripe_count, codec.k, chunk_size))
+
+    # shard_i 中条带连续存放，这一批条带在每个分片文件里是一段连续区域
+    offset = first_stripe * chunk_size
+    for i, shard_path in shard_paths.items():
+        fd = _open_output(shard_path)
+        try:
+            _pwrite(fd, np.ascontiguousarray(stripes[:, i]), offset)
+        finally:
+            os.close(fd)
+    return stripe_count
+
+
+def _decode_batch(shard_paths: List[str], indices: Tuple[int, ...], output_path: str,
+                  original_size: int, first_stripe: int, stripe_count: int, chunk_size: int) -> int:
+    codec = _worker_codec
+    offset = first_stripe * chunk_size
+    shards = np.stack([
+        _read_region(shard_paths[i], offset, stripe_count * chunk_size).reshape(stripe_count, chunk_size)
+        for i in indices
+    ], axis=1)
+    data = codec.decode_stripes(shards, indices)
+
+    start = first_stripe * codec.k * chunk_size
+    length = min(data.size, original_size - start)
+    fd = _open_output(output_path)
+    try:
+        _pwrite(fd, np.ascontiguousarray(data).reshape(-1)[:length], start)
+    finally:
+        os.close(fd)
+    return stripe_count
+
+
+class ParallelCodec:
+    def __init__(self, k: int, m: int, workers: Optional[int] = None,
+                 batch_bytes: int = 16 * 1024 * 1024, max_pending: Optional[int] = None):
+        self.k = k
+        self.m = m
+        self.n = k + m
+        self.workers = workers or os.cpu_count() or 1
+        # 每个任务处理约 batch_bytes 的数据，在途任务数有上限，内存占用与文件大小无关
+        self.batch_bytes = batch_bytes
+        self.max_pending = max_pending or self.workers * 2
+        self.executor = None
+
+    def start(self):
+        if self.executor is None:
+            # 调用方进程里可能已经有线程和事件循环，fork 出的子进程会继承它们持有的锁；
+            # 工作进程改由 forkserver（不支持时用 spawn）启动
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.k, self.m)
+            )
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _stripes_per_batch(self, chunk_size: int) -> int:
+        return max(1, self.batch_bytes // (self.k * chunk_size))
+
+    def _run_batches(self, function, stripe_count: int, chunk_size: int, *args) -> bool:
+        self.start()
+        batch = self._stripes_per_batch(chunk_size)
+        pending = []
+        try:
+            for first_stripe in range(0, stripe_count, batch):
+                if len(pending) >= self.max_pending:
+                    pending.pop(0).result()
+                count = min(batch, stripe_count - first_stripe)
+                pending.append(self.executor.submit(function, *args, first_stripe, count, chunk_size))
+            for future in pending:
+                future.result()
+            return True
+        except Exception as e:
+            print(f"Parallel codec failed: {str(e)}")
+            for future in pending:
+                future.cancel()
+            return False
+
+    @staticmethod
+    def _preallocate(path: str, size: int):
+        with open(path, 'wb') as f:
+            f.truncate(size)
+
+    @staticmethod
+    def _sync(paths: List[str]) -> bool:
+        # 工作进程写完后统一落盘，任何一个描述符上的 fsync 都会刷写该文件的全部脏页
+        try:
+            for path in paths:
+                fd = _open_output(path)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            return True
+        except OSError as e:
+            print(f"Parallel codec failed to sync output: {str(e)}")
+            return False
+
+    def encode_file(self, input_path: str, output_dir: str, chunk_size: int = 1024 * 1024,
+                    shard_indices: Optional[List[int]] = None) -> List[str]:
+        # 输出布局与 RSCodec.encode_file 相同：shard_i 依次保存所有条带的第 i 个分片。
+        # shard_indices 只生成指定的分片，例如 range(k, n) 只生成纠删码下载使用的校验文件
+        if not os.path.exists(input_path):
+            return []
+        file_size = os.path.getsize(input_path)
+        if file_size == 0:
+            return []
+
+        stripe_size = self.k * chunk_size
+        stripe_count = (file_size + stripe_size - 1) // stripe_size
+        os.makedirs(output_dir, exist_ok=True)
+        indices = range(self.n) if shard_indices is None else shard_indices
+        shard_paths = {i: os.path.join(output_dir, f'shard_{i}') for i in indices}
+        for shard_path in shard_paths.values():
+            self._preallocate(shard_path, stripe_count * chunk_size)
+
+        if not self._run_batches(_encode_batch, stripe_count, chunk_size, input_path, shard_paths):
+            return []
+        if not self._sync(list(shard_paths.values())):
+            return []
+        return list(shard_paths.values())
+
+    def decode_file(self, shard_paths: List[Optional[str]], original_size: int,
+                    output_path: str, chunk_size: int = 1024 * 1024) -> bool:
+        # shard_paths[i] 为第 i 个分片文件，缺失的分片传 None；至少需要 k 个
+        available = tuple(i for i, path in enumerate(shard_paths[:self.n])
+                          if path is not None and os.path.exists(path))
+        if len(available) < self.k:
+            return False
+
+        indices = available[:self.k]
+        stripe_size = self.k * chunk_size
+        stripe_count = (original_size + stripe_size - 1) // stripe_size
+        self._preallocate(output_path, original_size)
+        if stripe_count == 0:
+            return True
+
+        return (self._run_batches(_decode_batch, stripe_count, chunk_size,
+                                  list(shard_paths), indices, output_path, original_size) and
+                self._sync([output_path]))
@@ -1,64 +1,123 @@
 import numpy as np
-from typing import List, Tuple, Optional
-import galois
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Optional
 import os
+from .GF256 import gf_pow, invert_matrix, matrix_multiply, small_matrix_multiply
 
 class RSCodec:
-    def __init__(self, k: int, m: int):
+    def __init__(self, k: int, m: int, decoding_cache_size: int = 64):
         self.k = k
         self.m = m
         self.n = k + m
-        self.field = galois.GF(2**8)
+        self.decoding_cache_size = decoding_cache_size
+        self.decoding_cache_hits = 0
+        self.decoding_cache_misses = 0
         self._generate_matrices()
 
     def _generate_matrices(self):
-        vandermonde = np.array([[1] + [self.field(x)**(j) for j in range(1, self.k)]
-                               for x in range(self.n)])
-        self.encoding_matrix = self.field(vandermonde)
-        self.decoding_matrices = {}
+        vandermonde = np.array([[gf_pow(x, j) for j in range(self.k)]
+                                for x in range(self.n)], dtype=np.uint8)
+        # 系统码：编码矩阵前 k 行为单位阵，数据分片原样保留，只需计算 m 个校验分片
+        top_inverse = invert_matrix(vandermonde[:self.k])
+        self.encoding_matrix = small_matrix_multiply(vandermonde, top_inverse)
+        self.parity_matrix = self.encoding_matrix[self.k:]
+        # LRU 缓存：可用分片组合 -> 解码矩阵，同一个节点丢失时所有条带只求一次逆
+        self.decoding_matrices = OrderedDict()
 
     def _prepare_data(self, data: bytes, chunk_size: int) -> np.ndarray:
-        padding_size = (chunk_size - len(data) % chunk_size) % chunk_size
-        padded_data = data + b'\0' * padding_size
-        return np.frombuffer(padded_data, dtype=np.uint8).reshape(-1, chunk_size)
+        # 按条带切分：每个条带 k 个数据分片，每片 chunk_size 字节，末尾补零
+        stripe_size = self.k * chunk_size
+        padding_size = (stripe_size - len(data) % stripe_size) % stripe_size
+        buffer = np.zeros(len(data) + padding_size, dtype=np.uint8)
+        buffer[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        return buffer.reshape(-1, self.k, chunk_size)
+
+    def encode_stripes(self, data_shards: np.ndarray) -> np.ndarray:
+        # data_shards: (条带数, k, L) -> (条带数, n, L)
+        stripes = np.empty((data_shards.shape[0], self.n, data_shards.shape[2]), dtype=np.uint8)
+        stripes[:, :self.k] = data_shards
+        stripes[:, self.k:] = matrix_multiply(self.parity_matrix, data_shards)
+        return stripes
 
     def encode(self, data: bytes, chunk_size: int = 1024) -> List[bytes]:
         if not data:
             return []
 
-        data_matrix = self._prepare_data(data, chunk_size)
-        encoded_chunks = []
-
-        for i in range(data_matrix.shape[0]):
-            chunk = data_matrix[i]
-            encoded = self.encoding_matrix.dot(chunk)
-            encoded_chunks.extend(bytes(x) for x in encoded)
-
-        return encoded_chunks
+        # 返回按条带顺序排列的分片：第 s 个条带的第 i 个分片位于 s * n + i
+        stripes = self.encode_stripes(self._prepare_data(data, chunk_size))
+        return [shard.tobytes() for shard in stripes.reshape(-1, chunk_size)]
+
+    def _get_decoding_matrix(self, indices: Tuple[int, ...]) -> np.ndarray:
+        decoding_matrix = self.decoding_matrices.get(indices)
+        if decoding_matrix is not None:
+            self.decoding_matrices.move_to_end(indices)
+            self.decoding_cache_hits += 1
+            return decoding_matrix
+
+        self.decoding_cache_misses += 1
+        decoding_matrix = invert_matrix(self.encoding_matrix[list(indices)])
+        self.decoding_matrices[indices] = decoding_matrix
+        if len(self.decoding_matrices) > self.decoding_cache_size:
+            self.decoding_matrices.popitem(last=False)
+        return decoding_matrix
+
+    def decode_stripes(self, shards: np.ndarray, indices: Tuple[int, ...]) -> np.ndarray:
+        # shards: (条带数, k, L)，indices 为这 k 个分片在条带内的编号（升序）
+        if indices == tuple(range(self.k)):
+            return shards
+
+        decoding_matrix = self._get_decoding_matrix(indices)
+        missing = [i for i in range(self.k) if i not in indices]
+        data = np.empty_like(shards)
+        for position, index in enumerate(indices):
+            if index < self.k:
+                data[:, index] = shards[:, position]
+        # 只重建缺失的数据分片
+        data[:, missing] = matrix_multiply(decoding_matrix[missing], shards)
+        return data
+
+    def decode_stripe(self, shards: Dict[int, bytes]) -> Optional[np.ndarray]:
+        if len(shards) < self.k:
+            return None
+        indices = tuple(sorted(shards)[:self.k])
+        stacked = np.stack([np.frombuffer(shards[i], dtype=np.uint8) for i in indices])
+        return self.decode_stripes(stacked[None], indices)[0]
 
-    def decode(self, chunks: List[bytes], available_indices: List[int], 
+    def decode(self, chunks: List[bytes], available_indices: List[int],
                original_size: int) -> Optional[bytes]:
-        if len(chunks) < self.k or len(available_indices) < self.k:
+        if len(chunks) < self.k or len(chunks) != len(available_indices):
             return None
 
         try:
             chunk_size = len(chunks[0])
-            available_indices = available_indices[:self.k]
-            chunks = chunks[:self.k]
-
-            decoding_matrix = self.encoding_matrix[available_indices, :self.k]
-            decoding_matrix = self.field(np.linalg.inv(decoding_matrix))
-
-            chunk_matrix = np.vstack([np.frombuffer(chunk, dtype=np.uint8) 
-                                    for chunk in chunks])
-            decoded = decoding_matrix.dot(chunk_matrix)
-            
-            result = bytes(decoded.flatten())
-            return result[:original_size]
+            stripe_size = self.k * chunk_size
+            stripe_count = max(1, (original_size + stripe_size - 1) // stripe_size)
+
+            by_stripe = {}
+            for index, chunk in zip(available_indices, chunks):
+                by_stripe.setdefault(index // self.n, {})[index % self.n] = chunk
+
+            # 丢失模式相同的条带一起解码，共用一个解码矩阵
+            patterns = {}
+            for stripe in range(stripe_count):
+                shards = by_stripe.get(stripe, {})
+                if len(shards) < self.k:
+                    return None
+                patterns.setdefault(tuple(sorted(shards)[:self.k]), []).append(stripe)
+
+            decoded = np.empty((stripe_count, self.k, chunk_size), dtype=np.uint8)
+            for indices, stripes in patterns.items():
+                stacked = np.stack([
+                    np.stack([np.frombuffer(by_stripe[stripe][i], dtype=np.uint8) for i in indices])
+                    for stripe in stripes
+                ])
+                decoded[stripes] = self.decode_stripes(stacked, indices)
+
+            return decoded.tobytes()[:original_size]
         except Exception:
             return None
 
-    def encode_file(self, input_path: str, output_dir: str, 
+    def encode_file(self, input_path: str, output_dir: str,
                    chunk_size: int = 1024) -> Tuple[List[str], List[bytes]]:
         if not os.path.exists(input_path):
             return [], []
@@ -67,24 +126,26 @@ class RSCodec:
             with open(input_path, 'rb') as f:
                 data = f.read()
 
-            encoded_chunks = self.encode(data, chunk_size)
-            if not encoded_chunks:
+            if not data:
                 return [], []
+            stripes = self.encode_stripes(self._prepare_data(data, chunk_size))
 
+            # 每个分片编号一个文件：shard_i 依次保存所有条带的第 i 个分片，
+            # shard_k ... shard_{n-1} 就是纠删码下载使用的校验源
             os.makedirs(output_dir, exist_ok=True)
             chunk_paths = []
 
-            for i, chunk in enumerate(encoded_chunks):
-                chunk_path = os.path.join(output_dir, f'chunk_{i}')
+            for i in range(self.n):
+                chunk_path = os.path.join(output_dir, f'shard_{i}')
                 with open(chunk_path, 'wb') as f:
-                    f.write(chunk)
+                    f.write(stripes[:, i].tobytes())
                 chunk_paths.append(chunk_path)
 
-            return chunk_paths, encoded_chunks
+            return chunk_paths, [shard.tobytes() for shard in stripes.reshape(-1, chunk_size)]
         except Exception:
             return [], []
 
-    def decode_file(self, chunks: List[bytes], available_indices: List[int], 
+    def decode_file(self, chunks: List[bytes], available_indices: List[int],
                    original_size: int, output_path: str) -> bool:
         decoded_data = self.decode(chunks, available_indices, original_size)
         if decoded_data is None:
@@ -97,17 +158,16 @@ class RSCodec:
         except Exception:
             return False
 
-    def repair_chunks(self, available_chunks: List[bytes], 
+    def repair_chunks(self, available_chunks: List[bytes],
                      available_indices: List[int]) -> List[bytes]:
         if len(available_chunks) < self.k:
             return []
 
         try:
-            decoded_data = self.decode(available_chunks, available_indices, 
-                                     len(available_chunks[0]) * self.k)
-            if decoded_data is None:
+            data_shards = self.decode_stripe(dict(zip(available_indices, available_chunks)))
+            if data_shards is None:
                 return []
 
-            return self.encode(decoded_data, len(available_chunks[0]))
+            return [shard.tobytes() for shard in self.encode_stripes(data_shards[None])[0]]
         except Exception:
             return []
@@ -1,4 +1,7 @@
 from .RSCodec import RSCodec
 from .ChunkValidator import ChunkValidator
+from .ParallelCodec import ParallelCodec
+from .MerkleTree import MerkleTree
+from .Manifest import Manifest
 
-__all__ = ['RSCodec', 'ChunkValidator']
+__all__ = ['RSCodec', 'ChunkValidator', 'ParallelCodec', 'MerkleTree', 'Manifest']
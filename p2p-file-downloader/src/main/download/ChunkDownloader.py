@@ -1,65 +1,352 @@
 import aiohttp
 import asyncio
-from typing import List, Dict, Optional, Tuple
+import re
+from typing import Callable, List, Dict, Optional, Tuple
 import time
+from .ChunkScheduler import ChunkScheduler
+from .ChunkWriter import ChunkWriter
+from ..codec.ChunkValidator import ChunkValidator
+from ..codec.Manifest import BlockVerifier, Manifest
+from ..network.Transport import Transport
+
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
 
 
 class ChunkDownloader:
-    def __init__(self, timeout: int = 30, max_retries: int = 3):
+    def __init__(self, timeout: int = 30, max_retries: int = 3, read_size: int = 64 * 1024,
+                 chunk_validator: Optional[ChunkValidator] = None, bandwidth_manager=None,
+                 transport: Optional[Transport] = None):
         self.timeout = timeout
         self.max_retries = max_retries
+        self.read_size = read_size
+        self.chunk_validator = chunk_validator or ChunkValidator()
+        self.repaired_blocks = 0
+        # 限速器：每读到一段数据就从全局、下载任务、对端三级令牌桶取令牌
+        self.bandwidth_manager = bandwidth_manager
+        # 传入的共享传输层由调用方负责关闭，未传入时自己创建并在 close 时关闭
+        self.transport = transport or Transport()
+        self.owns_transport = transport is None
         self.session = None
+        # 记录忽略 Range 请求的源，之后对这些源只走整流下载
+        self.range_unsupported_urls = set()
+        # 每个源从发出请求到收到响应头的时间（EWMA），近似为往返时延
+        self.source_rtt = {}
+        self.rtt_alpha = 0.3
+        # 可选的 PeerSelector：调度器把每次传输的结果报给它，跨下载任务积累各源的评分
+        self.peer_selector = None
 
     async def initialize(self):
-        if self.session is None:
-            self.session = aiohttp.ClientSession()
+        self.session = await self.transport.start()
 
     async def close(self):
-        if self.session:
-            await self.session.close()
-            self.session = None
+        if self.owns_transport:
+            await self.transport.close()
+        self.session = None
+
+    def _client_timeout(self) -> aiohttp.ClientTimeout:
+        # 大块数据可能需要较长时间，只限制连接和单次读取的等待时间
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+
+    def record_rtt(self, url: str, sample: float):
+        rtt = self.source_rtt.get(url)
+        self.source_rtt[url] = sample if rtt is None else rtt + self.rtt_alpha * (sample - rtt)
+
+    @staticmethod
+    def parse_content_range(header: Optional[str]) -> Optional[Tuple[int, int, Optional[int]]]:
+        if not header:
+            return None
+        match = CONTENT_RANGE_PATTERN.match(header.strip())
+        if not match:
+            return None
+        total = None if match.group(3) == '*' else int(match.group(3))
+        return int(match.group(1)), int(match.group(2)), total
+
+    def _new_verifier(self, start_byte: int, expected_hash: Optional[str] = None,
+                      manifest: Optional[Manifest] = None):
+        # 有清单时按小块校验，否则按整块哈希校验；数据边接收边计算
+        if manifest is not None:
+            return manifest.verifier(start_byte)
+        if expected_hash:
+            return self.chunk_validator.new_hasher(expected_hash)
+        return None
+
+    def _verifier_passed(self, verifier, expected_hash: Optional[str] = None) -> bool:
+        if verifier is None:
+            return True
+        if isinstance(verifier, BlockVerifier):
+            return not verifier.finish()
+        return self.chunk_validator.hash_matches(verifier, expected_hash)
+
+    async def _throttle(self, nbytes: int, url: str, download_id: Optional[str] = None):
+        if self.bandwidth_manager is not None:
+            await self.bandwidth_manager.consume(nbytes, download_id, url)
+
+    async def _read_body(self, response: aiohttp.ClientResponse, expected_size: Optional[int] = None,
+                         verifier=None, download_id: Optional[str] = None,
+                         buffer: Optional[bytearray] = None) -> bytearray:
+        # 传入 buffer 时接在已有数据后面，调用方在读取被取消时仍能拿到已收到的部分
+        buffer = bytearray() if buffer is None else buffer
+        async for piece in response.content.iter_chunked(self.read_size):
+            await self._throttle(len(piece), str(response.url), download_id)
+            buffer.extend(piece)
+            if expected_size is not None and len(buffer) > expected_size:
+                raise ValueError(f"Received more than {expected_size} bytes")
+            if verifier is not None:
+                verifier.update(piece)
+        return buffer
+
+    async def _repair_block(self, url: str, manifest: Manifest, block: int,
+                            chunk_data: bytearray, start_byte: int, download_id: Optional[str] = None):
+        # 只重新获取校验失败的小块并替换到缓冲区中，不必重下整个块
+        block_start, block_end = manifest.block_range(block)
+        headers = {'Range': f'bytes={block_start}-{block_end}', 'Accept-Encoding': 'identity'}
+        async with self.session.get(url, headers=headers, timeout=self._client_timeout()) as response:
+            if response.status != 206:
+                raise ValueError(f"Block {block} re-fetch failed, status: {response.status}")
+            data = await self._read_body(response, block_end - block_start + 1, download_id=download_id)
+        if not manifest.verify_block(block, bytes(data)):
+            raise ValueError(f"Block {block} hash mismatch")
+        chunk_data[block_start - start_byte:block_end - start_byte + 1] = data
+        self.repaired_blocks += 1
+        print(f"Re-fetched corrupted block {block} from {url}")
+
+    async def _verify_body(self, url: str, chunk_data: bytearray, start_byte: int, verifier,
+                           expected_hash: Optional[str] = None, download_id: Optional[str] = None) -> bytes:
+        if isinstance(verifier, BlockVerifier):
+            for block in verifier.finish():
+                await self._repair_block(url, verifier.manifest, block, chunk_data, start_byte, download_id)
+        elif not self._verifier_passed(verifier, expected_hash):
+            raise ValueError("Chunk hash mismatch")
+        return bytes(chunk_data)
 
     async def download_chunk(self, url: str, chunk_id: int,
-                             start_byte: int = None, end_byte: int = None) -> Tuple[int, Optional[bytes]]:
+                             start_byte: int = None, end_byte: int = None,
+                             expected_hash: Optional[str] = None,
+                             manifest: Optional[Manifest] = None,
+                             download_id: Optional[str] = None,
+                             prefix: Optional[bytes] = None,
+                             on_partial: Optional[Callable[[int, int, bytes], None]] = None
+                             ) -> Tuple[int, Optional[bytes]]:
+        # prefix 是上次中断时已保存的块开头部分，只请求剩余字节，校验仍覆盖整个块；
+        # 请求被取消时把已收到的部分（含 prefix）交给 on_partial(块号, 起始偏移, 数据)
         headers = {}
-        if start_byte is not None and end_byte is not None:
-            headers['Range'] = f'bytes={start_byte}-{end_byte}'
+        expected_size = None
+        is_range_request = start_byte is not None and end_byte is not None
+        prefix = prefix if is_range_request and prefix and len(prefix) <= end_byte - start_byte else b''
+        if is_range_request:
+            # Range 作用于编码后的内容，禁止压缩才能保证偏移正确
+            headers['Accept-Encoding'] = 'identity'
+            expected_size = end_byte - start_byte + 1
 
+        chunk_data = bytearray()
         retry_count = 0
         while retry_count < self.max_retries:
+            if is_range_request:
+                headers['Range'] = f'bytes={start_byte + len(prefix)}-{end_byte}'
+            chunk_data = bytearray(prefix)
             try:
-                async with self.session.get(url, headers=headers, timeout=self.timeout) as response:
-                    if response.status in [200, 206]:
-                        chunk_data = await response.read()
-                        return chunk_id, chunk_data
+                request_time = time.time()
+                async with self.session.get(url, headers=headers, timeout=self._client_timeout()) as response:
+                    self.record_rtt(url, time.time() - request_time)
+                    if is_range_request and response.status == 200:
+                        # 服务器忽略了 Range，不读取响应体，交给整流下载处理
+                        self.range_unsupported_urls.add(url)
+                        return chunk_id, None
+                    elif response.status == 206:
+                        content_range = self.parse_content_range(response.headers.get('Content-Range'))
+                        if is_range_request and (content_range is None or
+                                                 content_range[0] != start_byte + len(prefix) or
+                                                 content_range[1] != end_byte):
+                            raise ValueError(f"Unexpected Content-Range: {response.headers.get('Content-Range')}")
+                        offset = content_range[0] - len(prefix) if content_range else 0
+                        verifier = self._new_verifier(offset, expected_hash, manifest)
+                        if verifier is not None and prefix:
+                            verifier.update(prefix)
+                        await self._read_body(response, expected_size, verifier, download_id, chunk_data)
+                        if expected_size is not None and len(chunk_data) != expected_size:
+                            raise ValueError(f"Short read: {len(chunk_data)}/{expected_size} bytes")
+                        return chunk_id, await self._verify_body(url, chunk_data, offset, verifier,
+                                                                 expected_hash, download_id)
+                    elif response.status == 200:
+                        verifier = self._new_verifier(0, expected_hash, manifest)
+                        chunk_data = await self._read_body(response, verifier=verifier, download_id=download_id)
+                        if not self._verifier_passed(verifier, expected_hash):
+                            raise ValueError("Chunk hash mismatch")
+                        return chunk_id, bytes(chunk_data)
                     elif response.status == 416:  # Range Not Satisfiable
                         return chunk_id, None
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status)
+            except asyncio.CancelledError:
+                # 暂停或取消：退出 async with 时连接立即交还连接池，已收到的部分留给续传
+                if on_partial is not None and is_range_request and len(prefix) < len(chunk_data) < expected_size:
+                    on_partial(chunk_id, start_byte, bytes(chunk_data))
+                raise
             except Exception as e:
                 retry_count += 1
+                # 失败可能是保存的前缀有误，重试时请求整个块
+                prefix = b''
                 if retry_count == self.max_retries:
                     print(f"Download failed for chunk {chunk_id}: {str(e)}")
+                    break
                 await asyncio.sleep(1)  # 失败后等待1秒再重试
 
         return chunk_id, None
 
-    async def download_chunks(self, chunk_urls: Dict[int, List[str]],
-                              progress_callback=None) -> Dict[int, bytes]:
-        results = {}
-        failed_chunks = set()
+    async def _split_body(self, response: aiohttp.ClientResponse, url: str, chunks: Dict[int, Dict],
+                          boundaries: List[Tuple[int, int, int]], offset: int, on_chunk: Callable,
+                          download_id: Optional[str] = None, on_partial: Optional[Callable] = None):
+        # 把响应体按块边界切开，每个块单独流式校验，块结束时调用 on_chunk(块号, 起始偏移, 数据, 是否通过)；
+        # 被取消时把当前块已收到的部分交给 on_partial(块号, 起始偏移, 数据)
+        index = 0
+        buffer = bytearray()
+        verifier = None
+        try:
+            async for piece in response.content.iter_chunked(self.read_size):
+                await self._throttle(len(piece), url, download_id)
+                view = memoryview(piece)
+                while view and index < len(boundaries):
+                    start, end, chunk_id = boundaries[index]
+                    if offset + len(view) <= start:
+                        offset += len(view)
+                        break
+                    if offset < start:
+                        view = view[start - offset:]
+                        offset = start
+
+                    take = min(len(view), end + 1 - offset)
+                    expected_hash = chunks[chunk_id].get('hash')
+                    if verifier is None:
+                        verifier = self._new_verifier(offset, expected_hash, chunks[chunk_id].get('manifest'))
+                    if verifier is not None:
+                        verifier.update(view[:take])
+                    buffer.extend(view[:take])
+                    view = view[take:]
+                    offset += take
+
+                    if offset == end + 1:
+                        await on_chunk(chunk_id, start, bytes(buffer),
+                                       self._verifier_passed(verifier, expected_hash))
+                        buffer.clear()
+                        verifier = None
+                        index += 1
+                if index >= len(boundaries):
+                    break
+        except asyncio.CancelledError:
+            if on_partial is not None and buffer and index < len(boundaries):
+                start, _, chunk_id = boundaries[index]
+                on_partial(chunk_id, start, bytes(buffer))
+            raise
+
+    async def download_range(self, url: str, chunks: Dict[int, Dict], on_chunk: Callable,
+                             download_id: Optional[str] = None, on_partial: Optional[Callable] = None) -> bool:
+        # 一次 Range 请求取回多个相邻的块，每个块到齐并校验后立即交给 on_chunk，内存只占一个块
+        boundaries = sorted((chunk['start'], chunk['end'], chunk_id) for chunk_id, chunk in chunks.items())
+        start_byte, end_byte = boundaries[0][0], boundaries[-1][1]
+        headers = {'Range': f'bytes={start_byte}-{end_byte}', 'Accept-Encoding': 'identity'}
+        try:
+            request_time = time.time()
+            async with self.session.get(url, headers=headers, timeout=self._client_timeout()) as response:
+                self.record_rtt(url, time.time() - request_time)
+                if response.status == 200:
+                    self.range_unsupported_urls.add(url)
+                    return False
+                if response.status != 206:
+                    raise ValueError(f"Unexpected status: {response.status}")
+                content_range = self.parse_content_range(response.headers.get('Content-Range'))
+                if content_range is None or content_range[:2] != (start_byte, end_byte):
+                    raise ValueError(f"Unexpected Content-Range: {response.headers.get('Content-Range')}")
+                await self._split_body(response, url, chunks, boundaries, start_byte, on_chunk, download_id,
+                                       on_partial)
+            return True
+        except Exception as e:
+            print(f"Range download failed for bytes {start_byte}-{end_byte}: {str(e)}")
+            return False
+
+    async def download_stream(self, url: str, chunks: Dict[int, Dict],
+                              progress_callback=None,
+                              chunk_writer: Optional[ChunkWriter] = None,
+                              results: Optional[Dict[int, bytes]] = None,
+                              chunk_callback: Optional[Callable[[int], None]] = None) -> Dict[int, bytes]:
+        # 单连接顺序下载整个文件，按块边界切分后写盘或保存
+        results = {} if results is None else results
+        boundaries = sorted((chunk['start'], chunk['end'], chunk_id) for chunk_id, chunk in chunks.items())
+        if not boundaries:
+            return results
 
-        async def download_with_progress(chunk_id: int, url: str):
-            result = await self.download_chunk(url, chunk_id)
-            if result[1] is not None:
-                results[result[0]] = result[1]
+        total_chunks = len(chunks) + len([chunk_id for chunk_id in results if chunk_id not in chunks])
+
+        async def on_chunk(chunk_id: int, start: int, chunk_data: bytes, verified: bool):
+            if not verified:
+                # 校验失败的块不写入，保持缺失状态留给下次续传
+                print(f"Chunk {chunk_id} failed hash verification")
+            elif chunk_id not in results:
+                await self.store_chunk(chunk_id, start, chunk_data, chunk_writer, results, chunk_callback)
                 if progress_callback:
-                    await progress_callback(len(results) / len(chunk_urls))
-            else:
-                failed_chunks.add(chunk_id)
+                    await progress_callback(len(results) / total_chunks, len(chunk_data))
+
+        try:
+            async with self.session.get(url, timeout=self._client_timeout()) as response:
+                if response.status != 200:
+                    print(f"Stream download failed, status: {response.status}")
+                    return results
+                await self._split_body(response, url, chunks, boundaries, 0, on_chunk,
+                                       chunks[boundaries[0][2]].get('download_id'))
+        except Exception as e:
+            print(f"Stream download failed: {str(e)}")
+
+        return results
+
+    async def store_chunk(self, chunk_id: int, offset: int, chunk_data: bytes,
+                           chunk_writer: Optional[ChunkWriter], results: Dict[int, bytes],
+                          chunk_callback: Optional[Callable[[int], None]] = None) -> int:
+        chunk_length = len(chunk_data)
+        if chunk_writer is not None:
+            await chunk_writer.write(offset, chunk_data)
+            results[chunk_id] = chunk_length
+        else:
+            results[chunk_id] = chunk_data
+        if chunk_callback:
+            chunk_callback(chunk_id)
+        return chunk_length
+
+    async def download_chunks(self, chunks: Dict[int, Dict],
+                              progress_callback=None,
+                              chunk_writer: Optional[ChunkWriter] = None,
+                              max_concurrency: int = 3,
+                              chunk_callback: Optional[Callable[[int], None]] = None,
+                              endgame_threshold: int = 0,
+                              endgame_max_duplicates: int = 0,
+                              max_request_bytes: int = 0,
+                              availability=None,
+                              concurrency_limit: Optional[Callable[[], int]] = None,
+                              partial_callback: Optional[Callable[[int, int, bytes], None]] = None
+                              ) -> Dict[int, bytes]:
+        # chunks: chunk_id -> {'urls': [...], 'start': 起始字节, 'end': 结束字节（含）,
+        #                     'hash': 可选，块的哈希值，下载时流式校验,
+        #                     'manifest': 可选，Merkle 清单，按小块校验并只重下损坏的小块,
+        #                     'download_id': 可选，所属下载任务，用于按任务限速,
+        #                     'prefix': 可选，上次中断时已保存的块开头部分，只请求剩余字节}
+        # 传入 chunk_writer 时数据块到达后立即写盘，结果中只保留块大小
+        # chunk_callback 在每个块写入完成后以块号调用
+        # max_request_bytes > 0 时按各源的带宽时延积把相邻的块合并成一次请求
+        # availability 为 PieceAvailability 时按最稀有优先派发，各块的 urls 取索引里的持有者
+        # 下载被取消时，未完成的块已收到的部分以 (块号, 起始偏移, 数据) 交给 partial_callback
+        scheduler = ChunkScheduler(self, max_concurrency,
+                                   endgame_threshold=endgame_threshold,
+                                   endgame_max_duplicates=endgame_max_duplicates,
+                                   max_request_bytes=max_request_bytes,
+                                   availability=availability,
+                                   concurrency_limit=concurrency_limit)
+        results = await scheduler.run(chunks, progress_callback, chunk_writer,
+                                      chunk_callback=chunk_callback, partial_callback=partial_callback)
 
-        tasks = [
-            asyncio.create_task(download_with_progress(chunk_id, urls[0]))
-            for chunk_id, urls in chunk_urls.items() if urls
-        ]
+        if scheduler.fallback_urls:
+            remaining = {chunk_id: chunk for chunk_id, chunk in chunks.items() if chunk_id not in results}
+            print(f"Server ignored Range requests, falling back to a single stream "
+                  f"for {len(remaining)} chunks")
+            await self.download_stream(next(iter(scheduler.fallback_urls)), remaining,
+                                       progress_callback, chunk_writer, results, chunk_callback)
 
-        await asyncio.gather(*tasks)
-        return results
\ No newline at end of file
+        return results
@@ -0,0 +1,537 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class ChunkScheduler:
+    def __init__(self, chunk_downloader, max_workers: int = 3, queue_size: int = 0,
+                 throughput_alpha: float = 0.3, endgame_threshold: int = 0,
+                 endgame_max_duplicates: int = 0, max_request_bytes: int = 0,
+                 request_rtts: float = 8.0, min_request_seconds: float = 0.25,
+                 max_request_seconds: float = 2.0, availability=None,
+                 concurrency_limit: Optional[Callable[[], int]] = None, max_requeues: int = 1):
+        self.chunk_downloader = chunk_downloader
+        # max_workers 是每个下载源的并发上限，工作协程总数随源数增加
+        self.max_workers = max(1, max_workers)
+        # 多个下载任务共享连接预算时，concurrency_limit 返回本任务当前分到的每源并发数，
+        # 预算重新分配后立即生效
+        self.concurrency_limit = concurrency_limit
+        self.queue_size = queue_size
+        self.throughput_alpha = throughput_alpha
+        # 剩余块数不超过 endgame_threshold 时进入收尾阶段，
+        # 空闲协程向其他源重复请求未完成的块，每块最多 endgame_max_duplicates 个副本
+        self.endgame_threshold = endgame_threshold
+        self.endgame_max_duplicates = endgame_max_duplicates
+        # 自适应请求大小：块仍是校验和续传的固定网格，一次请求可以合并多个相邻的块。
+        # 目标大小取 request_rtts 倍带宽时延积与 min_request_seconds 秒传输量中的较大者，
+        # 再受 max_request_seconds 秒传输量和 max_request_bytes 限制；max_request_bytes 为 0 时不合并
+        self.max_request_bytes = max_request_bytes
+        self.request_rtts = request_rtts
+        self.min_request_seconds = min_request_seconds
+        self.max_request_seconds = max_request_seconds
+        # 可选的块可用性索引：给出时按最稀有优先的顺序派发块，
+        # 每个块派发时按索引里当前的持有者选源，离开的对端不再被使用；
+        # 所有源都失败的块放回索引，最多重新派发 max_requeues 次（届时持有者可能已经变化）
+        self.availability = availability
+        self.max_requeues = max_requeues
+        self.requeue_counts = {}
+        self.dispatching = set()
+        self._dispatch_changed = None
+        self.claimed_chunks = set()
+        self.range_tasks = set()
+        self.total_chunks = 0
+        self.worker_count = 1
+        self.inflight_chunks = {}
+        self.duplicate_counts = {}
+        self.storing_chunks = set()
+        self.results = {}
+        self.failed_chunks = set()
+        self.fallback_urls = set()
+        self.chunk_callback = None
+        self.partial_callback = None
+        self.source_stats = {}
+        self._slot_released = None
+
+    def _get_source_stats(self, url: str) -> Dict:
+        if url not in self.source_stats:
+            # 以对端评分里之前任务测得的吞吐量作为初值
+            peer_selector = self.chunk_downloader.peer_selector
+            self.source_stats[url] = {
+                'throughput': peer_selector.get_speed(url) if peer_selector else 0.0,
+                'inflight': 0,
+                'bytes': 0,
+                'failures': 0,
+                'request_size': 0
+            }
+        return self.source_stats[url]
+
+    def record_transfer(self, url: str, size: int, elapsed: float):
+        stats = self._get_source_stats(url)
+        stats['bytes'] += size
+        # 去掉等待响应头的时间，得到数据传输阶段的吞吐量
+        rtt = self.chunk_downloader.source_rtt.get(url, 0.0)
+        elapsed = max(elapsed - rtt, elapsed * 0.1)
+        if elapsed <= 0:
+            return
+        peer_selector = self.chunk_downloader.peer_selector
+        if peer_selector is not None:
+            peer_selector.record_transfer(url, size, elapsed, rtt or None)
+        sample = size / elapsed
+        if stats['throughput'] == 0:
+            stats['throughput'] = sample
+        else:
+            stats['throughput'] += self.throughput_alpha * (sample - stats['throughput'])
+
+    def record_failure(self, url: str):
+        self._get_source_stats(url)['failures'] += 1
+        if self.chunk_downloader.peer_selector is not None:
+            self.chunk_downloader.peer_selector.record_failure(url)
+
+    def pick_source(self, urls: List[str], exclude=()) -> Optional[str]:
+        # 按 吞吐量 / (在途请求数 + 1) 选择源，快的源分到更多块；
+        # 尚未测速的源按当前最快的源估计，保证每个源都有机会被测到；最近失败过的源按衰减后的失败次数降权
+        known = [stats['throughput'] for stats in self.source_stats.values() if stats['throughput'] > 0]
+        default_throughput = max(known) if known else 1.0
+        peer_selector = self.chunk_downloader.peer_selector
+        limit = self.max_workers
+        if self.concurrency_limit is not None:
+            limit = max(1, min(limit, self.concurrency_limit()))
+
+        best_url = None
+        best_score = -1.0
+        for url in urls:
+            if url in exclude or url in self.chunk_downloader.range_unsupported_urls:
+                continue
+            stats = self._get_source_stats(url)
+            if stats['inflight'] >= limit:
+                continue
+            throughput = stats['throughput'] or default_throughput
+            score = throughput / (stats['inflight'] + 1)
+            if peer_selector is not None:
+                score /= 1 + peer_selector.get_failures(url)
+            if score > best_score:
+                best_url = url
+                best_score = score
+        return best_url
+
+    def request_size(self, url: str, chunk_length: int) -> int:
+        # 按该源的带宽时延积调整请求大小，未测出吞吐量和时延之前只请求一个块
+        stats = self._get_source_stats(url)
+        rtt = self.chunk_downloader.source_rtt.get(url)
+        throughput = stats['throughput']
+        if not self.max_request_bytes or not throughput or rtt is None:
+            return chunk_length
+        target = max(throughput * rtt * self.request_rtts, throughput * self.min_request_seconds)
+        target = min(target, throughput * self.max_request_seconds, self.max_request_bytes)
+        stats['request_size'] = int(max(target, chunk_length))
+        return stats['request_size']
+
+    def _coalesce(self, chunk_id: int, chunks: Dict[int, Dict], url: str) -> List[int]:
+        # 从 chunk_id 开始向后合并字节连续、同一源可用、尚未被领取的块；
+        # 有可用性索引时只合并还在索引里或已入队但没有协程领取的块，索引里的块随即取走，不会再派发
+        chunk = chunks[chunk_id]
+        if chunk.get('prefix'):
+            # 有续传前缀的块单独请求剩余字节
+            return [chunk_id]
+        size = chunk['end'] - chunk['start'] + 1
+        limit = self.request_size(url, size)
+        # 剩余块不多时缩小请求，避免少数大请求拖长尾部
+        max_chunks = max(1, (self.total_chunks - len(self.results)) // self.worker_count)
+        chunk_ids = [chunk_id]
+        end = chunk['end']
+        next_id = chunk_id + 1
+        while len(chunk_ids) < max_chunks:
+            next_chunk = chunks.get(next_id)
+            if (next_chunk is None or next_chunk['start'] != end + 1 or url not in next_chunk['urls'] or
+                    next_id in self.claimed_chunks or next_id in self.inflight_chunks or self._is_done(next_id) or
+                    next_chunk.get('prefix')):
+                break
+            if self.availability is not None and not self.availability.has(url, next_id):
+                break
+            length = next_chunk['end'] - next_chunk['start'] + 1
+            if size + length > limit:
+                break
+            if self.availability is not None and not (next_id in self.dispatching or
+                                                      self.availability.take(next_id)):
+                break
+            chunk_ids.append(next_id)
+            size += length
+            end = next_chunk['end']
+            next_id += 1
+        return chunk_ids
+
+    def _has_candidates(self, urls: List[str], exclude=()) -> bool:
+        return any(url not in exclude and url not in self.chunk_downloader.range_unsupported_urls
+                   for url in urls)
+
+    async def _dispatch_order(self, chunks: Dict[int, Dict]):
+        if self.availability is None:
+            for chunk_id, chunk in chunks.items():
+                if chunk['urls']:
+                    yield chunk_id
+            return
+        # 队列有界，每次入队前才重新挑选，选块时用的是最新的可用性；
+        # 取走的块离开索引的桶，每次挑选不随块数增长
+        while True:
+            chunk_id = self.availability.take_rarest()
+            if chunk_id is None:
+                if not self.dispatching:
+                    return
+                # 还有派发出去的块没有结果，它们失败后可能放回索引
+                self._dispatch_changed.clear()
+                await self._dispatch_changed.wait()
+                continue
+            if chunk_id not in chunks:
+                # 不在本次下载范围内的块由调用方处理
+                continue
+            self.dispatching.add(chunk_id)
+            chunks[chunk_id]['urls'] = self.availability.holders_of(chunk_id)
+            yield chunk_id
+
+    def _dispatch_done(self, chunk_id: int, ok: bool):
+        if chunk_id not in self.dispatching:
+            return
+        self.dispatching.discard(chunk_id)
+        if not ok and not self.fallback_urls and self.requeue_counts.get(chunk_id, 0) < self.max_requeues:
+            self.requeue_counts[chunk_id] = self.requeue_counts.get(chunk_id, 0) + 1
+            self.failed_chunks.discard(chunk_id)
+            self.claimed_chunks.discard(chunk_id)
+            self.availability.requeue(chunk_id)
+        self._dispatch_changed.set()
+
+    def _stored(self, chunk_id: int):
+        if self.availability is not None:
+            self.availability.mark_complete(chunk_id)
+
+    async def run(self, chunks: Dict[int, Dict], progress_callback=None,
+                  chunk_writer=None, results: Optional[Dict[int, bytes]] = None,
+                  chunk_callback: Optional[Callable[[int], None]] = None,
+                  partial_callback: Optional[Callable[[int, int, bytes], None]] = None) -> Dict[int, bytes]:
+        self.chunk_callback = chunk_callback
+        self.partial_callback = partial_callback
+        self.results = {} if results is None else results
+        self.failed_chunks = set()
+        self.fallback_urls = set()
+        self.inflight_chunks = {}
+        self.duplicate_counts = {}
+        self.storing_chunks = set()
+        self.claimed_chunks = set()
+        self.range_tasks = set()
+        self.requeue_counts = {}
+        self.dispatching = set()
+        self._dispatch_changed = asyncio.Event()
+        self._slot_released = asyncio.Condition()
+
+        sources = set()
+        for chunk in chunks.values():
+            sources.update(chunk['urls'])
+        worker_count = self.max_workers * max(1, len(sources))
+        self.worker_count = worker_count
+        self.total_chunks = len(chunks)
+
+        # 有界队列：生产者最多领先工作协程 queue_size 个块
+        queue = asyncio.Queue(maxsize=self.queue_size or worker_count * 2)
+        stop_event = asyncio.Event()
+        total_chunks = len(chunks)
+
+        async def produce():
+            async for chunk_id in self._dispatch_order(chunks):
+                if stop_event.is_set():
+                    break
+                await queue.put(chunk_id)
+            # 每个工作协程一个结束标记
+            for _ in range(worker_count):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                chunk_id = await queue.get()
+                owned = False
+                try:
+                    if chunk_id is None:
+                        if not stop_event.is_set():
+                            await self._run_endgame(chunks, total_chunks,
+                                                    progress_callback, chunk_writer)
+                        return
+                    # 已被合并请求领取的块跳过，由领取它的协程报告结果
+                    if chunk_id in self.claimed_chunks:
+                        continue
+                    owned = True
+                    # 切换到整流下载后只排空队列，不再发起新请求
+                    if stop_event.is_set():
+                        continue
+                    self.claimed_chunks.add(chunk_id)
+                    ok = await self._fetch(chunk_id, chunks, total_chunks, progress_callback, chunk_writer)
+                    if not ok and self.fallback_urls:
+                        stop_event.set()
+                    if self.availability is not None:
+                        self._dispatch_done(chunk_id, ok)
+                finally:
+                    if owned and self.availability is not None:
+                        # 跳过或取消的块也要让生产者知道它已经有了结果
+                        self._dispatch_done(chunk_id, True)
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(produce())]
+        tasks.extend(asyncio.create_task(work()) for _ in range(worker_count))
+        cancelled = False
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # 被取消时 gather 已经取消了所有工作协程，不再重复取消，
+            # 让它们在 finally 里等到请求真正结束、已收到的部分保存完再返回
+            if not cancelled:
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.availability is not None:
+                # 没有下载到的块放回索引，下次续传或对端更新后还能再派发
+                for chunk_id in list(self.availability.in_flight):
+                    if chunk_id in chunks and not self._is_done(chunk_id):
+                        self.availability.requeue(chunk_id)
+
+        return self.results
+
+    async def _acquire_source(self, urls: List[str], tried) -> Optional[str]:
+        async with self._slot_released:
+            while True:
+                if not self._has_candidates(urls, tried):
+                    return None
+                url = self.pick_source(urls, tried)
+                if url is not None:
+                    self._get_source_stats(url)['inflight'] += 1
+                    return url
+                await self._slot_released.wait()
+
+    async def _release_source(self, url: str):
+        async with self._slot_released:
+            self._get_source_stats(url)['inflight'] -= 1
+            self._slot_released.notify_all()
+
+    def _is_done(self, chunk_id: int) -> bool:
+        return chunk_id in self.results or chunk_id in self.storing_chunks
+
+    def _on_partial(self, chunk_id: int, offset: int, data: bytes):
+        # 被其他副本抢先完成而取消的请求不保存部分数据
+        if self.partial_callback is not None and not self._is_done(chunk_id):
+            self.partial_callback(chunk_id, offset, data)
+
+    @staticmethod
+    async def _finish(task: asyncio.Task):
+        # 取消在途请求并等它退出：连接交还连接池、带宽令牌不再被占用之后才返回
+        if not task.done():
+            task.cancel()
+        await asyncio.wait([task])
+
+    def _pick_duplicate(self, chunks: Dict[int, Dict]) -> Optional[tuple]:
+        # 选择副本最少的在途块，优先换一个还没在下载它的源
+        best = None
+        for chunk_id, attempts in self.inflight_chunks.items():
+            if not attempts or self._is_done(chunk_id):
+                continue
+            # 按累计发出的副本数限制，副本失败后不会无限重发
+            if self.duplicate_counts.get(chunk_id, 0) >= self.endgame_max_duplicates:
+                continue
+            if best is None or len(attempts) < len(self.inflight_chunks[best]):
+                best = chunk_id
+        if best is None:
+            return None
+
+        urls = chunks[best]['urls']
+        active_urls = set(self.inflight_chunks[best].values())
+        url = self.pick_source(urls, active_urls)
+        if url is None and not self._has_candidates(urls, active_urls):
+            # 只有一个源时换一条新连接重试，绕开卡住的连接
+            url = self.pick_source(urls)
+        if url is None:
+            return None
+        return best, url
+
+    async def _run_endgame(self, chunks: Dict[int, Dict], total_chunks: int,
+                           progress_callback=None, chunk_writer=None):
+        if self.endgame_threshold <= 0 or self.endgame_max_duplicates <= 0:
+            return
+
+        while True:
+            async with self._slot_released:
+                while True:
+                    if not any(not self._is_done(chunk_id) and attempts
+                               for chunk_id, attempts in self.inflight_chunks.items()):
+                        return
+                    candidate = None
+                    if total_chunks - len(self.results) <= self.endgame_threshold:
+                        candidate = self._pick_duplicate(chunks)
+                    if candidate is not None:
+                        break
+                    await self._slot_released.wait()
+
+                chunk_id, url = candidate
+                self.duplicate_counts[chunk_id] = self.duplicate_counts.get(chunk_id, 0) + 1
+                self._get_source_stats(url)['inflight'] += 1
+
+            await self._attempt(chunk_id, chunks[chunk_id], url, total_chunks,
+                                progress_callback, chunk_writer)
+
+    async def _attempt(self, chunk_id: int, chunk: Dict, url: str, total_chunks: int,
+                       progress_callback=None, chunk_writer=None) -> bool:
+        # 调用前已占用 url 的并发槽位，这里负责释放
+        downloader = self.chunk_downloader
+        # 有续传前缀时收尾副本也只请求剩余字节
+        task = asyncio.create_task(
+            downloader.download_chunk(url, chunk_id, chunk['start'], chunk['end'],
+                                      chunk.get('hash'), chunk.get('manifest'), chunk.get('download_id'),
+                                      chunk.get('prefix'), self._on_partial))
+        attempts = self.inflight_chunks.setdefault(chunk_id, {})
+        attempts[task] = url
+        start_time = time.time()
+        try:
+            await asyncio.wait([task])
+        finally:
+            await self._finish(task)
+            attempts.pop(task, None)
+            if not attempts and self.inflight_chunks.get(chunk_id) is attempts:
+                del self.inflight_chunks[chunk_id]
+            await self._release_source(url)
+
+        if task.cancelled():
+            # 被其他副本抢先完成而取消
+            return False
+        _, chunk_data = task.result()
+        if chunk_data is None:
+            if url not in downloader.range_unsupported_urls:
+                self.record_failure(url)
+            # 失败可能是保存的前缀有误，之后改为请求整个块
+            chunk.pop('prefix', None)
+            return False
+
+        self.record_transfer(url, len(chunk_data), time.time() - start_time)
+        if self._is_done(chunk_id):
+            return True
+
+        # 第一个完成的副本胜出，立即取消其余重复请求（合并请求还包含其他块，不取消）
+        self.storing_chunks.add(chunk_id)
+        for other_task in list(self.inflight_chunks.get(chunk_id, {})):
+            if other_task not in self.range_tasks:
+                other_task.cancel()
+
+        # 写盘后立即释放缓冲区，内存占用只与在途块数有关
+        try:
+            chunk_length = await downloader.store_chunk(chunk_id, chunk['start'], chunk_data,
+                                                        chunk_writer, self.results, self.chunk_callback)
+            self._stored(chunk_id)
+        finally:
+            self.storing_chunks.discard(chunk_id)
+        chunk_data = None
+        chunk.pop('prefix', None)
+        if progress_callback:
+            await progress_callback(len(self.results) / total_chunks, chunk_length)
+        return True
+
+    async def _attempt_range(self, chunk_ids: List[int], chunks: Dict[int, Dict], url: str,
+                             total_chunks: int, progress_callback=None, chunk_writer=None) -> bool:
+        # 一次请求多个相邻块，每个块到齐校验后立即写盘；调用前已占用 url 的并发槽位
+        downloader = self.chunk_downloader
+        group = {chunk_id: chunks[chunk_id] for chunk_id in chunk_ids}
+        received = 0
+
+        async def on_chunk(chunk_id: int, offset: int, chunk_data: bytes, verified: bool):
+            nonlocal received
+            received += len(chunk_data)
+            if not verified:
+                print(f"Chunk {chunk_id} failed hash verification")
+                return
+            if self._is_done(chunk_id):
+                return
+            self.storing_chunks.add(chunk_id)
+            for other_task in list(self.inflight_chunks.get(chunk_id, {})):
+                if other_task not in self.range_tasks:
+                    other_task.cancel()
+            try:
+                chunk_length = await downloader.store_chunk(chunk_id, offset, chunk_data, chunk_writer,
+                                                            self.results, self.chunk_callback)
+                self._stored(chunk_id)
+            finally:
+                self.storing_chunks.discard(chunk_id)
+            if progress_callback:
+                await progress_callback(len(self.results) / total_chunks, chunk_length)
+
+        task = asyncio.create_task(downloader.download_range(
+            url, group, on_chunk, chunks[chunk_ids[0]].get('download_id'), self._on_partial))
+        self.range_tasks.add(task)
+        for chunk_id in chunk_ids:
+            self.inflight_chunks.setdefault(chunk_id, {})[task] = url
+        start_time = time.time()
+        try:
+            await asyncio.wait([task])
+        finally:
+            await self._finish(task)
+            self.range_tasks.discard(task)
+            for chunk_id in chunk_ids:
+                attempts = self.inflight_chunks.get(chunk_id)
+                if attempts is not None:
+                    attempts.pop(task, None)
+                    if not attempts:
+                        del self.inflight_chunks[chunk_id]
+            await self._release_source(url)
+
+        if task.cancelled() or not task.result():
+            if url not in downloader.range_unsupported_urls:
+                self.record_failure(url)
+            return False
+        self.record_transfer(url, received, time.time() - start_time)
+        return True
+
+    async def _fetch(self, chunk_id: int, chunks: Dict[int, Dict], total_chunks: int,
+                     progress_callback=None, chunk_writer=None, coalesce: bool = True) -> bool:
+        chunk = chunks[chunk_id]
+        tried = set()
+        leftovers = []
+
+        # 一个源失败后换下一个持有该块的源重试
+        while not self._is_done(chunk_id):
+            url = await self._acquire_source(chunk['urls'], tried)
+            if url is None:
+                duplicates = list(self.inflight_chunks.get(chunk_id, {}))
+                if duplicates:
+                    # 收尾阶段的副本还在下载，等待其结果
+                    await asyncio.wait(duplicates)
+                    continue
+                if chunk['urls'] and not self._has_candidates(chunk['urls']):
+                    self.fallback_urls.add(chunk['urls'][0])
+                else:
+                    self.failed_chunks.add(chunk_id)
+                break
+
+            chunk_ids = self._coalesce(chunk_id, chunks, url) if coalesce else [chunk_id]
+            coalesce = False
+            if len(chunk_ids) > 1:
+                # 合并请求中失败的块随后逐个重新获取
+                self.claimed_chunks.update(chunk_ids)
+                leftovers = chunk_ids[1:]
+                if self.availability is not None:
+                    # 合并进来的块与派发的块一样，结束时各自报告结果
+                    for other_id in leftovers:
+                        self.dispatching.add(other_id)
+                        chunks[other_id]['urls'] = self.availability.holders_of(other_id)
+                await self._attempt_range(chunk_ids, chunks, url, total_chunks,
+                                          progress_callback, chunk_writer)
+                continue
+
+            tried.add(url)
+            if await self._attempt(chunk_id, chunk, url, total_chunks,
+                                   progress_callback, chunk_writer):
+                break
+
+        for other_id in leftovers:
+            ok = self._is_done(other_id)
+            try:
+                if not ok and not self.fallback_urls:
+                    ok = await self._fetch(other_id, chunks, total_chunks, progress_callback, chunk_writer, False)
+            finally:
+                if self.availability is not None:
+                    # 仍然失败的块放回索引重新派发
+                    self._dispatch_done(other_id, ok)
+        return self._is_done(chunk_id)
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import threading
+from typing import Optional
+
+
+class ChunkWriter:
+    def __init__(self, output_path: str, file_size: int, chunk_size: int):
+        self.output_path = output_path
+        self.temp_path = output_path + '.part'
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.fd: Optional[int] = None
+        self.bytes_written = 0
+        # 没有 os.pwrite 的平台（Windows）需要用锁保护 seek + write
+        self._lock = threading.Lock()
+
+    def open(self):
+        if self.fd is not None:
+            return
+
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(self.temp_path, flags, 0o644)
+        self._preallocate()
+
+    async def open_async(self):
+        # 预分配整个文件可能很慢，放到线程池，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.open)
+
+    def _preallocate(self):
+        current_size = os.fstat(self.fd).st_size
+        if current_size > self.file_size:
+            os.ftruncate(self.fd, self.file_size)
+        elif current_size == self.file_size:
+            return
+
+        # 预分配磁盘空间，避免边写边扩展文件造成碎片
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, self.file_size)
+                return
+            except OSError:
+                pass
+        os.ftruncate(self.fd, self.file_size)
+
+    def write_at(self, offset: int, data: bytes) -> int:
+        if self.fd is None:
+            raise ValueError("ChunkWriter is not open")
+
+        view = memoryview(data)
+        written = 0
+        if hasattr(os, 'pwrite'):
+            while written < len(view):
+                written += os.pwrite(self.fd, view[written:], offset + written)
+        else:
+            with self._lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                while written < len(view):
+                    written += os.write(self.fd, view[written:])
+
+        self.bytes_written += written
+        return written
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        if self.fd is None:
+            raise ValueError("ChunkWriter is not open")
+
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, length, offset)
+        with self._lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, length)
+
+    def write_chunk(self, chunk_id: int, data: bytes) -> int:
+        return self.write_at(chunk_id * self.chunk_size, data)
+
+    async def write(self, offset: int, data: bytes) -> int:
+        # 磁盘写入放到线程池，避免阻塞事件循环
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.write_at, offset, data)
+
+    def flush(self):
+        if self.fd is not None:
+            os.fsync(self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def finalize(self) -> bool:
+        try:
+            self.flush()
+            self.close()
+            os.replace(self.temp_path, self.output_path)
+            return True
+        except OSError:
+            return False
@@ -1,26 +1,64 @@
 import asyncio
+import heapq
 import os
 import time
 from typing import List, Dict, Optional, Callable
 from .ChunkDownloader import ChunkDownloader
+from .PeerSelector import PeerSelector
+from .PieceAvailability import PieceAvailability
+from .ChunkWriter import ChunkWriter
+from .ResumeJournal import ResumeJournal
+from .StripeDownloader import StripeDownloader
 from ..codec.RSCodec import RSCodec
 from ..codec.ChunkValidator import ChunkValidator
+from ..codec.Manifest import Manifest
 from ..utils.FileUtils import FileUtils
 from ..utils.Config import Config
+from ..network.BandwidthManager import BandwidthManager
+from ..network.Transport import Transport
 
 
 class DownloadManager:
-    def __init__(self, k: int = 4, m: int = 2, chunk_size: int = 1024 * 1024):
+    def __init__(self, k: int = 4, m: int = 2, chunk_size: int = 1024 * 1024,
+                 bandwidth_manager: Optional[BandwidthManager] = None,
+                 transport: Optional[Transport] = None):
         self.chunk_size = chunk_size
         self.rs_codec = RSCodec(k, m)
         self.chunk_validator = ChunkValidator(chunk_size)
-        self.chunk_downloader = ChunkDownloader()
+        # 未传入时按配置创建：network.max_bandwidth 为全局上限，max_peer_bandwidth 为单个对端上限
+        if bandwidth_manager is None:
+            config = Config()
+            bandwidth_manager = BandwidthManager(config.get('network.max_bandwidth', 0),
+                                                 max_peer_bandwidth=config.get('network.max_peer_bandwidth', 0))
+        self.bandwidth_manager = bandwidth_manager
+        # 共享连接池：HEAD 探测、清单和所有块请求都复用同一批保持连接
+        self.owns_transport = transport is None
+        self.transport = transport or Transport.from_config(Config())
+        self.chunk_downloader = ChunkDownloader(chunk_validator=self.chunk_validator,
+                                                bandwidth_manager=bandwidth_manager,
+                                                transport=self.transport)
+        # 对端评分在多个下载任务之间保留，新任务一开始就知道哪些源快、哪些源最近出过错
+        self.peer_selector = PeerSelector(chunk_downloader=self.chunk_downloader)
+        self.chunk_downloader.peer_selector = self.peer_selector
+        self.availability: Optional[PieceAvailability] = None
         self.download_state = {}
-        self.is_downloading = False
+        # 下载任务队列：submit 的任务按优先级（大的先）进入堆，最多 max_active_jobs 个同时运行。
+        # 运行中的任务按 weight 分享全局带宽（加权公平队列）和 connection_budget 个并发连接
+        self.jobs: Dict[str, Dict] = {}
+        self.job_tasks: Dict[str, asyncio.Task] = {}
+        self._job_options: Dict[str, tuple] = {}
+        self._job_queue = []
+        self._job_sequence = 0
+        self.max_active_jobs = 4
+        self.connection_budget = 32
 
         # 新增属性
         self.max_speed = 0  # 0 表示不限速
         self.max_concurrent_downloads = 3
+        self.temp_path = 'temp'
+        self.endgame_threshold = 8
+        self.endgame_max_duplicates = 2
+        self.max_request_size = 64 * 1024 * 1024
         self.current_speed = 0
         self.downloaded_bytes = 0
         self.last_speed_update = time.time()
@@ -33,6 +71,23 @@ class DownloadManager:
         config = Config()
         self.max_speed = config.get('download.max_speed', 0)
         self.max_concurrent_downloads = config.get('download.max_concurrent_downloads', 3)
+        self.temp_path = config.get('storage.temp_path', 'temp')
+        self.endgame_threshold = config.get('download.endgame_threshold', 8)
+        self.endgame_max_duplicates = config.get('download.endgame_max_duplicates', 2)
+        self.max_request_size = config.get('download.max_request_size', 64 * 1024 * 1024)
+        self.max_active_jobs = config.get('download.max_active_jobs', 4)
+        self.connection_budget = config.get('download.connection_budget', 32)
+        # 块哈希列表的默认算法；快速校验和只检测传输错误，清单始终使用 SHA-256
+        configured = config.get('download.chunk_hash_algorithm', 'sha256')
+        algorithm = ChunkValidator.resolve_algorithm(configured)
+        if configured != algorithm:
+            print(f"Chunk hash algorithm '{configured}' resolved to {algorithm}")
+        if algorithm != self.chunk_validator.algorithm:
+            if algorithm in ChunkValidator.available_algorithms():
+                self.chunk_validator = ChunkValidator(self.chunk_size, algorithm=algorithm)
+                self.chunk_downloader.chunk_validator = self.chunk_validator
+            else:
+                print(f"Unsupported chunk hash algorithm: {algorithm}")
 
     # 新增方法：保存设置
     def save_settings(self):
@@ -45,7 +100,14 @@ class DownloadManager:
         return self.max_speed
 
     def set_max_speed(self, speed: int):
+        # 立即作用于正在进行的下载
         self.max_speed = speed
+        for job in self.active_jobs():
+            self.bandwidth_manager.set_download_limit(job['download_id'], speed)
+
+    @property
+    def is_downloading(self) -> bool:
+        return any(job['status'] == 'downloading' for job in self.jobs.values())
 
     # 新增方法：获取和设置并发下载数
     def get_concurrent_downloads(self) -> int:
@@ -72,25 +134,375 @@ class DownloadManager:
 
     async def close(self):
         await self.chunk_downloader.close()
+        if self.owns_transport:
+            await self.transport.close()
 
-    # 修改现有的 start_download 方法
-    async def start_download(self, url: str, output_path: str,
-                             progress_callback: Optional[Callable] = None) -> bool:
-        if self.is_downloading:
+    async def _probe_source(self, url: str, expected_size: int) -> bool:
+        try:
+            async with self.chunk_downloader.session.head(url) as response:
+                if response.status != 200:
+                    return False
+                if int(response.headers.get('Content-Length', 0)) != expected_size:
+                    print(f"Skipping source {url}: size mismatch")
+                    return False
+                if response.headers.get('Accept-Ranges', '').lower() == 'none':
+                    self.chunk_downloader.range_unsupported_urls.add(url)
+                return True
+        except Exception as e:
+            print(f"Skipping source {url}: {str(e)}")
             return False
 
-        self.is_downloading = True
-        self.download_state = {
+    async def _probe_mirrors(self, mirrors: List[str], file_size: int) -> List[str]:
+        # 只保留文件大小与主源一致的镜像
+        results = await asyncio.gather(*(self._probe_source(mirror, file_size) for mirror in mirrors))
+        return [mirror for mirror, ok in zip(mirrors, results) if ok]
+
+    async def _probe_parity(self, parity_urls: List[str], file_size: int) -> List[Optional[str]]:
+        # 第 j 个校验源保存每个条带的第 j 个校验分片，大小为 条带数 * 分片大小
+        stripe_size = self.rs_codec.k * self.chunk_size
+        parity_size = (file_size + stripe_size - 1) // stripe_size * self.chunk_size
+        parity_urls = list(parity_urls[:self.rs_codec.m])
+        results = await asyncio.gather(*(self._probe_source(parity_url, parity_size)
+                                         for parity_url in parity_urls))
+        return [parity_url if ok else None for parity_url, ok in zip(parity_urls, results)]
+
+    async def _download_erasure_coded(self, journal: ResumeJournal, file_size: int,
+                                      sources: List[str], parity_sources: List[Optional[str]],
+                                      chunk_writer: ChunkWriter, progress_callback: Callable,
+                                      chunk_callback: Callable[[int], None],
+                                      download_id: Optional[str] = None,
+                                      chunk_hashes: Optional[List[str]] = None,
+                                      manifest: Optional[Manifest] = None,
+                                      parity_hashes: Optional[List[List[str]]] = None):
+        # 分片大小与块大小相同，条带 s 的数据分片就是第 s * k 到 s * k + k - 1 块
+        k = self.rs_codec.k
+        stripe_downloader = StripeDownloader(self.chunk_downloader, self.rs_codec,
+                                             self.chunk_size, self.max_concurrent_downloads,
+                                             download_id, chunk_hashes, manifest, parity_hashes)
+        stripes = sorted({chunk_id // k for chunk_id in journal.missing_chunks()})
+
+        def on_stripe_stored(stripe: int):
+            for chunk_id in range(stripe * k, min((stripe + 1) * k, journal.chunk_count)):
+                chunk_callback(chunk_id)
+
+        await stripe_downloader.download_stripes(stripes, file_size, sources, parity_sources,
+                                                 chunk_writer, progress_callback, on_stripe_stored)
+        if stripe_downloader.decoded_stripes:
+            print(f"Reconstructed {stripe_downloader.decoded_stripes} stripes from parity shards")
+        if stripe_downloader.rejected_stripes:
+            print(f"Rejected {stripe_downloader.rejected_stripes} reconstructed stripes that failed verification")
+
+    async def _verify_resumed_chunks(self, journal: ResumeJournal, part_path: str,
+                                     chunk_hashes: List[str]) -> int:
+        # 续传前在线程池中并行校验已完成的块，损坏的块重新标记为缺失
+        chunk_ids = journal.completed_chunks()
+        if not chunk_ids:
+            return 0
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(
+            None, self.chunk_validator.validate_file_chunks, part_path, chunk_hashes, chunk_ids)
+        corrupted = [chunk_id for chunk_id, ok in zip(chunk_ids, results) if not ok]
+        for chunk_id in corrupted:
+            journal.mark_missing(chunk_id)
+        if corrupted:
+            await journal.flush_async()
+        return len(corrupted)
+
+    async def _fetch_manifest(self, manifest_url: str, file_size: int,
+                              manifest_root: Optional[str] = None) -> Optional[Manifest]:
+        try:
+            async with self.chunk_downloader.session.get(
+                    manifest_url, timeout=self.chunk_downloader._client_timeout()) as response:
+                if response.status != 200:
+                    print(f"Failed to fetch manifest, status: {response.status}")
+                    return None
+                manifest = Manifest.from_json(await response.text(), manifest_root)
+            if manifest.file_size != file_size:
+                print("Manifest does not match the remote file size")
+                return None
+            if manifest.chunk_size != self.chunk_size:
+                # 清单与本地块大小不同时按本地块大小重新分组，要求块大小能被校验块大小整除
+                manifest = Manifest(file_size, self.chunk_size, manifest.block_size, manifest.block_hashes)
+            print(f"Loaded manifest with {manifest.block_count} blocks, root {manifest.root}")
+            return manifest
+        except Exception as e:
+            print(f"Failed to load manifest: {str(e)}")
+            return None
+
+    async def _verify_blocks(self, journal: ResumeJournal, part_path: str,
+                             manifest: Manifest) -> Dict[int, tuple]:
+        # 按小块校验已完成的块，只把损坏的小块所在区间重新加入下载
+        chunk_ids = journal.completed_chunks()
+        if not chunk_ids:
+            return {}
+        loop = asyncio.get_running_loop()
+        bad_blocks = await loop.run_in_executor(None, manifest.verify_file, part_path, chunk_ids)
+        spans = {}
+        for chunk_id, blocks in bad_blocks.items():
+            journal.mark_missing(chunk_id)
+            spans[chunk_id] = (manifest.block_range(blocks[0])[0], manifest.block_range(blocks[-1])[1])
+        if spans:
+            await journal.flush_async()
+        return spans
+
+    async def _build_availability(self, chunk_locations: Dict[int, List[str]], sources: List[str],
+                                  chunk_count: int, file_size: int) -> PieceAvailability:
+        availability = PieceAvailability(chunk_count)
+        for source in sources:
+            availability.add_peer(source, pieces=range(chunk_count))
+        peers = {peer for holders in chunk_locations.values() for peer in holders} - set(sources)
+        reachable = set(await self._probe_mirrors(sorted(peers), file_size))
+        for chunk_id, holders in chunk_locations.items():
+            for peer in holders:
+                if peer in reachable:
+                    availability.have(peer, chunk_id)
+        print(f"Piece availability from {len(reachable)} partial peers: {availability.get_stats()}")
+        return availability
+
+    def submit(self, url: str, output_path: str, priority: int = 0, weight: float = 1.0,
+               progress_callback: Optional[Callable] = None, **options) -> str:
+        # 加入下载队列，返回任务 ID（输出文件的绝对路径）；同一个输出文件已在队列或下载中时直接返回它。
+        # options 与 start_download 的可选参数相同
+        job_id = os.path.abspath(output_path)
+        job = self.jobs.get(job_id)
+        if job is not None and job['status'] in ('queued', 'starting', 'downloading', 'paused'):
+            # 暂停的任务再次提交时继续下载
+            self.resume_job(job_id)
+            return job_id
+        job = self._new_job(url, output_path, priority, weight)
+        self._job_options[job_id] = (progress_callback, options)
+        self._push_job(job)
+        self._dispatch_jobs()
+        return job_id
+
+    def _new_job(self, url: str, output_path: str, priority: int, weight: float) -> Dict:
+        job_id = os.path.abspath(output_path)
+        job = {
+            'id': job_id,
             'url': url,
             'output_path': output_path,
+            'download_id': job_id,
+            'priority': priority,
+            'weight': max(float(weight), 0.01),
+            'status': 'queued',
             'progress': 0.0,
-            'status': 'downloading',
-            'downloaded_bytes': 0
+            'downloaded_bytes': 0,
+            'file_size': 0,
+            'speed': 0.0,
+            'connections': self.max_concurrent_downloads,
+            'created': time.time(),
+            'started': None,
+            'first_byte': None,
+            'finished': None,
+            'result': None
+        }
+        self.jobs[job_id] = job
+        return job
+
+    def _push_job(self, job: Dict):
+        # 修改优先级时压入新记录，旧记录出堆时按序号跳过
+        self._job_sequence += 1
+        job['queue_sequence'] = self._job_sequence
+        heapq.heappush(self._job_queue, (-job['priority'], self._job_sequence, job['id']))
+
+    def _dispatch_jobs(self):
+        while self._job_queue and len(self.job_tasks) < self.max_active_jobs:
+            _, sequence, job_id = heapq.heappop(self._job_queue)
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] != 'queued' or job.get('queue_sequence') != sequence:
+                continue
+            job['status'] = 'starting'
+            self.job_tasks[job_id] = asyncio.create_task(self._run_job(job))
+
+    async def _run_job(self, job: Dict) -> bool:
+        # 暂停的任务保留提交时的参数，继续时原样再下载一次（已完成的块从断点续传日志恢复）
+        progress_callback, options = self._job_options.get(job['id'], (None, {}))
+        try:
+            return await self._download(job, progress_callback, **options)
+        finally:
+            if job['status'] != 'paused':
+                self._job_options.pop(job['id'], None)
+            self.job_tasks.pop(job['id'], None)
+            self._dispatch_jobs()
+
+    def _rebalance_jobs(self):
+        # 按权重把连接预算分给运行中的任务，每个任务至少一个连接，最多 max_concurrent_downloads 个
+        active = self.active_jobs()
+        total_weight = sum(job['weight'] for job in active) or 1.0
+        for job in active:
+            share = int(self.connection_budget * job['weight'] / total_weight)
+            job['connections'] = max(1, min(self.max_concurrent_downloads, share))
+
+    def _update_job_speed(self, job: Dict, nbytes: int):
+        now = time.time()
+        window = job.setdefault('speed_window', [now, 0])
+        window[1] += nbytes
+        if now - window[0] >= 1.0:
+            job['speed'] = window[1] / (now - window[0])
+            job['speed_window'] = [now, 0]
+
+    def active_jobs(self) -> List[Dict]:
+        return [job for job in self.jobs.values() if job['status'] == 'downloading']
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items()
+                if key not in ('queue_sequence', 'speed_window', 'availability')}
+
+    def list_jobs(self) -> List[Dict]:
+        return [self.get_job(job_id) for job_id in self.jobs]
+
+    def set_job_priority(self, job_id: str, priority: int) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job['priority'] = priority
+        if job['status'] == 'queued':
+            self._push_job(job)
+        return True
+
+    def set_job_weight(self, job_id: str, weight: float) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job['weight'] = max(float(weight), 0.01)
+        if job['status'] == 'downloading':
+            self.bandwidth_manager.set_download_weight(job['download_id'], job['weight'])
+            self._rebalance_jobs()
+        return True
+
+    def set_max_active_jobs(self, count: int):
+        self.max_active_jobs = max(1, count)
+        self._dispatch_jobs()
+
+    async def _stop_job(self, job: Dict, status: str):
+        # 取消任务的协程并等它退出：块请求随之取消，连接回到连接池，带宽流被移除，
+        # 已完成的块和在途块已收到的部分写入断点续传日志，继续时从中断的字节开始
+        job['status'] = status
+        task = self.job_tasks.get(job['id'])
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            if self.job_tasks.get(job['id']) is task:
+                # 还没开始运行就被取消的协程不会执行 _run_job 的 finally
+                del self.job_tasks[job['id']]
+                self._dispatch_jobs()
+        job['speed'] = 0.0
+        job['finished'] = job['finished'] or time.time()
+
+    async def pause_job(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] not in ('queued', 'starting', 'downloading'):
+            return False
+        await self._stop_job(job, 'paused')
+        return True
+
+    def resume_job(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] != 'paused':
+            return False
+        job['status'] = 'queued'
+        job['finished'] = None
+        self._push_job(job)
+        self._dispatch_jobs()
+        return True
+
+    async def cancel_job(self, job_id: str, remove_partial: bool = True) -> bool:
+        # 取消后默认删除未完成的 .part 文件和断点续传日志
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] in ('completed', 'failed', 'cancelled'):
+            return False
+        await self._stop_job(job, 'cancelled')
+        self._job_options.pop(job_id, None)
+        if remove_partial:
+            FileUtils.remove_file(job['output_path'] + '.part')
+            FileUtils.remove_file(ResumeJournal.journal_path_for(self.temp_path, job['url'], job['output_path']))
+        return True
+
+    def get_stats(self) -> Dict:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job['status']] = statuses.get(job['status'], 0) + 1
+        return {
+            'jobs': len(self.jobs),
+            'statuses': statuses,
+            'download_speed': self.bandwidth_manager.get_current_bandwidth(),
+            'bytes_downloaded': self.bandwidth_manager.total_bytes_transferred,
+            'bytes_uploaded': self.bandwidth_manager.total_bytes_uploaded,
+            'transport': self.transport.get_stats()
         }
 
+    async def wait(self, job_id: str) -> bool:
+        # 排队中的任务还没有协程，先等任意运行中的任务结束（腾出名额后它会被调度），再等它自己
+        while True:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] not in ('queued', 'starting', 'downloading'):
+                return bool(job and job['result'])
+            task = self.job_tasks.get(job_id)
+            pending = [task] if task is not None else list(self.job_tasks.values())
+            if not pending:
+                return False
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    async def wait_all(self) -> Dict[str, bool]:
+        # 等待队列里和正在运行的所有任务结束
+        while self.job_tasks:
+            await asyncio.gather(*list(self.job_tasks.values()), return_exceptions=True)
+        return {job_id: bool(job['result']) for job_id, job in self.jobs.items()
+                if job['status'] not in ('queued', 'starting')}
+
+    # 修改现有的 start_download 方法
+    async def start_download(self, url: str, output_path: str,
+                             progress_callback: Optional[Callable] = None,
+                             mirrors: Optional[List[str]] = None,
+                             parity_urls: Optional[List[str]] = None,
+                             chunk_hashes: Optional[List[str]] = None,
+                             manifest_url: Optional[str] = None,
+                             manifest_root: Optional[str] = None,
+                             chunk_locations: Optional[Dict[int, List[str]]] = None,
+                             priority: int = 0, weight: float = 1.0,
+                             parity_hashes: Optional[List[List[str]]] = None) -> bool:
+        # 立即开始下载（不经过队列），与队列中运行的任务一起分享带宽和连接预算；
+        # 任务被暂停或取消时返回 False
+        job = self.jobs.get(os.path.abspath(output_path))
+        if job is not None and job['status'] in ('starting', 'downloading'):
+            return False
+        job = self._new_job(url, output_path, priority, weight)
+        self._job_options[job['id']] = (progress_callback, {
+            'mirrors': mirrors, 'parity_urls': parity_urls, 'chunk_hashes': chunk_hashes,
+            'manifest_url': manifest_url, 'manifest_root': manifest_root, 'chunk_locations': chunk_locations,
+            'parity_hashes': parity_hashes})
+        job['status'] = 'starting'
+        task = self.job_tasks[job['id']] = asyncio.create_task(self._run_job(job))
+        try:
+            return await self.wait(job['id'])
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    async def _download(self, job: Dict, progress_callback: Optional[Callable] = None,
+                        mirrors: Optional[List[str]] = None,
+                        parity_urls: Optional[List[str]] = None,
+                        chunk_hashes: Optional[List[str]] = None,
+                        manifest_url: Optional[str] = None,
+                        manifest_root: Optional[str] = None,
+                        chunk_locations: Optional[Dict[int, List[str]]] = None,
+                        parity_hashes: Optional[List[List[str]]] = None) -> bool:
+        url = job['url']
+        output_path = job['output_path']
+        download_id = job['download_id']
+        job['status'] = 'downloading'
+        job['started'] = time.time()
+        self.download_state = job
+        # 每个下载任务一个令牌桶，max_speed 为 0 时不限速；全局带宽按 weight 在任务间公平分享
+        self.bandwidth_manager.set_download_limit(download_id, self.max_speed, job['weight'])
+        self._rebalance_jobs()
+
         try:
             print(f"Starting download from {url}")
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
 
             async with self.chunk_downloader.session.head(url) as response:
                 if response.status != 200:
@@ -103,48 +515,200 @@ class DownloadManager:
                     return False
 
                 print(f"File size: {file_size} bytes")
+                job['file_size'] = file_size
+                if response.headers.get('Accept-Ranges', '').lower() == 'none':
+                    self.chunk_downloader.range_unsupported_urls.add(url)
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+
+            # 多源下载：不同的块同时从主源和各个镜像获取
+            sources = [url]
+            if mirrors:
+                candidates = [mirror for mirror in dict.fromkeys(mirrors) if mirror != url]
+                sources.extend(await self._probe_mirrors(candidates, file_size))
+                # 只对没有评分的源发小范围测速请求，已有评分的源直接用之前的估计
+                await self.peer_selector.probe_unknown(sources)
+                print(f"Downloading from {len(sources)} sources")
 
             chunk_count = (file_size + self.chunk_size - 1) // self.chunk_size
-            chunk_urls = {}
 
-            for i in range(chunk_count):
+            # 读取断点续传日志，远端文件未变化时只下载缺失的块
+            FileUtils.ensure_dir(self.temp_path)
+            journal = ResumeJournal(ResumeJournal.journal_path_for(self.temp_path, url, output_path))
+            if not (journal.load() and
+                    journal.matches(url, file_size, self.chunk_size, etag, last_modified) and
+                    FileUtils.get_file_size(output_path + '.part') == file_size):
+                journal.reset(url, output_path, file_size, self.chunk_size, etag, last_modified)
+
+            if chunk_hashes is not None and len(chunk_hashes) != chunk_count:
+                print(f"Ignoring chunk hashes: expected {chunk_count}, got {len(chunk_hashes)}")
+                chunk_hashes = None
+            # 提供清单时按 Merkle 树的小块校验，清单的根哈希可以与 manifest_root 对照
+            manifest = None
+            if manifest_url:
+                manifest = await self._fetch_manifest(manifest_url, file_size, manifest_root)
+                if manifest is None:
+                    return False
+
+            repair_spans = {}
+            if manifest is not None and journal.completed_count:
+                repair_spans = await self._verify_blocks(journal, output_path + '.part', manifest)
+                if repair_spans:
+                    print(f"{len(repair_spans)} resumed chunks have corrupted blocks and will be repaired")
+            if chunk_hashes and journal.completed_count:
+                corrupted = await self._verify_resumed_chunks(journal, output_path + '.part', chunk_hashes)
+                if corrupted:
+                    print(f"{corrupted} resumed chunks failed verification and will be downloaded again")
+
+            # 提供校验源时使用纠删码模式：每个条带任意 k 个分片到达即可完成。
+            # parity_hashes[j] 是第 j 个校验文件里每个条带分片的哈希，校验源发布的校验文件附带这份列表
+            parity_sources = None
+            if parity_urls:
+                parity_sources = await self._probe_parity(parity_urls, file_size)
+                if not any(parity_sources):
+                    parity_sources = None
+                else:
+                    print(f"Erasure-coded download with {sum(1 for p in parity_sources if p)} parity sources")
+            if parity_hashes is not None:
+                stripe_count = (chunk_count + self.rs_codec.k - 1) // self.rs_codec.k
+                if any(len(hashes) != stripe_count for hashes in parity_hashes):
+                    print(f"Ignoring parity hashes: expected {stripe_count} per parity source")
+                    parity_hashes = None
+
+            # 部分持有者：chunk_locations 给出每个块还能从哪些对端获取，主源和镜像持有全部块。
+            # 建立可用性索引后按最稀有优先下载，持有者少的块趁对端还在时先拿到
+            availability = None
+            if chunk_locations and not parity_sources:
+                availability = await self._build_availability(chunk_locations, sources, chunk_count, file_size)
+                for chunk_id in range(chunk_count):
+                    if journal.is_complete(chunk_id):
+                        availability.mark_complete(chunk_id)
+            # 下载过程中对端的宣告和离开通过 job['availability'] 增量更新
+            job['availability'] = availability
+            self.availability = availability
+
+            chunks = {}
+            for i in journal.missing_chunks():
                 start_byte = i * self.chunk_size
                 end_byte = min(start_byte + self.chunk_size - 1, file_size - 1)
-                chunk_urls[i] = [url]
+                if i in repair_spans:
+                    start_byte, end_byte = repair_spans[i]
+                chunks[i] = {'urls': availability.holders_of(i) if availability else sources,
+                             'start': start_byte, 'end': end_byte, 'download_id': download_id}
+                if chunk_hashes and i not in repair_spans:
+                    chunks[i]['hash'] = chunk_hashes[i]
+                elif manifest is not None:
+                    chunks[i]['manifest'] = manifest
 
-            print(f"Starting download of {chunk_count} chunks")
+            # 暂停后继续时重新计算，未完成块的前缀在块完成时一并计入
+            job['downloaded_bytes'] = file_size - sum(
+                chunk['end'] - chunk['start'] + 1 for chunk in chunks.values())
+            if journal.completed_count:
+                print(f"Resuming download: {journal.completed_count}/{chunk_count} chunks already present")
+            print(f"Starting download of {len(chunks)} chunks")
 
             async def progress_wrapper(progress: float, bytes_downloaded: int):
+                # 第一个块写入的时间，作为首字节时间（上界）
+                if job['first_byte'] is None:
+                    job['first_byte'] = time.time()
                 self.update_speed(bytes_downloaded)
-                self.download_state['downloaded_bytes'] += bytes_downloaded
+                self._update_job_speed(job, bytes_downloaded)
+                job['downloaded_bytes'] += bytes_downloaded
+                job['progress'] = journal.completed_count / chunk_count
                 if progress_callback:
-                    await progress_callback(progress, self.current_speed)
+                    await progress_callback(job['progress'], job['speed'])
+
+            # 预分配输出文件，数据块到达后按偏移直接写入
+            chunk_writer = ChunkWriter(output_path, file_size, self.chunk_size)
+            await chunk_writer.open_async()
+
+            # 上次暂停时中断的块：读回已保存的前缀，只请求剩余字节
+            resumed_bytes = 0
+            for chunk_id, chunk in chunks.items():
+                nbytes = journal.partial_bytes(chunk_id)
+                if nbytes and chunk_id not in repair_spans and nbytes < chunk['end'] - chunk['start'] + 1:
+                    chunk['prefix'] = chunk_writer.read_at(chunk['start'], nbytes)
+                    resumed_bytes += nbytes
+            if resumed_bytes:
+                print(f"Resuming {resumed_bytes} bytes of partially downloaded chunks")
 
-            chunks = await self.chunk_downloader.download_chunks(
-                chunk_urls,
-                progress_wrapper
-            )
+            def on_chunk_stored(chunk_id: int):
+                journal.mark_complete(chunk_id)
+                journal.flush_in_background(chunk_writer.flush)
 
-            if len(chunks) != chunk_count:
-                print(f"Download incomplete: {len(chunks)}/{chunk_count} chunks")
+            def on_chunk_partial(chunk_id: int, offset: int, data: bytes):
+                # 暂停或取消时在途块已收到的部分写入 .part，日志记下字节数；修复用的块不是从块边界开始，不保存
+                if offset != chunk_id * self.chunk_size or journal.is_complete(chunk_id):
+                    return
+                if len(data) <= journal.partial_bytes(chunk_id):
+                    return
+                try:
+                    chunk_writer.write_at(offset, data)
+                    journal.mark_partial(chunk_id, len(data))
+                except (OSError, ValueError) as e:
+                    print(f"Failed to save partial chunk {chunk_id}: {str(e)}")
+
+            try:
+                if parity_sources:
+                    await self._download_erasure_coded(journal, file_size, sources, parity_sources,
+                                                       chunk_writer, progress_wrapper, on_chunk_stored,
+                                                       download_id, chunk_hashes, manifest, parity_hashes)
+                else:
+                    await self.chunk_downloader.download_chunks(
+                        chunks,
+                        progress_wrapper,
+                        chunk_writer,
+                        self.max_concurrent_downloads,
+                        on_chunk_stored,
+                        self.endgame_threshold,
+                        self.endgame_max_duplicates,
+                        self.max_request_size,
+                        availability,
+                        lambda: job['connections'],
+                        on_chunk_partial
+                    )
+
+                if manifest is not None and chunk_hashes and journal.completed_count == chunk_count:
+                    # 传输中只做块级快速校验，全部到齐后再用清单的 SHA-256 并行校验一遍
+                    repair_spans = await self._verify_blocks(journal, output_path + '.part', manifest)
+                    if repair_spans:
+                        print(f"{len(repair_spans)} chunks failed the manifest check and will be repaired")
+                        await self.chunk_downloader.download_chunks(
+                            {chunk_id: {'urls': sources, 'start': start_byte, 'end': end_byte,
+                                        'manifest': manifest, 'download_id': download_id}
+                             for chunk_id, (start_byte, end_byte) in repair_spans.items()},
+                            progress_wrapper,
+                            chunk_writer,
+                            self.max_concurrent_downloads,
+                            on_chunk_stored
+                        )
+            finally:
+                # 中断或失败时保存已完成的块，下次启动从这里继续；会等后台刷盘结束，关闭文件时没有 fsync 在进行
+                await journal.flush_async(chunk_writer.flush)
+                chunk_writer.close()
+
+            if journal.completed_count != chunk_count:
+                print(f"Download incomplete: {journal.completed_count}/{chunk_count} chunks")
                 return False
 
-            print("Merging chunks...")
-            with open(output_path, 'wb') as f:
-                for i in range(chunk_count):
-                    if i in chunks:
-                        f.write(chunks[i])
-                    else:
-                        print(f"Missing chunk {i}")
-                        return False
+            if not chunk_writer.finalize():
+                print(f"Failed to finalize {output_path}")
+                return False
+            journal.remove()
 
             print("Download completed successfully")
-            self.download_state['status'] = 'completed'
+            job['status'] = 'completed'
             return True
 
         except Exception as e:
             print(f"Download failed: {str(e)}")
-            self.download_state['status'] = 'failed'
+            job['status'] = 'failed'
             return False
         finally:
-            self.is_downloading = False
\ No newline at end of file
+            self.bandwidth_manager.remove_download(download_id)
+            if job['status'] == 'downloading':
+                job['status'] = 'failed'
+            job['result'] = job['status'] == 'completed'
+            job['finished'] = time.time()
+            job.pop('availability', None)
+            self._rebalance_jobs()
\ No newline at end of file
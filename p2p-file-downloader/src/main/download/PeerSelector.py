@@ -1,87 +1,223 @@
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
 import asyncio
-import random
+import heapq
 import time
 from .ChunkDownloader import ChunkDownloader
+from .PieceAvailability import PieceAvailability
+from ..network.Transport import Transport
 
 class PeerSelector:
-    def __init__(self, speed_test_size: int = 1024 * 1024):
+    # 对端评分：吞吐量和时延用 EWMA 估计，样本来自真实的块传输，只对没有样本的对端发小范围探测请求。
+    # 失败次数按 failure_half_life 秒的半衰期衰减，衰减后仍不少于 max_failures 的对端视为不可靠
+    # （默认 2.5：短时间内连续失败三次），eviction_seconds 秒没有消息的对端被淘汰。
+    # 排名用带版本号的最大堆维护，每次更新只压入一条记录，取前 k 个是 O(k log n)，不对全部对端排序
+    def __init__(self, speed_test_size: int = 256 * 1024, transport: Optional[Transport] = None,
+                 chunk_downloader: Optional[ChunkDownloader] = None, alpha: float = 0.3,
+                 max_failures: float = 2.5, failure_half_life: float = 60.0,
+                 eviction_seconds: float = 1800.0, probe_ttl: float = 300.0,
+                 probe_concurrency: int = 8):
         self.speed_test_size = speed_test_size
-        self.peer_stats = {}
-        self.chunk_downloader = ChunkDownloader()
-        self.last_update = {}
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.failure_half_life = failure_half_life
+        self.eviction_seconds = eviction_seconds
+        self.probe_ttl = probe_ttl
+        self.probe_concurrency = max(1, probe_concurrency)
+        # 按最近一次更新的时间排序，淘汰时只需要从头部检查
+        self.peer_stats: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._heap: List[Tuple[float, int, str]] = []
+        self._versions: Dict[str, int] = {}
+        self._version = 0
+        # 与下载管理器共用下载器或传输层时，探测请求复用下载时建立的连接
+        self.owns_downloader = chunk_downloader is None
+        self.chunk_downloader = chunk_downloader or ChunkDownloader(transport=transport)
 
     async def initialize(self):
         await self.chunk_downloader.initialize()
 
+    async def close(self):
+        if self.owns_downloader:
+            await self.chunk_downloader.close()
+
+    def _get_stats(self, peer_url: str, now: float) -> Dict:
+        stats = self.peer_stats.get(peer_url)
+        if stats is None:
+            stats = self.peer_stats[peer_url] = {
+                'speed': 0.0,
+                'rtt': None,
+                'samples': 0,
+                'failures': 0.0,
+                'last_failure': 0.0,
+                'last_update': now
+            }
+        return stats
+
+    def _touch(self, peer_url: str, stats: Dict, now: float):
+        stats['last_update'] = now
+        self.peer_stats.move_to_end(peer_url)
+        self.evict_stale(now)
+
+    def _push(self, peer_url: str, speed: float):
+        self._version += 1
+        self._versions[peer_url] = self._version
+        heapq.heappush(self._heap, (-speed, self._version, peer_url))
+        # 过期记录太多时重建堆，堆的大小保持在对端数的常数倍
+        if len(self._heap) > 2 * len(self.peer_stats) + 64:
+            self._heap = [(-stats['speed'], self._versions[peer], peer)
+                          for peer, stats in self.peer_stats.items()]
+            heapq.heapify(self._heap)
+
+    def record_transfer(self, peer_url: str, size: int, elapsed: float, rtt: Optional[float] = None):
+        if elapsed <= 0 or size <= 0:
+            return
+        now = time.time()
+        stats = self._get_stats(peer_url, now)
+        sample = size / elapsed
+        stats['speed'] = sample if stats['samples'] == 0 else stats['speed'] + self.alpha * (sample - stats['speed'])
+        if rtt is not None:
+            stats['rtt'] = rtt if stats['rtt'] is None else stats['rtt'] + self.alpha * (rtt - stats['rtt'])
+        stats['samples'] += 1
+        self._touch(peer_url, stats, now)
+        self._push(peer_url, stats['speed'])
+
+    def record_failure(self, peer_url: str):
+        now = time.time()
+        stats = self._get_stats(peer_url, now)
+        stats['failures'] = self.get_failures(peer_url, now) + 1
+        stats['last_failure'] = now
+        self._touch(peer_url, stats, now)
+        if peer_url not in self._versions:
+            self._push(peer_url, stats['speed'])
+
+    def get_failures(self, peer_url: str, now: Optional[float] = None) -> float:
+        stats = self.peer_stats.get(peer_url)
+        if stats is None or not stats['failures']:
+            return 0.0
+        age = (time.time() if now is None else now) - stats['last_failure']
+        return stats['failures'] * 0.5 ** (age / self.failure_half_life)
+
+    def get_speed(self, peer_url: str) -> float:
+        return self.peer_stats.get(peer_url, {}).get('speed', 0.0)
+
+    def get_rtt(self, peer_url: str) -> Optional[float]:
+        return self.peer_stats.get(peer_url, {}).get('rtt')
+
+    def evict_stale(self, now: Optional[float] = None):
+        cutoff = (time.time() if now is None else now) - self.eviction_seconds
+        while self.peer_stats:
+            peer_url, stats = next(iter(self.peer_stats.items()))
+            if stats['last_update'] > cutoff:
+                break
+            del self.peer_stats[peer_url]
+            # 堆里的旧记录在取排名时按版本号跳过
+            self._versions.pop(peer_url, None)
+
+    def needs_probe(self, peer_url: str, now: Optional[float] = None) -> bool:
+        stats = self.peer_stats.get(peer_url)
+        if stats is None or stats['samples'] == 0:
+            return True
+        return (time.time() if now is None else now) - stats['last_update'] > self.probe_ttl
+
     async def test_peer_speed(self, peer_url: str) -> float:
+        # 小范围 Range 请求：响应头到达的时间作为时延样本，响应体的传输时间作为吞吐量样本
         try:
-            speed = await self.chunk_downloader.verify_download_speed(peer_url)
-            self.peer_stats[peer_url] = {
-                'speed': speed,
-                'last_test': time.time(),
-                'failures': 0
-            }
-            return speed
-        except Exception:
-            self.peer_stats[peer_url] = {
-                'speed': 0,
-                'last_test': time.time(),
-                'failures': self.peer_stats.get(peer_url, {}).get('failures', 0) + 1
-            }
+            session = self.chunk_downloader.session
+            request_time = time.time()
+            async with session.get(peer_url, headers={'Range': f'bytes=0-{self.speed_test_size - 1}'},
+                                   timeout=self.chunk_downloader._client_timeout()) as response:
+                header_time = time.time()
+                if response.status not in (200, 206):
+                    raise Exception(f"HTTP {response.status}")
+                received = 0
+                async for data in response.content.iter_chunked(self.chunk_downloader.read_size):
+                    received += len(data)
+                    if received >= self.speed_test_size:
+                        break
+            elapsed = time.time() - request_time
+            rtt = header_time - request_time
+            # 探测量很小，扣掉一个往返时间后再算吞吐量
+            self.record_transfer(peer_url, received, max(elapsed - rtt, elapsed * 0.1), rtt)
+            return self.get_speed(peer_url)
+        except Exception as e:
+            print(f"Speed test failed for {peer_url}: {str(e)}")
+            self.record_failure(peer_url)
             return 0.0
 
-    async def select_optimal_peers(self, chunk_locations: Dict[int, List[str]]) -> Dict[int, List[str]]:
+    async def probe_unknown(self, peers: Iterable[str]):
+        # 只探测没有样本或样本已过期的对端，同时进行的探测不超过 probe_concurrency 个
+        now = time.time()
+        pending = [peer for peer in dict.fromkeys(peers) if self.needs_probe(peer, now)]
+        if not pending:
+            return
+        semaphore = asyncio.Semaphore(self.probe_concurrency)
+
+        async def probe(peer_url: str):
+            async with semaphore:
+                await self.test_peer_speed(peer_url)
+
+        await asyncio.gather(*(probe(peer) for peer in pending))
+
+    async def select_optimal_peers(self, chunk_locations: Dict[int, List[str]],
+                                   per_chunk: int = 3) -> Dict[int, List[str]]:
         if not chunk_locations:
             return {}
 
         all_peers = set()
         for peers in chunk_locations.values():
             all_peers.update(peers)
+        await self.probe_unknown(all_peers)
 
-        test_tasks = [self.test_peer_speed(peer) for peer in all_peers 
-                     if time.time() - self.last_update.get(peer, 0) > 300]
-        if test_tasks:
-            await asyncio.gather(*test_tasks)
-
+        # 结果按最稀有优先排列，调用方按顺序派发即可；每个块只取前 per_chunk 个对端，nlargest 是 O(n log k)
+        availability = PieceAvailability.from_locations(max(chunk_locations) + 1, chunk_locations)
+        now = time.time()
         optimal_locations = {}
-        for chunk_id, peers in chunk_locations.items():
-            ranked_peers = sorted(
-                [(peer, self.peer_stats.get(peer, {}).get('speed', 0)) 
-                 for peer in peers if self.is_peer_reliable(peer)],
-                key=lambda x: x[1],
-                reverse=True
-            )
-            optimal_locations[chunk_id] = [peer for peer, _ in ranked_peers[:3]]
+        for chunk_id in availability.rarest_first(chunk_locations):
+            peers = chunk_locations[chunk_id]
+            reliable = [peer for peer in peers if self.is_peer_reliable(peer, now)]
+            optimal_locations[chunk_id] = heapq.nlargest(per_chunk, reliable, key=self.get_speed)
 
         return optimal_locations
 
-    def get_peer_ranking(self) -> List[Tuple[str, float]]:
-        return sorted(
-            [(peer, stats.get('speed', 0)) 
-             for peer, stats in self.peer_stats.items()],
-            key=lambda x: x[1],
-            reverse=True
-        )
+    def get_peer_ranking(self, count: Optional[int] = None,
+                         reliable_only: bool = False) -> List[Tuple[str, float]]:
+        # 从堆顶依次弹出有效记录，取够 count 个后把弹出的记录放回
+        now = time.time()
+        limit = len(self.peer_stats) if count is None else count
+        ranking = []
+        popped = []
+        while self._heap and len(ranking) < limit:
+            entry = heapq.heappop(self._heap)
+            neg_speed, version, peer_url = entry
+            if self._versions.get(peer_url) != version:
+                continue
+            popped.append(entry)
+            if not reliable_only or self.is_peer_reliable(peer_url, now):
+                ranking.append((peer_url, -neg_speed))
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return ranking
 
     def reset_stats(self):
         self.peer_stats.clear()
-        self.last_update.clear()
+        self._heap.clear()
+        self._versions.clear()
 
     def get_best_peers(self, count: int = 5) -> List[str]:
-        ranked_peers = self.get_peer_ranking()
-        return [peer for peer, _ in ranked_peers[:count]]
+        return [peer for peer, _ in self.get_peer_ranking(count, reliable_only=True)]
 
-    def is_peer_reliable(self, peer_url: str) -> bool:
-        stats = self.peer_stats.get(peer_url, {})
-        return stats.get('failures', 0) < 3 and stats.get('speed', 0) > 0
+    def is_peer_reliable(self, peer_url: str, now: Optional[float] = None) -> bool:
+        stats = self.peer_stats.get(peer_url)
+        if stats is None:
+            return False
+        return self.get_failures(peer_url, now) < self.max_failures and stats['speed'] > 0
 
     async def retest_slow_peers(self, speed_threshold: float = 100 * 1024):
         slow_peers = [
             peer for peer, stats in self.peer_stats.items()
-            if stats.get('speed', 0) < speed_threshold
+            if stats['speed'] < speed_threshold
         ]
-        
+
         test_tasks = [self.test_peer_speed(peer) for peer in slow_peers]
         if test_tasks:
             await asyncio.gather(*test_tasks)
@@ -0,0 +1,178 @@
+import random
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class PieceAvailability:
+    # 块可用性索引：块 -> 持有它的对端，对端 -> 位图（与 BitTorrent 相同，高位在前）。
+    # 还需要下载且未派发的块按持有者数量分桶，对端宣告或离开时只移动受影响的块，
+    # 最稀有优先选块从持有者最少的非空桶开始找。桶是列表加位置索引，
+    # 随机取一个和删除都是 O(1)；取走的块进入 in_flight，失败后 requeue 放回桶里
+    def __init__(self, piece_count: int):
+        self.piece_count = piece_count
+        self.holders: Dict[int, Set[str]] = {}
+        self.bitfields: Dict[str, bytearray] = {}
+        self.counts = [0] * piece_count
+        self.wanted: Set[int] = set(range(piece_count))
+        self.in_flight: Set[int] = set()
+        self.buckets: Dict[int, List[int]] = {0: list(range(piece_count))} if piece_count else {}
+        self.positions: Dict[int, int] = {piece: piece for piece in range(piece_count)}
+
+    @classmethod
+    def from_locations(cls, piece_count: int,
+                       chunk_locations: Dict[int, List[str]]) -> 'PieceAvailability':
+        availability = cls(piece_count)
+        for piece, peers in chunk_locations.items():
+            for peer in peers:
+                availability.have(peer, piece)
+        return availability
+
+    @staticmethod
+    def pieces_in(bitfield: bytes) -> List[int]:
+        pieces = []
+        for index, byte in enumerate(bitfield):
+            if not byte:
+                continue
+            for bit in range(8):
+                if byte & (0x80 >> bit):
+                    pieces.append(index * 8 + bit)
+        return pieces
+
+    def _bitfield_for(self, peer: str) -> bytearray:
+        bitfield = self.bitfields.get(peer)
+        if bitfield is None:
+            bitfield = self.bitfields[peer] = bytearray((self.piece_count + 7) // 8)
+        return bitfield
+
+    def _bucket_add(self, piece: int):
+        bucket = self.buckets.setdefault(self.counts[piece], [])
+        self.positions[piece] = len(bucket)
+        bucket.append(piece)
+
+    def _bucket_remove(self, piece: int, count: int):
+        # 与桶尾交换后弹出
+        index = self.positions.pop(piece, None)
+        if index is None:
+            return
+        bucket = self.buckets[count]
+        last = bucket.pop()
+        if last != piece:
+            bucket[index] = last
+            self.positions[last] = index
+        if not bucket:
+            del self.buckets[count]
+
+    def _move(self, piece: int, old_count: int, new_count: int):
+        if piece not in self.positions:
+            return
+        self._bucket_remove(piece, old_count)
+        self._bucket_add(piece)
+
+    def add_peer(self, peer: str, bitfield: Optional[bytes] = None, pieces: Optional[Iterable[int]] = None):
+        # 对端连上时宣告完整位图，或直接给出持有的块号
+        self._bitfield_for(peer)
+        if bitfield is not None:
+            pieces = self.pieces_in(bitfield)
+        for piece in pieces or ():
+            self.have(peer, piece)
+
+    def have(self, peer: str, piece: int) -> bool:
+        # 增量更新：对端宣告新拿到了一个块，返回是否是新信息
+        if not 0 <= piece < self.piece_count:
+            return False
+        bitfield = self._bitfield_for(peer)
+        mask = 0x80 >> (piece % 8)
+        if bitfield[piece // 8] & mask:
+            return False
+        bitfield[piece // 8] |= mask
+        self.holders.setdefault(piece, set()).add(peer)
+        self.counts[piece] += 1
+        self._move(piece, self.counts[piece] - 1, self.counts[piece])
+        return True
+
+    def remove_peer(self, peer: str):
+        # 对端离开：它持有的块的可用性都减一
+        bitfield = self.bitfields.pop(peer, None)
+        if bitfield is None:
+            return
+        for piece in self.pieces_in(bitfield):
+            if piece >= self.piece_count:
+                continue
+            self.holders[piece].discard(peer)
+            if not self.holders[piece]:
+                del self.holders[piece]
+            self.counts[piece] -= 1
+            self._move(piece, self.counts[piece] + 1, self.counts[piece])
+
+    def has(self, peer: str, piece: int) -> bool:
+        bitfield = self.bitfields.get(peer)
+        return bool(bitfield) and 0 <= piece < self.piece_count and bool(bitfield[piece // 8] & (0x80 >> (piece % 8)))
+
+    def availability(self, piece: int) -> int:
+        return self.counts[piece]
+
+    def holders_of(self, piece: int) -> List[str]:
+        return list(self.holders.get(piece, ()))
+
+    def bitfield(self, peer: str) -> bytes:
+        return bytes(self.bitfields.get(peer, b''))
+
+    def mark_complete(self, piece: int):
+        if piece in self.wanted:
+            self.wanted.discard(piece)
+            self.in_flight.discard(piece)
+            self._bucket_remove(piece, self.counts[piece])
+
+    def mark_wanted(self, piece: int):
+        if 0 <= piece < self.piece_count and piece not in self.wanted:
+            self.wanted.add(piece)
+            self._bucket_add(piece)
+
+    def requeue(self, piece: int):
+        # 派发出去的块失败或被放弃，放回桶里等待重新派发
+        if piece in self.in_flight:
+            self.in_flight.discard(piece)
+            if piece in self.wanted:
+                self._bucket_add(piece)
+
+    def pick_rarest(self, peer: Optional[str] = None) -> Optional[int]:
+        # 返回持有者最少（至少一个）的未派发块，同样稀有的块随机挑一个，
+        # 避免所有下载者同时抢同一个块；不同的持有者数量最多是对端数加一，
+        # 不指定 peer 时与块数无关。peer 不为空时只在该对端持有的块中选
+        for count in sorted(self.buckets):
+            if count == 0:
+                continue
+            bucket = self.buckets[count]
+            if peer is None:
+                return bucket[random.randrange(len(bucket))]
+            candidates = [piece for piece in bucket if self.has(peer, piece)]
+            if candidates:
+                return random.choice(candidates)
+        return None
+
+    def take_rarest(self, peer: Optional[str] = None) -> Optional[int]:
+        # 取走最稀有的块并标记为在途，完成时 mark_complete，失败时 requeue
+        piece = self.pick_rarest(peer)
+        if piece is not None:
+            self._bucket_remove(piece, self.counts[piece])
+            self.in_flight.add(piece)
+        return piece
+
+    def take(self, piece: int) -> bool:
+        # 取走指定的块（例如合并进同一个请求的相邻块），块不在桶里（已派发或已完成）时返回 False
+        if piece not in self.positions:
+            return False
+        self._bucket_remove(piece, self.counts[piece])
+        self.in_flight.add(piece)
+        return True
+
+    def rarest_first(self, pieces: Iterable[int]) -> List[int]:
+        return sorted(pieces, key=lambda piece: self.counts[piece])
+
+    def get_stats(self) -> Dict:
+        return {
+            'peers': len(self.bitfields),
+            'wanted': len(self.wanted),
+            'in_flight': len(self.in_flight),
+            'unavailable': len(self.buckets.get(0, ())),
+            'min_availability': min((count for count in self.buckets if count > 0), default=0)
+        }
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class ResumeJournal:
+    MAGIC = b'P2PJ'
+    VERSION = 1
+    HEADER_FORMAT = '<4sBI'
+
+    def __init__(self, journal_path: str, flush_every: int = 64, flush_interval: float = 2.0):
+        self.journal_path = journal_path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.metadata: Dict = {}
+        self.bitmap = bytearray()
+        self.chunk_count = 0
+        self.completed_count = 0
+        # 暂停或取消时中断的块：块号 -> 已写入 .part 的前缀字节数，续传时从这个偏移继续
+        self.partial: Dict[int, int] = {}
+        self.pending_updates = 0
+        self.last_flush = time.time()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Future] = None
+
+    @staticmethod
+    def journal_path_for(temp_dir: str, url: str, output_path: str) -> str:
+        key = f"{url}|{os.path.abspath(output_path)}".encode('utf-8')
+        return os.path.join(temp_dir, hashlib.sha1(key).hexdigest()[:16] + '.journal')
+
+    def reset(self, url: str, output_path: str, file_size: int, chunk_size: int,
+              etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.metadata = {
+            'url': url,
+            'output_path': output_path,
+            'file_size': file_size,
+            'chunk_size': chunk_size,
+            'etag': etag,
+            'last_modified': last_modified
+        }
+        self.chunk_count = (file_size + chunk_size - 1) // chunk_size
+        self.bitmap = bytearray((self.chunk_count + 7) // 8)
+        self.completed_count = 0
+        self.partial = {}
+        self.pending_updates = 0
+
+    def load(self) -> bool:
+        try:
+            with open(self.journal_path, 'rb') as f:
+                magic, version, header_length = struct.unpack(
+                    self.HEADER_FORMAT, f.read(struct.calcsize(self.HEADER_FORMAT)))
+                if magic != self.MAGIC or version != self.VERSION:
+                    return False
+                metadata = json.loads(f.read(header_length).decode('utf-8'))
+                bitmap = bytearray(f.read())
+        except (OSError, ValueError, struct.error):
+            return False
+
+        chunk_count = (metadata['file_size'] + metadata['chunk_size'] - 1) // metadata['chunk_size']
+        if len(bitmap) != (chunk_count + 7) // 8:
+            return False
+        try:
+            partial = {int(chunk_id): int(nbytes) for chunk_id, nbytes in metadata.pop('partial', {}).items()}
+        except (AttributeError, ValueError):
+            partial = {}
+
+        self.metadata = metadata
+        self.partial = {chunk_id: nbytes for chunk_id, nbytes in partial.items()
+                        if 0 <= chunk_id < chunk_count and nbytes > 0}
+        self.chunk_count = chunk_count
+        self.bitmap = bitmap
+        self.completed_count = sum(bin(byte).count('1') for byte in bitmap)
+        self.pending_updates = 0
+        return True
+
+    def matches(self, url: str, file_size: int, chunk_size: int,
+                etag: Optional[str] = None, last_modified: Optional[str] = None) -> bool:
+        # 任一校验值变化都说明远端文件已更新，旧进度作废
+        return (self.metadata.get('url') == url and
+                self.metadata.get('file_size') == file_size and
+                self.metadata.get('chunk_size') == chunk_size and
+                self.metadata.get('etag') == etag and
+                self.metadata.get('last_modified') == last_modified)
+
+    def is_complete(self, chunk_id: int) -> bool:
+        return bool(self.bitmap[chunk_id >> 3] & (1 << (chunk_id & 7)))
+
+    def mark_complete(self, chunk_id: int):
+        if self.is_complete(chunk_id):
+            return
+        self.bitmap[chunk_id >> 3] |= 1 << (chunk_id & 7)
+        self.completed_count += 1
+        self.partial.pop(chunk_id, None)
+        self.pending_updates += 1
+
+    def mark_missing(self, chunk_id: int):
+        if not self.is_complete(chunk_id):
+            return
+        self.bitmap[chunk_id >> 3] &= ~(1 << (chunk_id & 7)) & 0xFF
+        self.completed_count -= 1
+        self.pending_updates += 1
+
+    def mark_partial(self, chunk_id: int, nbytes: int):
+        # 部分数据未经校验，续传时和剩余部分一起按整块校验，不通过就整块重下
+        if self.is_complete(chunk_id) or nbytes <= self.partial.get(chunk_id, 0):
+            return
+        self.partial[chunk_id] = nbytes
+        self.pending_updates += 1
+
+    def partial_bytes(self, chunk_id: int) -> int:
+        return self.partial.get(chunk_id, 0)
+
+    def completed_chunks(self) -> List[int]:
+        return [i for i in range(self.chunk_count) if self.is_complete(i)]
+
+    def missing_chunks(self) -> List[int]:
+        return [i for i in range(self.chunk_count) if not self.is_complete(i)]
+
+    def should_flush(self) -> bool:
+        if self.pending_updates == 0:
+            return False
+        return (self.pending_updates >= self.flush_every or
+                time.time() - self.last_flush >= self.flush_interval)
+
+    def _snapshot(self) -> bytes:
+        # 在事件循环线程生成日志内容，之后的更新计入下一次刷盘
+        metadata = dict(self.metadata, partial=self.partial) if self.partial else self.metadata
+        header = json.dumps(metadata).encode('utf-8')
+        self.pending_updates = 0
+        self.last_flush = time.time()
+        return struct.pack(self.HEADER_FORMAT, self.MAGIC, self.VERSION, len(header)) + header + bytes(self.bitmap)
+
+    def _write(self, content: bytes, sync_data: Optional[Callable[[], None]] = None):
+        # 先落盘数据文件再写日志，日志里标记完成的块一定已经持久化
+        if sync_data is not None:
+            sync_data()
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+        os.replace(temp_path, self.journal_path)
+
+    def flush(self, sync_data: Optional[Callable[[], None]] = None):
+        self._write(self._snapshot(), sync_data)
+
+    def flush_if_needed(self, sync_data: Optional[Callable[[], None]] = None):
+        if self.should_flush():
+            self.flush(sync_data)
+
+    async def flush_async(self, sync_data: Optional[Callable[[], None]] = None):
+        # fsync 和日志写入放到线程池，事件循环上的传输不等磁盘；
+        # 同一时间只有一次刷盘，快照在拿到锁之后生成，不会用旧内容覆盖新内容
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            content = self._snapshot()
+            await asyncio.get_running_loop().run_in_executor(None, self._write, content, sync_data)
+
+    def flush_in_background(self, sync_data: Optional[Callable[[], None]] = None):
+        # 满足刷盘条件且没有刷盘在进行时启动一次后台刷盘，调用方不等待
+        if not self.should_flush() or (self._flush_task is not None and not self._flush_task.done()):
+            return
+        self._flush_task = asyncio.ensure_future(self._background_flush(sync_data))
+
+    async def _background_flush(self, sync_data: Optional[Callable[[], None]] = None):
+        try:
+            await self.flush_async(sync_data)
+        except OSError as e:
+            print(f"Failed to write resume journal: {str(e)}")
+
+    def remove(self):
+        for path in (self.journal_path, self.journal_path + '.tmp'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,192 @@
+import asyncio
+from typing import Callable, List, Optional, Set
+
+import numpy as np
+
+from ..codec.Manifest import Manifest
+
+
+class StripeDownloader:
+    # 纠删码下载：每个条带由 k 个数据分片和 m 个校验分片组成。
+    # 数据分片 i 对应原文件区间 [(s * k + i) * L, (s * k + i + 1) * L)，
+    # 校验分片 j 来自第 j 个校验文件的区间 [s * L, (s + 1) * L)。
+    # 同时请求 n 个分片，任意 k 个到达并通过校验即完成该条带并取消其余请求。
+    # 数据分片就是下载块，按 chunk_hashes（没有时按清单）流式校验；校验分片 j 按 parity_hashes[j][条带] 校验。
+    # 校验失败的分片丢弃，继续等其他分片；由校验分片恢复出的数据块写盘前再按块哈希或清单校验一次
+    def __init__(self, chunk_downloader, rs_codec, shard_size: int, max_stripes: int = 3,
+                 download_id: Optional[str] = None, chunk_hashes: Optional[List[str]] = None,
+                 manifest: Optional[Manifest] = None, parity_hashes: Optional[List[List[str]]] = None):
+        self.chunk_downloader = chunk_downloader
+        self.rs_codec = rs_codec
+        self.shard_size = shard_size
+        self.max_stripes = max(1, max_stripes)
+        self.completed_stripes = set()
+        self.failed_stripes = set()
+        self.decoded_stripes = 0
+        self.rejected_stripes = 0
+        self.download_id = download_id
+        self.chunk_hashes = chunk_hashes
+        self.manifest = manifest
+        self.parity_hashes = parity_hashes
+
+    def stripe_count(self, file_size: int) -> int:
+        stripe_size = self.rs_codec.k * self.shard_size
+        return (file_size + stripe_size - 1) // stripe_size
+
+    def _data_range(self, stripe: int, index: int, file_size: int) -> Optional[tuple]:
+        start = (stripe * self.rs_codec.k + index) * self.shard_size
+        if start >= file_size:
+            return None
+        return start, min(start + self.shard_size, file_size) - 1
+
+    async def _fetch_shard(self, url: str, shard_id: int, start: int, end: int,
+                           expected_hash: Optional[str] = None,
+                           manifest: Optional[Manifest] = None) -> Optional[np.ndarray]:
+        # 校验失败时 download_chunk 返回 None，与分片丢失一样处理
+        _, data = await self.chunk_downloader.download_chunk(url, shard_id, start, end, expected_hash, manifest,
+                                                             download_id=self.download_id)
+        if data is None or len(data) != end - start + 1:
+            return None
+        shard = np.zeros(self.shard_size, dtype=np.uint8)
+        shard[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+        return shard
+
+    async def fetch_stripe(self, stripe: int, file_size: int, data_urls: List[str],
+                           parity_urls: List[Optional[str]]) -> Optional[np.ndarray]:
+        k = self.rs_codec.k
+        shards = {}
+        tasks = {}
+
+        for index in range(k):
+            data_range = self._data_range(stripe, index, file_size)
+            if data_range is None:
+                # 超出文件末尾的数据分片全为零，不需要下载
+                shards[index] = np.zeros(self.shard_size, dtype=np.uint8)
+                continue
+            url = data_urls[(stripe + index) % len(data_urls)]
+            chunk_id = stripe * k + index
+            expected_hash = self.chunk_hashes[chunk_id] if self.chunk_hashes else None
+            task = asyncio.create_task(
+                self._fetch_shard(url, chunk_id, data_range[0], data_range[1], expected_hash,
+                                  None if expected_hash else self.manifest))
+            tasks[task] = index
+
+        for parity_index, url in enumerate(parity_urls):
+            if url is None:
+                continue
+            start = stripe * self.shard_size
+            expected_hash = None
+            if self.parity_hashes and parity_index < len(self.parity_hashes):
+                expected_hash = self.parity_hashes[parity_index][stripe]
+            task = asyncio.create_task(
+                self._fetch_shard(url, stripe * self.rs_codec.n + k + parity_index,
+                                  start, start + self.shard_size - 1, expected_hash))
+            tasks[task] = k + parity_index
+
+        pending = set(tasks)
+        try:
+            while len(shards) < k and pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.cancelled() and task.exception() is None and task.result() is not None:
+                        shards[tasks[task]] = task.result()
+        finally:
+            # 凑齐 k 个分片后其余请求全部取消，慢节点不拖累尾延迟
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if len(shards) < k:
+            return None
+
+        indices = tuple(sorted(shards)[:k])
+        if indices == tuple(range(k)):
+            return np.stack([shards[i] for i in indices])
+
+        stacked = np.stack([shards[i] for i in indices])
+        data = self.rs_codec.decode_stripes(stacked[None], indices)[0]
+        if not self._verify_reconstructed(stripe, data, [i for i in range(k) if i not in shards], file_size):
+            self.rejected_stripes += 1
+            print(f"Stripe {stripe} failed verification after reconstruction")
+            return None
+        self.decoded_stripes += 1
+        return data
+
+    def _verify_reconstructed(self, stripe: int, data: np.ndarray, indices: List[int], file_size: int) -> bool:
+        # 只有恢复出的数据块需要校验，直接下载的分片已在接收时校验过；没有块哈希和清单时无从校验
+        validator = self.chunk_downloader.chunk_validator
+        for index in indices:
+            data_range = self._data_range(stripe, index, file_size)
+            if data_range is None:
+                continue
+            chunk_id = stripe * self.rs_codec.k + index
+            chunk = data[index][:data_range[1] - data_range[0] + 1].tobytes()
+            if self.chunk_hashes:
+                if not validator.validate_chunk(chunk, self.chunk_hashes[chunk_id]):
+                    return False
+            elif self.manifest is not None:
+                for block in self.manifest.chunk_blocks(chunk_id):
+                    block_start, block_end = self.manifest.block_range(block)
+                    offset = block_start - data_range[0]
+                    if not self.manifest.verify_block(block, chunk[offset:offset + block_end - block_start + 1]):
+                        return False
+        return True
+
+    async def download_stripes(self, stripes: List[int], file_size: int, data_urls: List[str],
+                               parity_urls: List[Optional[str]], chunk_writer=None,
+                               progress_callback=None,
+                               stripe_callback: Optional[Callable[[int], None]] = None) -> Set[int]:
+        self.completed_stripes = set()
+        self.failed_stripes = set()
+        queue = asyncio.Queue(maxsize=self.max_stripes * 2)
+        total_stripes = len(stripes)
+
+        async def produce():
+            for stripe in stripes:
+                await queue.put(stripe)
+            for _ in range(self.max_stripes):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                stripe = await queue.get()
+                try:
+                    if stripe is None:
+                        return
+                    data = await self.fetch_stripe(stripe, file_size, data_urls, parity_urls)
+                    if data is None:
+                        self.failed_stripes.add(stripe)
+                        continue
+                    stripe_bytes = await self._store_stripe(stripe, data, file_size, chunk_writer)
+                    data = None
+                    self.completed_stripes.add(stripe)
+                    if stripe_callback:
+                        stripe_callback(stripe)
+                    if progress_callback:
+                        await progress_callback(len(self.completed_stripes) / total_stripes, stripe_bytes)
+                finally:
+                    queue.task_done()
+
+        tasks = [asyncio.create_task(produce())]
+        tasks.extend(asyncio.create_task(work()) for _ in range(self.max_stripes))
+        cancelled = False
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # 被取消时 gather 已经取消了工作协程，不再重复取消，让它们等分片请求退出、连接交还后再返回
+            if not cancelled:
+                for task in tasks:
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return self.completed_stripes
+
+    async def _store_stripe(self, stripe: int, data: np.ndarray, file_size: int, chunk_writer) -> int:
+        start = stripe * self.rs_codec.k * self.shard_size
+        length = min(self.rs_codec.k * self.shard_size, file_size - start)
+        await chunk_writer.write(start, data.reshape(-1)[:length].tobytes())
+        return length
@@ -1,5 +1,11 @@
 from .ChunkDownloader import ChunkDownloader
+from .ChunkScheduler import ChunkScheduler
+from .ChunkWriter import ChunkWriter
 from .DownloadManager import DownloadManager
 from .PeerSelector import PeerSelector
+from .PieceAvailability import PieceAvailability
+from .ResumeJournal import ResumeJournal
+from .StripeDownloader import StripeDownloader
 
-__all__ = ['ChunkDownloader', 'DownloadManager', 'PeerSelector']
+__all__ = ['ChunkDownloader', 'ChunkScheduler', 'ChunkWriter', 'DownloadManager',
+           'PeerSelector', 'PieceAvailability', 'ResumeJournal', 'StripeDownloader']
@@ -1,17 +1,106 @@
 import time
 from typing import Dict, Optional
-import asyncio
 from collections import deque
+from urllib.parse import urlsplit
+from .TokenBucket import TokenBucket
+from .WeightedFairQueue import WeightedFairQueue
 
 class BandwidthManager:
-    def __init__(self, max_bandwidth: float = float('inf'), window_size: int = 10):
+    def __init__(self, max_bandwidth: float = float('inf'), window_size: int = 10,
+                 max_peer_bandwidth: float = 0, max_upload_bandwidth: float = 0):
         self.max_bandwidth = max_bandwidth
         self.window_size = window_size
-        self.transfer_history = deque(maxlen=window_size)
+        # 窗口内的传输记录和字节总数，过期记录从队头移除，统计是均摊 O(1) 的
+        self.transfer_history = deque()
+        self.window_bytes = 0
         self.active_transfers = {}
         self.total_bytes_transferred = 0
         self.last_update = time.time()
 
+        # 三级令牌桶：全局、每个下载任务、每个对端，读取数据时同时从三级取令牌
+        self.global_bucket = TokenBucket(max_bandwidth)
+        # 全局上限由多个下载任务按权重公平分享
+        self.fair_queue = WeightedFairQueue(self.global_bucket)
+        self.max_peer_bandwidth = max_peer_bandwidth
+        self.download_buckets: Dict[str, TokenBucket] = {}
+        self.peer_buckets: Dict[str, TokenBucket] = {}
+        # 上传单独一个令牌桶，做种不占用下载的额度
+        self.max_upload_bandwidth = max_upload_bandwidth
+        self.upload_bucket = TokenBucket(max_upload_bandwidth)
+        self.total_bytes_uploaded = 0
+
+    def set_max_bandwidth(self, max_bandwidth: float):
+        self.max_bandwidth = max_bandwidth
+        self.global_bucket.set_rate(max_bandwidth)
+
+    def set_max_upload_bandwidth(self, max_upload_bandwidth: float):
+        self.max_upload_bandwidth = max_upload_bandwidth
+        self.upload_bucket.set_rate(max_upload_bandwidth)
+
+    def set_download_limit(self, download_id: str, max_speed: float, weight: Optional[float] = None):
+        bucket = self.download_buckets.get(download_id)
+        if bucket is None:
+            self.download_buckets[download_id] = TokenBucket(max_speed)
+        else:
+            bucket.set_rate(max_speed)
+        if weight is not None:
+            self.fair_queue.set_weight(download_id, weight)
+
+    def set_download_weight(self, download_id: str, weight: float):
+        self.fair_queue.set_weight(download_id, weight)
+
+    def remove_download(self, download_id: str):
+        self.download_buckets.pop(download_id, None)
+        self.fair_queue.remove_flow(download_id)
+
+    def set_peer_limit(self, max_peer_bandwidth: float):
+        self.max_peer_bandwidth = max_peer_bandwidth
+        for bucket in self.peer_buckets.values():
+            bucket.set_rate(max_peer_bandwidth)
+
+    @staticmethod
+    def peer_key(url: str) -> str:
+        # 同一主机上的多个地址共用一个对端限速
+        return urlsplit(url).netloc or url
+
+    def _peer_bucket(self, peer: str) -> Optional[TokenBucket]:
+        if not self.max_peer_bandwidth or self.max_peer_bandwidth <= 0:
+            return None
+        key = self.peer_key(peer)
+        bucket = self.peer_buckets.get(key)
+        if bucket is None:
+            bucket = self.peer_buckets[key] = TokenBucket(self.max_peer_bandwidth)
+        return bucket
+
+    async def consume(self, nbytes: int, download_id: Optional[str] = None, peer: Optional[str] = None):
+        # 每次从网络读取 nbytes 后调用，超出任一级的速率上限时等待相应的时间。
+        # 属于某个下载任务的数据经加权公平队列从全局令牌桶取令牌
+        self._record(nbytes, time.time())
+        global_bucket = self.global_bucket
+        if download_id is not None and not global_bucket.unlimited:
+            await self.fair_queue.acquire(download_id, nbytes)
+            global_bucket = None
+        buckets = (global_bucket,
+                   self.download_buckets.get(download_id) if download_id is not None else None,
+                   self._peer_bucket(peer) if peer is not None else None)
+        await TokenBucket.acquire_all(buckets, nbytes)
+
+    async def consume_upload(self, nbytes: int, peer: Optional[str] = None):
+        # 每次发送 nbytes 之前调用，超出上传上限时等待
+        self.total_bytes_uploaded += nbytes
+        await self.upload_bucket.acquire(nbytes)
+
+    def _record(self, nbytes: int, timestamp: float):
+        self.transfer_history.append((timestamp, nbytes))
+        self.window_bytes += nbytes
+        self.total_bytes_transferred += nbytes
+        self._expire(timestamp)
+
+    def _expire(self, current_time: float):
+        window_start = current_time - self.window_size
+        while self.transfer_history and self.transfer_history[0][0] <= window_start:
+            self.window_bytes -= self.transfer_history.popleft()[1]
+
     def start_transfer(self, transfer_id: str):
         self.active_transfers[transfer_id] = {
             'bytes_transferred': 0,
@@ -32,43 +121,32 @@ class BandwidthManager:
             transfer['speed'] = bytes_transferred / time_diff
             transfer['bytes_transferred'] += bytes_transferred
             transfer['last_update'] = current_time
-            self.total_bytes_transferred += bytes_transferred
-
-            self.transfer_history.append({
-                'timestamp': current_time,
-                'bytes': bytes_transferred
-            })
+            self._record(bytes_transferred, current_time)
 
     def end_transfer(self, transfer_id: str):
         if transfer_id in self.active_transfers:
             del self.active_transfers[transfer_id]
 
     def get_current_bandwidth(self) -> float:
-        if not self.transfer_history:
-            return 0.0
-
         current_time = time.time()
-        window_start = current_time - self.window_size
-        recent_transfers = [t for t in self.transfer_history 
-                          if t['timestamp'] > window_start]
-
-        if not recent_transfers:
+        self._expire(current_time)
+        if not self.transfer_history:
             return 0.0
 
-        total_bytes = sum(t['bytes'] for t in recent_transfers)
-        time_span = current_time - recent_transfers[0]['timestamp']
-        return total_bytes / time_span if time_span > 0 else 0.0
+        time_span = current_time - self.transfer_history[0][0]
+        return self.window_bytes / time_span if time_span > 0 else 0.0
 
-    async def throttle_if_needed(self):
-        current_bandwidth = self.get_current_bandwidth()
-        if current_bandwidth > self.max_bandwidth:
-            await asyncio.sleep(0.1)
+    async def throttle_if_needed(self, nbytes: int = 0):
+        # 兼容旧接口：按全局令牌桶的欠款等待
+        await self.global_bucket.acquire(nbytes)
 
     def get_transfer_stats(self, transfer_id: str) -> Optional[Dict]:
         return self.active_transfers.get(transfer_id)
 
     def reset_stats(self):
         self.transfer_history.clear()
+        self.window_bytes = 0
         self.active_transfers.clear()
         self.total_bytes_transferred = 0
+        self.total_bytes_uploaded = 0
         self.last_update = time.time()
@@ -1,16 +1,46 @@
 import asyncio
-import aiohttp
 from typing import Dict, Optional, List, Tuple
 import time
-import json
+import uuid
+from .Transport import Transport
+from .WireProtocol import (WireProtocol, MSG_BITFIELD, MSG_HANDSHAKE, MSG_HAVE,
+                           MSG_PIECE, MSG_REJECT)
 
 class PeerConnection:
-    def __init__(self, peer_id: str, host: str, port: int):
+    # 连接其他节点 PeerServer 的客户端（二进制协议，HTTP 回退）；
+    # 从 HTTP 源和镜像下载走 ChunkDownloader / ChunkScheduler，不经过这里
+    def __init__(self, peer_id: str, host: str, port: int, transport: Optional[Transport] = None,
+                 wire_port: Optional[int] = None, resource: str = '', chunk_size: int = 1024 * 1024,
+                 pipeline_depth: int = 16, timeout: float = 30.0, availability=None):
         self.peer_id = peer_id
         self.host = host
         self.port = port
+        # 所有对端共用一个传输层，断开连接只是不再使用，连接池里的保持连接留给后续请求
+        self.transport = transport or Transport()
+        self.owns_transport = transport is None
         self.session = None
         self.is_connected = False
+        # 给出 wire_port 时优先使用二进制协议，握手失败再退回 HTTP；
+        # resource 是要交换的文件名，块按 chunk_size 编号
+        self.wire_port = wire_port
+        self.resource = resource
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.local_peer_id = uuid.uuid4().hex
+        self.protocol = None
+        self.wire: Optional[WireProtocol] = None
+        self.peer_info = None
+        self.peer_bitfield = bytearray()
+        # 可选的 PieceAvailability，对端的 bitfield 和 have 消息直接更新到索引中
+        self.availability = availability
+        # 流水线：最多 pipeline_depth 个请求在途，响应按 (块号, 偏移, 长度) 匹配到等待的 future，
+        # 同一偏移上长度不同的请求互不混淆
+        self.pipeline_depth = pipeline_depth
+        self._pipeline = asyncio.Semaphore(pipeline_depth)
+        self._pending: Dict[Tuple[int, int, int], asyncio.Future] = {}
+        # 每个请求上等待的调用方个数，最后一个调用方被取消时才撤销请求
+        self._waiters: Dict[Tuple[int, int, int], int] = {}
+        self._reader_task = None
         self.stats = {
             'bytes_sent': 0,
             'bytes_received': 0,
@@ -22,10 +52,14 @@ class PeerConnection:
         if self.is_connected:
             return True
 
+        if self.wire_port and await self._connect_wire():
+            return True
+
         try:
-            self.session = aiohttp.ClientSession()
+            self.session = await self.transport.start()
             async with self.session.get(f"http://{self.host}:{self.port}/ping") as response:
                 if response.status == 200:
+                    self.protocol = 'http'
                     self.is_connected = True
                     return True
         except Exception as e:
@@ -33,13 +67,164 @@ class PeerConnection:
             self.stats['last_error'] = str(e)
         return False
 
+    async def _connect_wire(self) -> bool:
+        wire = None
+        try:
+            wire = await WireProtocol.open(self.host, self.wire_port, self.timeout)
+            info = await wire.handshake(self.local_peer_id, self.resource, self.chunk_size, self.timeout)
+            if info is None or info['resource'] != self.resource:
+                raise Exception("Handshake rejected")
+            self.wire = wire
+            self.peer_info = info
+            self.protocol = 'wire'
+            self.is_connected = True
+            self._reader_task = asyncio.create_task(self._read_loop())
+            return True
+        except Exception as e:
+            self.stats['failed_attempts'] += 1
+            self.stats['last_error'] = str(e)
+            if wire is not None:
+                await wire.close()
+            return False
+
+    async def _read_loop(self):
+        wire = self.wire
+        try:
+            while True:
+                msg_id, payload = await wire.read_message()
+                if msg_id == MSG_PIECE:
+                    piece, begin, data = WireProtocol.parse_piece(payload)
+                    self.stats['bytes_received'] += len(data)
+                    # 数据消息不带长度字段，负载长度就是请求的长度
+                    future = self._pending.pop((piece, begin, len(data)), None)
+                    if future is not None and not future.done():
+                        future.set_result(data)
+                elif msg_id == MSG_REJECT:
+                    future = self._pending.pop(WireProtocol.parse_address(payload), None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+                elif msg_id == MSG_HAVE:
+                    self._mark_have(WireProtocol.parse_have(payload))
+                elif msg_id == MSG_BITFIELD:
+                    self.peer_bitfield = bytearray(payload)
+                    if self.availability is not None:
+                        self.availability.add_peer(self.peer_id, bitfield=self.peer_bitfield)
+                elif msg_id == MSG_HANDSHAKE:
+                    continue
+        except Exception as e:
+            if not isinstance(e, asyncio.IncompleteReadError):
+                self.stats['last_error'] = str(e)
+        finally:
+            # 连接断开：等待中的请求都以 None 结束
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_result(None)
+            self._pending.clear()
+            if self.wire is wire:
+                self.is_connected = False
+
+    def _mark_have(self, piece: int):
+        index = piece // 8
+        if index >= len(self.peer_bitfield):
+            self.peer_bitfield.extend(bytes(index + 1 - len(self.peer_bitfield)))
+        self.peer_bitfield[index] |= 0x80 >> (piece % 8)
+        if self.availability is not None:
+            self.availability.have(self.peer_id, piece)
+
+    def has_piece(self, piece: int) -> bool:
+        index = piece // 8
+        return index < len(self.peer_bitfield) and bool(self.peer_bitfield[index] & (0x80 >> (piece % 8)))
+
     async def disconnect(self):
-        if self.session:
-            await self.session.close()
+        if self.wire is not None:
+            await self.wire.close()
+            self.wire = None
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+        if self.owns_transport:
+            await self.transport.close()
+        self.session = None
+        self.protocol = None
         self.is_connected = False
 
-    async def send_data(self, data: bytes) -> bool:
+    async def request_piece(self, piece: int, begin: int = 0, length: Optional[int] = None):
+        # 返回块数据（二进制协议下是指向接收缓冲区的 memoryview），失败或被拒绝时返回 None。
+        # 多个请求并发调用时自动形成流水线，不必等上一个响应回来再发下一个请求
         if not self.is_connected:
+            return None
+        length = length or self.chunk_size
+        if self.wire is None:
+            return await self._http_request_piece(piece, begin, length)
+
+        key = (piece, begin, length)
+        async with self._pipeline:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = asyncio.get_running_loop().create_future()
+                try:
+                    self.wire.send_request(piece, begin, length)
+                    await self.wire.drain()
+                except Exception as e:
+                    self._pending.pop(key, None)
+                    self.stats['failed_attempts'] += 1
+                    self.stats['last_error'] = str(e)
+                    return None
+            # 超时用定时回调取消，每个请求不再额外创建 wait_for 的任务
+            timer = asyncio.get_running_loop().call_later(self.timeout, self.cancel_piece, piece, begin, length)
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            try:
+                return await asyncio.shield(future)
+            finally:
+                timer.cancel()
+                waiters = self._waiters.pop(key) - 1
+                if waiters:
+                    self._waiters[key] = waiters
+                elif not future.done() and self._pending.get(key) is future:
+                    # 调用方被取消且没有其他调用方在等：移除 future，并通知对端不必再发送
+                    self.cancel_piece(piece, begin, length)
+
+    async def request_pieces(self, requests: List[Tuple[int, int, int]]) -> Dict[Tuple[int, int, int], Optional[bytes]]:
+        # requests: [(块号, 偏移, 长度)]，最多 pipeline_depth 个同时在途；结果按同样的三元组索引
+        results = await asyncio.gather(*(self.request_piece(piece, begin, length)
+                                         for piece, begin, length in requests))
+        return {tuple(request): data for request, data in zip(requests, results)}
+
+    def cancel_piece(self, piece: int, begin: int, length: int):
+        future = self._pending.pop((piece, begin, length), None)
+        if future is not None and not future.done():
+            future.set_result(None)
+        if self.wire is not None and not self.wire.is_closing:
+            self.wire.send_cancel(piece, begin, length)
+
+    def send_have(self, piece: int) -> bool:
+        # 告诉对端本地新完成了一个块，只有二进制协议支持
+        if self.wire is None or self.wire.is_closing:
+            return False
+        self.wire.send_have(piece)
+        return True
+
+    async def _http_request_piece(self, piece: int, begin: int, length: int) -> Optional[bytes]:
+        # HTTP 回退：对 /data/<resource> 发 Range 请求
+        start = piece * self.chunk_size + begin
+        try:
+            async with self.session.get(
+                f"http://{self.host}:{self.port}/data/{self.resource}",
+                headers={'Range': f'bytes={start}-{start + length - 1}'}
+            ) as response:
+                if response.status == 206:
+                    data = await response.read()
+                    self.stats['bytes_received'] += len(data)
+                    return data
+        except Exception as e:
+            self.stats['failed_attempts'] += 1
+            self.stats['last_error'] = str(e)
+        return None
+
+    async def send_data(self, data: bytes) -> bool:
+        # 只有 HTTP 连接有会话；二进制协议连接上没有对应的消息
+        if not self.is_connected or self.session is None:
             return False
 
         try:
@@ -56,7 +241,7 @@ class PeerConnection:
         return False
 
     async def receive_data(self) -> Optional[bytes]:
-        if not self.is_connected:
+        if not self.is_connected or self.session is None:
             return None
 
         try:
@@ -74,6 +259,12 @@ class PeerConnection:
 
     async def ping(self) -> float:
         start_time = time.time()
+        if self.wire is not None:
+            # 二进制连接上请求一个字节，数据或拒绝消息回来都算一次往返
+            await self.request_piece(0, 0, 1)
+            return time.time() - start_time if self.is_connected else float('inf')
+        if self.session is None:
+            return float('inf')
         try:
             async with self.session.get(
                 f"http://{self.host}:{self.port}/ping"
@@ -85,6 +276,10 @@ class PeerConnection:
         return float('inf')
 
     async def get_peer_info(self) -> Optional[Dict]:
+        if self.peer_info is not None:
+            return dict(self.peer_info)
+        if self.session is None:
+            return None
         try:
             async with self.session.get(
                 f"http://{self.host}:{self.port}/info"
@@ -0,0 +1,269 @@
+import asyncio
+import mmap
+import os
+import uuid
+from collections import deque
+from typing import Dict, Optional
+from aiohttp import web
+from .BandwidthManager import BandwidthManager
+from .WireProtocol import (WireProtocol, MSG_CANCEL, MSG_HANDSHAKE, MSG_KEEPALIVE, MSG_REQUEST)
+
+
+class PeerServer:
+    # 做种服务：把 root_dir 下已完成的文件提供给其他节点。
+    # HTTP 端口提供 /ping、/info 和 /data/<文件名>（支持 Range）；wire_port 上是二进制协议。
+    # 数据用 sendfile 直接从页缓存发出，设置了上传限速时改为 mmap 切片边发边取令牌；
+    # 同时进行的上传不超过 max_uploads 个，HTTP 请求超出时返回 503，二进制协议的请求排队等待
+    def __init__(self, root_dir: str, host: str = '127.0.0.1', port: int = 8000,
+                 wire_port: Optional[int] = None, bandwidth_manager: Optional[BandwidthManager] = None,
+                 max_uploads: int = 8, read_size: int = 64 * 1024, max_piece_size: int = 16 * 1024 * 1024):
+        self.root_dir = os.path.realpath(root_dir)
+        self.host = host
+        self.port = port
+        self.wire_port = wire_port
+        self.bandwidth_manager = bandwidth_manager
+        self.max_uploads = max(1, max_uploads)
+        self.read_size = read_size
+        self.max_piece_size = max_piece_size
+        self.peer_id = uuid.uuid4().hex
+        self._upload_slots = asyncio.Semaphore(self.max_uploads)
+        self._runner: Optional[web.AppRunner] = None
+        self._wire_server: Optional[asyncio.AbstractServer] = None
+        self._wire_connections = set()
+        self.stats = {
+            'active_uploads': 0,
+            'bytes_uploaded': 0,
+            'requests_served': 0,
+            'requests_rejected': 0
+        }
+
+    @classmethod
+    def from_config(cls, config, bandwidth_manager: Optional[BandwidthManager] = None) -> 'PeerServer':
+        return cls(config.get('storage.download_path', 'downloads'),
+                   host=config.get('network.listen_host', '127.0.0.1'),
+                   port=config.get('network.port', 8000),
+                   wire_port=config.get('network.wire_port') or None,
+                   bandwidth_manager=bandwidth_manager,
+                   max_uploads=config.get('network.max_uploads', 8))
+
+    @property
+    def is_running(self) -> bool:
+        return self._runner is not None
+
+    async def start(self) -> bool:
+        if self.is_running:
+            return True
+        try:
+            app = web.Application()
+            app.router.add_get('/ping', self._handle_ping)
+            app.router.add_get('/info', self._handle_info)
+            app.router.add_get('/data/{name:.+}', self._handle_data)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            if self.wire_port:
+                self._wire_server = await asyncio.start_server(self._handle_wire, self.host, self.wire_port)
+            print(f"Seeding {self.root_dir} on port {self.port}" +
+                  (f" (wire protocol on {self.wire_port})" if self.wire_port else ""))
+            return True
+        except Exception as e:
+            print(f"Failed to start peer server: {str(e)}")
+            await self.stop()
+            return False
+
+    async def stop(self):
+        if self._wire_server is not None:
+            self._wire_server.close()
+            for wire in list(self._wire_connections):
+                await wire.close()
+            await self._wire_server.wait_closed()
+            self._wire_server = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def resolve(self, name: str) -> Optional[str]:
+        # 只提供 root_dir 之内已完成的普通文件，未完成的 .part 和目录外的路径都不提供
+        path = os.path.realpath(os.path.join(self.root_dir, name))
+        if not path.startswith(self.root_dir + os.sep) or path.endswith('.part'):
+            return None
+        return path if os.path.isfile(path) else None
+
+    def list_files(self) -> Dict[str, int]:
+        files = {}
+        for directory, _, names in os.walk(self.root_dir):
+            for name in names:
+                if name.endswith('.part'):
+                    continue
+                path = os.path.join(directory, name)
+                files[os.path.relpath(path, self.root_dir).replace(os.sep, '/')] = os.path.getsize(path)
+        return files
+
+    @property
+    def _throttled(self) -> bool:
+        return self.bandwidth_manager is not None and not self.bandwidth_manager.upload_bucket.unlimited
+
+    async def _throttle(self, nbytes: int, peer: Optional[str]):
+        if self.bandwidth_manager is not None:
+            await self.bandwidth_manager.consume_upload(nbytes, peer)
+
+    async def _handle_ping(self, request: web.Request) -> web.Response:
+        return web.Response(text='pong')
+
+    async def _handle_info(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'peer_id': self.peer_id,
+            'wire_port': self.wire_port,
+            'files': self.list_files(),
+            'stats': dict(self.stats)
+        })
+
+    async def _handle_data(self, request: web.Request) -> web.StreamResponse:
+        path = self.resolve(request.match_info['name'])
+        if path is None:
+            raise web.HTTPNotFound()
+        if self._upload_slots.locked():
+            self.stats['requests_rejected'] += 1
+            raise web.HTTPServiceUnavailable(headers={'Retry-After': '1'})
+
+        file_size = os.path.getsize(path)
+        try:
+            http_range = request.http_range
+        except ValueError:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{file_size}'})
+        start, stop, _ = http_range.indices(file_size)
+        partial = http_range.start is not None or http_range.stop is not None
+        if partial and start >= stop:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f'bytes */{file_size}'})
+
+        async with self._upload_slots:
+            self.stats['active_uploads'] += 1
+            try:
+                response = web.StreamResponse(status=206 if partial else 200)
+                response.content_length = stop - start
+                response.content_type = 'application/octet-stream'
+                response.headers['Accept-Ranges'] = 'bytes'
+                if partial:
+                    response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{file_size}'
+                await response.prepare(request)
+                if request.method != 'HEAD':
+                    with open(path, 'rb') as f:
+                        await self._send_file(request, response, f, start, stop)
+                await response.write_eof()
+                self.stats['requests_served'] += 1
+                return response
+            finally:
+                self.stats['active_uploads'] -= 1
+
+    async def _send_file(self, request: web.Request, response: web.StreamResponse, f, start: int, stop: int):
+        if start >= stop:
+            # 空文件无法映射，也没有数据要发
+            return
+        if not self._throttled and request.transport is not None:
+            # 不限速时用 sendfile 直接从页缓存发到套接字
+            try:
+                await asyncio.get_running_loop().sendfile(request.transport, f, start, stop - start)
+                self.stats['bytes_uploaded'] += stop - start
+                return
+            except NotImplementedError:
+                pass
+        # 限速时把文件映射到内存，按 read_size 切片，每片先取令牌再发送
+        peer = request.remote
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(start, stop, self.read_size):
+                data = mapped[offset:min(offset + self.read_size, stop)]
+                await self._throttle(len(data), peer)
+                await response.write(data)
+                self.stats['bytes_uploaded'] += len(data)
+
+    async def _handle_wire(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        wire = WireProtocol(reader, writer)
+        self._wire_connections.add(wire)
+        peer = writer.get_extra_info('peername')
+        peer = peer[0] if peer else None
+        f = None
+        writer_task = None
+        try:
+            msg_id, payload = await asyncio.wait_for(wire.read_message(), 30)
+            info = WireProtocol.parse_handshake(payload) if msg_id == MSG_HANDSHAKE else None
+            path = self.resolve(info['resource']) if info else None
+            if path is None or not info['chunk_size']:
+                return
+            f = open(path, 'rb')
+            file_size = os.fstat(f.fileno()).st_size
+            chunk_size = info['chunk_size']
+            wire.send_handshake(self.peer_id, info['resource'], chunk_size, file_size)
+            # 已完成的文件持有全部块
+            piece_count = (file_size + chunk_size - 1) // chunk_size
+            bitfield = bytearray(b'\xff' * (piece_count // 8))
+            if piece_count % 8:
+                bitfield.append((0xff << (8 - piece_count % 8)) & 0xff)
+            wire.send_bitfield(bitfield)
+            await wire.drain()
+
+            # 请求按到达顺序放进队列，由单独的发送协程依次发出；取消消息直接从队列删除，
+            # 已经发出或不在队列里的请求忽略
+            queue = deque()
+            wakeup = asyncio.Event()
+            writer_task = asyncio.create_task(
+                self._wire_sender(wire, f, file_size, chunk_size, queue, wakeup, peer))
+            while True:
+                msg_id, payload = await wire.read_message()
+                if msg_id == MSG_REQUEST:
+                    queue.append(WireProtocol.parse_address(payload))
+                    wakeup.set()
+                elif msg_id == MSG_CANCEL:
+                    try:
+                        queue.remove(WireProtocol.parse_address(payload))
+                    except ValueError:
+                        pass
+                elif msg_id == MSG_KEEPALIVE:
+                    continue
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            print(f"Wire connection from {peer} failed: {str(e)}")
+        finally:
+            if writer_task is not None:
+                writer_task.cancel()
+                await asyncio.gather(writer_task, return_exceptions=True)
+            if f is not None:
+                f.close()
+            self._wire_connections.discard(wire)
+            await wire.close()
+
+    async def _wire_sender(self, wire: WireProtocol, f, file_size: int, chunk_size: int,
+                           queue: deque, wakeup: asyncio.Event, peer: Optional[str]):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not queue:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            piece, begin, length = queue.popleft()
+            offset = piece * chunk_size + begin
+            if length > self.max_piece_size or begin + length > chunk_size or offset + length > file_size:
+                wire.send_reject(piece, begin, length)
+                self.stats['requests_rejected'] += 1
+                continue
+
+            async with self._upload_slots:
+                self.stats['active_uploads'] += 1
+                try:
+                    wire.send_piece_header(piece, begin, length)
+                    await wire.drain()
+                    # 消息头之后的数据直接用 sendfile 从文件发到套接字；限速时与 HTTP 一样
+                    # 按 read_size 分片，每片先取令牌再发送，不会一次占用整块的令牌
+                    step = self.read_size if self._throttled else length
+                    for position in range(offset, offset + length, step):
+                        size = min(step, offset + length - position)
+                        await self._throttle(size, peer)
+                        await loop.sendfile(wire.writer.transport, f, position, size)
+                        wire.bytes_sent += size
+                        self.stats['bytes_uploaded'] += size
+                finally:
+                    self.stats['active_uploads'] -= 1
+            self.stats['requests_served'] += 1
+
+    def get_stats(self) -> Dict:
+        return dict(self.stats, wire_connections=len(self._wire_connections))
@@ -0,0 +1,58 @@
+import asyncio
+import time
+from typing import Iterable, Optional
+
+
+class TokenBucket:
+    # 令牌桶：每秒补充 rate 个令牌（字节），最多积累 burst 个；rate <= 0 表示不限速。
+    # 取令牌时直接扣除，余额为负时按欠款 / rate 计算等待时间，每次读取都平滑地等待一小段，
+    # 不会出现先超发再整段停顿的情况
+    def __init__(self, rate: float = 0, burst: Optional[float] = None, burst_seconds: float = 0.1):
+        self.burst_seconds = burst_seconds
+        self.rate = 0.0
+        self.burst = 0.0
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+        self.set_rate(rate, burst)
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def set_rate(self, rate: float, burst: Optional[float] = None):
+        now = time.monotonic()
+        if not self.unlimited:
+            self._refill(now)
+        self.rate = float(rate) if rate and rate > 0 and rate != float('inf') else 0.0
+        self.burst = float(burst) if burst else max(self.rate * self.burst_seconds, 1.0)
+        # 新的速率从一个满桶开始，已有的欠款保留
+        self.tokens = self.burst if self.tokens >= 0 else self.tokens
+        self.last_refill = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def take(self, amount: int, now: Optional[float] = None) -> float:
+        # 扣除 amount 个令牌，返回需要等待的秒数
+        if self.unlimited:
+            return 0.0
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= amount
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    async def acquire(self, amount: int):
+        delay = self.take(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def acquire_all(buckets: Iterable[Optional['TokenBucket']], amount: int):
+        # 同时从多级令牌桶取令牌，等待时间取最慢的一级，每级都是 O(1)
+        now = time.monotonic()
+        delay = 0.0
+        for bucket in buckets:
+            if bucket is not None:
+                delay = max(delay, bucket.take(amount, now))
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,79 @@
+import aiohttp
+from typing import Dict, Optional
+
+
+class Transport:
+    # 共享的 HTTP 传输层：所有下载器和对端连接共用一个连接池。
+    # 同一主机的请求复用保持连接，DNS 结果缓存 dns_cache_ttl 秒，每个主机最多 limit_per_host 条连接
+    def __init__(self, limit: int = 100, limit_per_host: int = 16, keepalive_timeout: float = 30.0,
+                 dns_cache_ttl: int = 300):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_resolutions': 0,
+            'dns_cache_hits': 0
+        }
+
+    @classmethod
+    def from_config(cls, config) -> 'Transport':
+        return cls(limit=config.get('network.max_connections', 100),
+                   limit_per_host=config.get('network.max_connections_per_host', 16),
+                   keepalive_timeout=config.get('network.keepalive_timeout', 30),
+                   dns_cache_ttl=config.get('network.dns_cache_ttl', 300))
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        # 统计新建与复用的连接数，用来确认请求确实落在热连接上
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(key: str):
+            async def on_event(session, context, params):
+                self.stats[key] += 1
+            return on_event
+
+        trace_config.on_request_start.append(counter('requests'))
+        trace_config.on_connection_create_end.append(counter('connections_created'))
+        trace_config.on_connection_reuseconn.append(counter('connections_reused'))
+        trace_config.on_dns_resolvehost_end.append(counter('dns_resolutions'))
+        trace_config.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        return trace_config
+
+    @property
+    def is_open(self) -> bool:
+        return self.session is not None and not self.session.closed
+
+    async def start(self) -> aiohttp.ClientSession:
+        if not self.is_open:
+            self.connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                enable_cleanup_closed=True
+            )
+            self.session = aiohttp.ClientSession(connector=self.connector,
+                                                 trace_configs=[self._trace_config()])
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+        self.session = None
+        self.connector = None
+
+    async def __aenter__(self) -> 'Transport':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
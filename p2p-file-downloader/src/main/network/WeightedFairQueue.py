@@ -0,0 +1,61 @@
+import asyncio
+import heapq
+from typing import Dict, List, Optional, Tuple
+from .TokenBucket import TokenBucket
+
+
+class WeightedFairQueue:
+    # 加权公平队列：多个下载任务共用一个令牌桶时，按权重分配带宽。
+    # 每个请求按所属任务计算虚拟完成时间 F = max(V, 该任务上次的 F) + 字节数 / 权重，
+    # 调度协程总是先放行 F 最小的请求；空闲的任务不排队，它的份额自动分给其他任务
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.weights: Dict[str, float] = {}
+        self.finish_tags: Dict[str, float] = {}
+        self.virtual_time = 0.0
+        self._heap: List[Tuple[float, int, float, int, asyncio.Future]] = []
+        self._sequence = 0
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def set_weight(self, flow: str, weight: float):
+        self.weights[flow] = max(float(weight), 1e-6)
+
+    def remove_flow(self, flow: str):
+        self.weights.pop(flow, None)
+        self.finish_tags.pop(flow, None)
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+    async def acquire(self, flow: str, amount: int):
+        if self.bucket.unlimited:
+            return
+        weight = self.weights.get(flow, 1.0)
+        start = max(self.virtual_time, self.finish_tags.get(flow, 0.0))
+        finish = start + amount / weight
+        self.finish_tags[flow] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._heap, (finish, self._sequence, start, amount, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        # 按虚拟完成时间依次取令牌，每次只放行一个请求，总速率由令牌桶保证
+        while self._heap:
+            _, _, start, amount, future = heapq.heappop(self._heap)
+            if future.done():
+                # 等待者已被取消，不占用令牌
+                continue
+            self.virtual_time = max(self.virtual_time, start)
+            delay = self.bucket.take(amount)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not future.done():
+                future.set_result(None)
+                # 让刚放行的任务先把下一个请求排进来再选，
+                # 否则每个任务只有一个请求在排队时只能轮流放行，权重不起作用
+                await asyncio.sleep(0)
@@ -0,0 +1,150 @@
+import asyncio
+import struct
+from typing import Optional, Tuple
+
+# 帧格式：4 字节大端长度（消息号 + 负载）+ 1 字节消息号 + 负载，长度为 0 的帧是保活消息。
+# 消息号沿用 BitTorrent 的编号
+MSG_HAVE = 4
+MSG_BITFIELD = 5
+MSG_REQUEST = 6
+MSG_PIECE = 7
+MSG_CANCEL = 8
+MSG_REJECT = 16
+MSG_HANDSHAKE = 20
+MSG_KEEPALIVE = -1
+
+PROTOCOL_MAGIC = b'P2PW'
+PROTOCOL_VERSION = 1
+
+_LENGTH = struct.Struct('>I')
+_HEADER = struct.Struct('>IB')
+_PIECE_ADDRESS = struct.Struct('>III')
+_PIECE_HEADER = struct.Struct('>IBII')
+_HANDSHAKE_TAIL = struct.Struct('>IQ')
+
+
+class WireProtocol:
+    # 基于 asyncio 流的二进制对端协议。
+    # 请求和取消都是 (块号, 块内偏移, 长度)；数据消息的负载以 memoryview 返回，切片不复制数据，
+    # 发送数据时消息头和数据分别交给 writelines，也不拼接
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 max_message_size: int = 16 * 1024 * 1024 + 64):
+        self.reader = reader
+        self.writer = writer
+        self.max_message_size = max_message_size
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float = 10.0) -> 'WireProtocol':
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return cls(reader, writer)
+
+    @property
+    def is_closing(self) -> bool:
+        return self.writer.is_closing()
+
+    async def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+    def _send(self, msg_id: int, payload: bytes = b''):
+        frame = _HEADER.pack(len(payload) + 1, msg_id) + payload
+        self.writer.write(frame)
+        self.bytes_sent += len(frame)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def read_message(self) -> Tuple[int, memoryview]:
+        # 返回 (消息号, 负载)；连接关闭时抛出 asyncio.IncompleteReadError
+        length = _LENGTH.unpack(await self.reader.readexactly(4))[0]
+        if length == 0:
+            self.bytes_received += 4
+            return MSG_KEEPALIVE, memoryview(b'')
+        if length > self.max_message_size:
+            raise ValueError(f"Message too large: {length} bytes")
+        frame = await self.reader.readexactly(length)
+        self.bytes_received += length + 4
+        view = memoryview(frame)
+        return view[0], view[1:]
+
+    # 握手：协议标识、版本、对端 ID、资源名（要交换的文件）、块大小、文件大小（发起方填 0）
+    def send_handshake(self, peer_id: str, resource: str, chunk_size: int, file_size: int = 0):
+        peer = peer_id.encode('utf-8')
+        name = resource.encode('utf-8')
+        payload = (PROTOCOL_MAGIC + bytes([PROTOCOL_VERSION, len(peer)]) + peer +
+                   struct.pack('>H', len(name)) + name + _HANDSHAKE_TAIL.pack(chunk_size, file_size))
+        self._send(MSG_HANDSHAKE, payload)
+
+    @staticmethod
+    def parse_handshake(payload: memoryview) -> Optional[dict]:
+        try:
+            if bytes(payload[:4]) != PROTOCOL_MAGIC or payload[4] != PROTOCOL_VERSION:
+                return None
+            offset = 6 + payload[5]
+            peer_id = bytes(payload[6:offset]).decode('utf-8')
+            name_length = struct.unpack_from('>H', payload, offset)[0]
+            offset += 2
+            resource = bytes(payload[offset:offset + name_length]).decode('utf-8')
+            chunk_size, file_size = _HANDSHAKE_TAIL.unpack_from(payload, offset + name_length)
+            return {'peer_id': peer_id, 'resource': resource,
+                    'chunk_size': chunk_size, 'file_size': file_size}
+        except Exception:
+            return None
+
+    async def handshake(self, peer_id: str, resource: str, chunk_size: int,
+                        timeout: float = 10.0) -> Optional[dict]:
+        self.send_handshake(peer_id, resource, chunk_size)
+        await self.drain()
+        msg_id, payload = await asyncio.wait_for(self.read_message(), timeout)
+        if msg_id != MSG_HANDSHAKE:
+            return None
+        return self.parse_handshake(payload)
+
+    def send_keepalive(self):
+        self.writer.write(_LENGTH.pack(0))
+        self.bytes_sent += 4
+
+    def send_have(self, piece: int):
+        self._send(MSG_HAVE, _LENGTH.pack(piece))
+
+    def send_bitfield(self, bitfield: bytes):
+        self._send(MSG_BITFIELD, bytes(bitfield))
+
+    def send_request(self, piece: int, begin: int, length: int):
+        self._send(MSG_REQUEST, _PIECE_ADDRESS.pack(piece, begin, length))
+
+    def send_cancel(self, piece: int, begin: int, length: int):
+        self._send(MSG_CANCEL, _PIECE_ADDRESS.pack(piece, begin, length))
+
+    def send_reject(self, piece: int, begin: int, length: int):
+        self._send(MSG_REJECT, _PIECE_ADDRESS.pack(piece, begin, length))
+
+    def send_piece(self, piece: int, begin: int, data):
+        header = _PIECE_HEADER.pack(len(data) + 9, MSG_PIECE, piece, begin)
+        self.writer.writelines((header, data))
+        self.bytes_sent += len(header) + len(data)
+
+    def send_piece_header(self, piece: int, begin: int, length: int):
+        # 只写数据消息的头，随后的 length 字节由调用方直接写入（例如 sendfile）
+        self.writer.write(_PIECE_HEADER.pack(length + 9, MSG_PIECE, piece, begin))
+        self.bytes_sent += _PIECE_HEADER.size
+
+    @staticmethod
+    def parse_have(payload: memoryview) -> int:
+        return _LENGTH.unpack_from(payload)[0]
+
+    @staticmethod
+    def parse_address(payload: memoryview) -> Tuple[int, int, int]:
+        # REQUEST、CANCEL、REJECT 的负载
+        return _PIECE_ADDRESS.unpack_from(payload)
+
+    @staticmethod
+    def parse_piece(payload: memoryview) -> Tuple[int, int, memoryview]:
+        piece, begin = struct.unpack_from('>II', payload)
+        return piece, begin, payload[8:]
@@ -1,5 +1,11 @@
 from .BandwidthManager import BandwidthManager
 from .NetworkMonitor import NetworkMonitor
 from .PeerConnection import PeerConnection
+from .PeerServer import PeerServer
+from .TokenBucket import TokenBucket
+from .Transport import Transport
+from .WeightedFairQueue import WeightedFairQueue
+from .WireProtocol import WireProtocol
 
-__all__ = ['BandwidthManager', 'NetworkMonitor', 'PeerConnection']
+__all__ = ['BandwidthManager', 'NetworkMonitor', 'PeerConnection', 'PeerServer', 'TokenBucket',
+           'Transport', 'WeightedFairQueue', 'WireProtocol']
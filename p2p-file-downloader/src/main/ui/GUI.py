@@ -1,19 +1,28 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import asyncio
+import os
 import threading
 import time
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict
 from .ProgressBar import ProgressBar
 from ..download.DownloadManager import DownloadManager
+from ..utils.ProgressBridge import ProgressBridge
 
 
 class DownloadItem(ttk.Frame):
-    def __init__(self, master, file_id: str, file_name: str, **kwargs):
+    # 按钮只调用回调（以 file_id 为参数），真正的暂停、继续和取消由 GUI 提交到事件循环执行
+    def __init__(self, master, file_id: str, file_name: str,
+                 on_pause: Optional[Callable[[str], None]] = None,
+                 on_resume: Optional[Callable[[str], None]] = None,
+                 on_cancel: Optional[Callable[[str], None]] = None, **kwargs):
         super().__init__(master, **kwargs)
 
         self.file_id = file_id
         self.file_name = file_name
+        self.on_pause = on_pause
+        self.on_resume = on_resume
+        self.on_cancel = on_cancel
 
         # 文件名标签
         self.name_label = ttk.Label(self, text=file_name)
@@ -69,27 +78,47 @@ class DownloadItem(ttk.Frame):
 
     def update_status(self, status: str):
         self.status_label.config(text=status)
+        if status in ('Completed', 'Failed', 'Cancelled'):
+            self.pause_button.state(['disabled'])
+        elif status == 'Paused' and not self.is_paused:
+            # 由其他途径暂停时同步按钮状态
+            self.is_paused = True
+            self.pause_button.config(text="Resume")
 
     def toggle_pause(self):
         self.is_paused = not self.is_paused
         self.pause_button.config(text="Resume" if self.is_paused else "Pause")
-        # 实现暂停/继续逻辑
+        self.status_label.config(text="Pausing..." if self.is_paused else "Resuming...")
+        callback = self.on_pause if self.is_paused else self.on_resume
+        if callback:
+            callback(self.file_id)
 
     def cancel(self):
-        # 实现取消下载逻辑
-        pass
+        self.pause_button.state(['disabled'])
+        self.cancel_button.state(['disabled'])
+        if self.on_cancel:
+            self.on_cancel(self.file_id)
 
 
 class GUI:
-    def __init__(self, download_manager: DownloadManager):
+    # Tk 只在主线程运行；下载在唯一的 asyncio 事件循环里运行（由 main 在后台线程启动后传入，
+    # 未传入时自己起一个）。界面向循环提交协程用 run_coroutine_threadsafe，
+    # 循环里的进度回调只写 ProgressBridge，界面每 refresh_interval 毫秒取一次合并后的进度再重绘
+    def __init__(self, download_manager: DownloadManager,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 bridge: Optional[ProgressBridge] = None, refresh_interval: int = 100):
         self.download_manager = download_manager
         self.root = tk.Tk()
         self.root.title("P2P File Downloader")
         self.root.geometry("800x600")
         self.setup_ui()
-        self.downloads = {}
-        self.loop = asyncio.new_event_loop()
+        self.downloads: Dict[str, DownloadItem] = {}
+        self.bridge = bridge or ProgressBridge()
+        self.refresh_interval = refresh_interval
+        self.owns_loop = loop is None
+        self.loop = loop or asyncio.new_event_loop()
         self.thread = None
+        self._refresh_id = None
 
     def setup_ui(self):
         self.menu_bar = tk.Menu(self.root)
@@ -147,37 +176,82 @@ class GUI:
         ttk.Button(dialog, text="Start Download", command=start).grid(
             row=2, column=0, columnspan=3, pady=20)
 
-    def start_download(self, file_id: str, save_path: str):
-        download_frame = ttk.Frame(self.downloads_frame)
-        download_frame.grid(sticky=(tk.W, tk.E), padx=5, pady=5)
-        download_frame.columnconfigure(1, weight=1)
+    def submit(self, coro) -> 'asyncio.Future':
+        # 界面线程向事件循环提交协程的唯一入口
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
 
-        ttk.Label(download_frame, text=file_id).grid(row=0, column=0, padx=5)
-        progress_bar = ProgressBar(download_frame)
-        progress_bar.grid(row=0, column=1, padx=5)
+    def call_soon(self, callback, *args):
+        # 修改下载管理器状态的同步调用也放到事件循环线程执行
+        self.loop.call_soon_threadsafe(callback, *args)
 
-        cancel_button = ttk.Button(download_frame, text="Cancel",
-                                 command=lambda: self.cancel_download(file_id))
-        cancel_button.grid(row=0, column=2, padx=5)
-
-        self.downloads[file_id] = {
-            'frame': download_frame,
-            'progress_bar': progress_bar,
-            'cancel_button': cancel_button
-        }
+    def start_download(self, url: str, save_path: str):
+        # 任务 ID 与 DownloadManager.submit 相同：输出文件的绝对路径
+        file_id = os.path.abspath(save_path)
+        if file_id in self.downloads:
+            return
+        item = DownloadItem(self.downloads_frame, file_id, os.path.basename(save_path),
+                            on_pause=self.pause_download, on_resume=self.resume_download,
+                            on_cancel=self.cancel_download)
+        item.grid(sticky=(tk.W, tk.E), padx=5, pady=5)
+        item.columnconfigure(0, weight=1)
+        self.downloads[file_id] = item
+
+        # 以下都在事件循环线程执行，只通过 bridge 把进度交给界面
+        async def on_progress(progress: float, speed: float):
+            job = self.download_manager.jobs.get(file_id)
+            self.bridge.publish(file_id, progress=progress, speed=speed,
+                                downloaded_bytes=job['downloaded_bytes'] if job else 0,
+                                status='Downloading...')
 
         async def download():
-            await self.download_manager.start_download(
-                file_id, {}, save_path,
-                lambda p: progress_bar.set_progress(p)
-            )
-
-        self.loop.create_task(download())
+            job_id = self.download_manager.submit(url, save_path, progress_callback=on_progress)
+            self.bridge.publish(job_id, status='Queued')
+            await self._watch(job_id)
+
+        self.submit(download())
+
+    async def _watch(self, job_id: str):
+        # 在事件循环线程等任务停下（完成、失败、暂停或取消），把结果状态交给界面
+        success = await self.download_manager.wait(job_id)
+        job = self.download_manager.jobs.get(job_id)
+        status = job['status'] if job else 'failed'
+        update = {'status': {'completed': 'Completed', 'paused': 'Paused',
+                             'cancelled': 'Cancelled'}.get(status, 'Failed')}
+        if success and job:
+            update.update(progress=1.0, downloaded_bytes=job['downloaded_bytes'])
+        self.bridge.publish(job_id, **update)
+
+    def pause_download(self, file_id: str):
+        # 在途请求被取消、连接回到连接池，已收到的部分保存下来；状态由 _watch 更新为 Paused
+        self.submit(self.download_manager.pause_job(file_id))
+
+    def resume_download(self, file_id: str):
+        async def resume():
+            if self.download_manager.resume_job(file_id):
+                self.bridge.publish(file_id, status='Queued')
+                await self._watch(file_id)
+
+        self.submit(resume())
 
     def cancel_download(self, file_id: str):
-        if file_id in self.downloads:
-            self.downloads[file_id]['frame'].destroy()
-            del self.downloads[file_id]
+        # 先移除界面上的条目，传输在事件循环里停止并删除未完成的文件
+        item = self.downloads.pop(file_id, None)
+        if item is not None:
+            item.destroy()
+        self.submit(self.download_manager.cancel_job(file_id))
+
+    def refresh_progress(self):
+        # 每个节拍每个任务最多重绘一次，循环线程上报得再频繁也只取最新值
+        for file_id, update in self.bridge.drain().items():
+            item = self.downloads.get(file_id)
+            if item is None:
+                continue
+            if 'progress' in update:
+                item.update_progress(update['progress'],
+                                     update.get('downloaded_bytes', item.last_downloaded_bytes))
+            if 'status' in update:
+                item.update_status(update['status'])
+        self._refresh_id = self.root.after(self.refresh_interval, self.refresh_progress)
 
     def show_preferences(self):
         dialog = tk.Toplevel(self.root)
@@ -204,12 +278,13 @@ class GUI:
                 speed = int(speed_var.get()) * 1024  # 转换为字节/秒
                 concurrent = int(concurrent_var.get())
 
-                # 更新下载管理器的设置
-                self.download_manager.set_max_speed(speed)
-                self.download_manager.set_concurrent_downloads(concurrent)
+                # 在事件循环线程上先更新下载管理器的设置，再保存到配置文件，保存的是新值
+                def apply():
+                    self.download_manager.set_max_speed(speed)
+                    self.download_manager.set_concurrent_downloads(concurrent)
+                    self.download_manager.save_settings()
 
-                # 保存到配置文件
-                self.download_manager.save_settings()
+                self.call_soon(apply)
 
                 dialog.destroy()
                 messagebox.showinfo("Success", "Settings saved successfully!")
@@ -220,16 +295,27 @@ class GUI:
             row=2, column=0, columnspan=2, pady=20)
 
     def run(self):
-        def run_loop():
-            asyncio.set_event_loop(self.loop)
-            self.loop.run_forever()
-
-        self.thread = threading.Thread(target=run_loop, daemon=True)
-        self.thread.start()
+        # 阻塞在 Tk 主循环，直到窗口关闭；必须在主线程调用
+        if self.owns_loop and not self.loop.is_running():
+            def run_loop():
+                asyncio.set_event_loop(self.loop)
+                self.loop.run_forever()
+
+            self.thread = threading.Thread(target=run_loop, daemon=True)
+            self.thread.start()
+        self.refresh_progress()
         self.root.mainloop()
 
     def stop(self):
-        if self.loop.is_running():
-            self.loop.stop()
-        if self.thread and self.thread.is_alive():
-            self.thread.join()
+        if self._refresh_id is not None:
+            self.root.after_cancel(self._refresh_id)
+            self._refresh_id = None
+        try:
+            self.root.destroy()
+        except tk.TclError:
+            pass
+        if self.owns_loop:
+            if self.loop.is_running():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            if self.thread and self.thread.is_alive():
+                self.thread.join()
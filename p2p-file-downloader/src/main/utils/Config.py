@@ -14,17 +14,41 @@ class Config:
                 "chunk_size": 1048576,
                 "max_concurrent_downloads": 3,
                 "timeout": 30,
-                "retry_count": 3
+                "retry_count": 3,
+                "endgame_threshold": 8,
+                "endgame_max_duplicates": 2,
+                "chunk_hash_algorithm": "sha256",
+                "max_request_size": 67108864,
+                "max_active_jobs": 4,
+                "connection_budget": 32
             },
             "network": {
                 "max_bandwidth": 0,
+                "max_peer_bandwidth": 0,
+                "max_connections": 100,
+                "max_connections_per_host": 16,
+                "keepalive_timeout": 30,
+                "dns_cache_ttl": 300,
                 "port": 8000,
+                "wire_port": 8001,
+                "listen_host": "127.0.0.1",
+                "seeding_enabled": False,
+                "max_uploads": 8,
+                "max_upload_bandwidth": 0,
                 "heartbeat_interval": 5
             },
             "storage": {
                 "download_path": "downloads",
                 "temp_path": "temp"
             },
+            "control": {
+                "socket": "temp/control.sock",
+                "host": "127.0.0.1",
+                "port": 8002,
+                "api_port": 0,
+                "api_token": "",
+                "api_token_file": "temp/api.token"
+            },
             "logging": {
                 "level": "INFO",
                 "file": "p2p_downloader.log",
@@ -38,10 +62,19 @@ class Config:
             if os.path.exists(self.config_path):
                 with open(self.config_path, 'r') as f:
                     loaded_config = json.load(f)
-                    self.config.update(loaded_config)
+                    self._merge(self.config, loaded_config)
         except Exception:
             self._save_config()
 
+    @staticmethod
+    def _merge(base: Dict[str, Any], override: Dict[str, Any]):
+        # 逐层合并，配置文件缺少的新选项保留默认值
+        for key, value in override.items():
+            if isinstance(value, dict) and isinstance(base.get(key), dict):
+                Config._merge(base[key], value)
+            else:
+                base[key] = value
+
     def _save_config(self):
         try:
             with open(self.config_path, 'w') as f:
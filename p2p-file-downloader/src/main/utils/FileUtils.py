@@ -14,6 +14,14 @@ class FileUtils:
         if os.path.exists(directory):
             shutil.rmtree(directory)
 
+    @staticmethod
+    def remove_file(file_path: str) -> bool:
+        try:
+            os.remove(file_path)
+            return True
+        except OSError:
+            return False
+
     @staticmethod
     def get_file_size(file_path: str) -> int:
         try:
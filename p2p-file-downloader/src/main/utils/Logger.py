@@ -13,7 +13,7 @@ class Logger:
            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
         )
         if log_file:
-           os.makedirs(os.path.dirname(log_file), exist_ok=True)
+           os.makedirs(os.path.dirname(log_file) or '.', exist_ok=True)
            file_handler = RotatingFileHandler(
                log_file,
                maxBytes=max_size,
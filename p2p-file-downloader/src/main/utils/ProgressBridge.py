@@ -0,0 +1,36 @@
+import threading
+from typing import Any, Dict
+
+
+class ProgressBridge:
+    # 下载所在的 asyncio 线程与界面线程之间的进度通道。
+    # publish 在任意线程调用，只把字段合并进待刷新的字典，不触碰界面；
+    # 界面线程按固定节拍调用 drain 取走每个任务合并后的最新状态，无论每秒到达多少个块，
+    # 每个任务每个节拍最多重绘一次
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def publish(self, key: str, **fields):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = fields
+            else:
+                entry.update(fields)
+            self.published += 1
+
+    def drain(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        self.delivered += len(pending)
+        return pending
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'published': self.published,
+            'delivered': self.delivered,
+            'coalesced': self.published - self.delivered
+        }
@@ -1,5 +1,6 @@
 from .Config import Config
 from .FileUtils import FileUtils
 from .Logger import Logger
+from .ProgressBridge import ProgressBridge
 
-__all__ = ['Config', 'FileUtils', 'Logger']
+__all__ = ['Config', 'FileUtils', 'Logger', 'ProgressBridge']
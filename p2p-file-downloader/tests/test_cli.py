@@ -0,0 +1,201 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from src.main.cli.CLI import CLI
+from src.main.cli.ControlAPI import ControlAPI
+from src.main.cli.ControlClient import ControlClient
+from src.main.cli.Daemon import Daemon
+from src.main.codec.ChunkValidator import ChunkValidator
+from src.main.codec.RSCodec import RSCodec
+from tests.test_download import new_manager, range_handler, start_server
+
+
+def test_headless_imports_skip_gui():
+    # ctl 只加载控制客户端；无界面模式不导入 tkinter
+    code = ("import sys, src.main.cli as cli; cli.ControlClient; "
+            "assert 'numpy' not in sys.modules and 'aiohttp' not in sys.modules, 'ctl'; "
+            "cli.CLI, cli.Daemon, cli.ControlAPI; "
+            "assert cli.CLI.__name__ == 'CLI' and 'tkinter' not in sys.modules, 'daemon'")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
+
+
+def test_submit_arguments_confined(tmp_path):
+    arguments = CLI.submit_arguments({'url': 'http://host/a/b.iso?x=1', 'priority': '3'}, str(tmp_path))
+    assert arguments == {'url': 'http://host/a/b.iso?x=1', 'priority': 3,
+                         'output_path': os.path.join(os.path.realpath(tmp_path), 'b.iso')}
+    os.symlink('/tmp', tmp_path / 'link')
+    for request, error in (({'url': 'http://host/f', 'output_path': '../f'}, ValueError),
+                           ({'url': 'http://host/f', 'output_path': 'link/f'}, ValueError),
+                           ({'url': 'http://host/f', 'output_path': '/etc/passwd'}, ValueError),
+                           ({'url': ''}, ValueError), ({}, KeyError), ([], TypeError)):
+        with pytest.raises(error):
+            CLI.submit_arguments(request, str(tmp_path))
+
+
+@pytest.mark.asyncio
+async def test_cli_prints_json_events(tmp_path):
+    data = os.urandom(2 * 64 * 1024)
+    source, base = await start_server({'/f': range_handler(data)})
+    manager = await new_manager(tmp_path, 64 * 1024)
+    stream = io.StringIO()
+    try:
+        cli = CLI(manager, stream=stream, interval=0.05)
+        assert await cli.run([{'url': f'{base}/f', 'output_path': str(tmp_path / 'out.bin')}])
+    finally:
+        await manager.close()
+        await source.cleanup()
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert events[0]['event'] == 'submitted'
+    assert [event['event'] for event in events].count('first_byte') == 1
+    assert events[-1]['event'] == 'completed' and events[-1]['downloaded_bytes'] == len(data)
+    assert events[-1]['cold_start_seconds'] >= events[-1]['first_byte_seconds'] >= 0
+    assert (tmp_path / 'out.bin').read_bytes() == data
+
+
+@pytest.mark.asyncio
+async def test_daemon_commands_over_socket(tmp_path):
+    data = os.urandom(3 * 64 * 1024)
+    source, base = await start_server({'/f': range_handler(data)})
+    manager = await new_manager(tmp_path, 64 * 1024)
+    socket_path = str(tmp_path / 'run' / 'daemon.sock')
+    daemon = Daemon(manager, socket_path=socket_path, download_dir=str(tmp_path), interval=0.05)
+    assert await daemon.start()
+    assert os.stat(socket_path).st_mode & 0o777 == 0o600
+    try:
+        async with ControlClient(socket_path=socket_path) as client:
+            reply = await client.request({'cmd': 'submit', 'url': f'{base}/f', 'output_path': 'out.bin'})
+            assert reply['ok']
+            job_id = reply['job_id']
+            events = [event async for event in client.watch([job_id])]
+            assert events[-1] == {'event': 'done'}
+            assert events[-2]['status'] == 'completed'
+
+            assert (await client.request({'cmd': 'status', 'job_id': job_id}))['job']['downloaded_bytes'] == len(data)
+            assert (await client.request({'cmd': 'list'}))['jobs'][0]['job'] == job_id
+            assert not (await client.request({'cmd': 'status', 'job_id': 'missing'}))['ok']
+            assert 'bad arguments' in (await client.request({'cmd': 'priority', 'job_id': job_id}))['error']
+            assert 'unknown command' in (await client.request({'cmd': 'bogus'}))['error']
+            assert (await client.request({'cmd': 'max_speed', 'speed': 1000}))['ok'] and manager.max_speed == 1000
+            client.writer.write(b'not json\n')
+            assert 'invalid command' in (await client._receive(5.0))['error']
+            assert (await client.request({'cmd': 'shutdown'}))['ok']
+        await asyncio.wait_for(daemon.serve_forever(), 5.0)
+        assert not os.path.exists(socket_path)
+        assert (tmp_path / 'out.bin').read_bytes() == data
+    finally:
+        await daemon.stop()
+        await manager.close()
+        await source.cleanup()
+
+
+async def start_api(api: ControlAPI):
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+
+@pytest.mark.asyncio
+async def test_control_api_jobs_and_events(tmp_path):
+    data = os.urandom(3 * 64 * 1024 + 10)
+    source, base = await start_server({'/file.bin': range_handler(data)})
+    manager = await new_manager(tmp_path, 64 * 1024)
+    download_dir = tmp_path / 'downloads'
+    download_dir.mkdir()
+    api = ControlAPI(manager, download_dir=str(download_dir), token='secret', interval=0.05)
+    runner, api_url = await start_api(api)
+    auth = {'Authorization': 'Bearer secret'}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'{api_url}/jobs') as response:
+                assert response.status == 401
+            async with session.get(f'{api_url}/jobs', headers={'Authorization': 'Bearer wrong'}) as response:
+                assert response.status == 401
+            # DNS 重绑定的网页带着外部主机名
+            async with session.get(f'{api_url}/jobs', headers=dict(auth, Host='evil.example:8003')) as response:
+                assert response.status == 403
+            async with session.post(f'{api_url}/jobs', headers=auth, data='url=x') as response:
+                assert response.status == 415
+
+            jobs = [{'url': f'{base}/file.bin'},
+                    {'url': f'{base}/file.bin', 'output_path': '../escape.bin'},
+                    {'output_path': 'no-url.bin'}]
+            async with session.post(f'{api_url}/jobs', headers=auth, json={'jobs': jobs}) as response:
+                assert response.status == 200
+                result = await response.json()
+            assert result['submitted'] == 1 and not result['ok']
+            assert [error['index'] for error in result['errors']] == [1, 2]
+            job_id = result['jobs'][0]['job_id']
+
+            async with session.get(f'{api_url}/events', headers=auth,
+                                   params=[('id', job_id), ('id', 'missing')]) as response:
+                assert response.status == 404
+                assert (await response.json())['job_ids'] == ['missing']
+            async with session.get(f'{api_url}/job', headers=auth, params={'id': 'missing'}) as response:
+                assert response.status == 404
+
+            events = []
+            async with session.get(f'{api_url}/events', headers=auth, params={'id': job_id}) as response:
+                assert response.headers['Content-Type'] == 'text/event-stream'
+                async for line in response.content:
+                    if line.startswith(b'event: '):
+                        events.append(line[len('event: '):].strip().decode())
+                    elif line.startswith(b'data: ') and events[-1] == 'progress':
+                        last = json.loads(line[len('data: '):])
+            assert events[-1] == 'done' and set(events[:-1]) == {'progress'}
+            assert last['status'] == 'completed' and last['downloaded_bytes'] == len(data)
+            assert (download_dir / 'file.bin').read_bytes() == data
+
+            async with session.get(f'{api_url}/job', headers=auth, params={'id': job_id}) as response:
+                job = (await response.json())['job']
+            assert job['status'] == 'completed' and job['average_speed'] > 0
+            async with session.post(f'{api_url}/jobs/resume', headers=auth,
+                                    json={'job_ids': [job_id, 'missing']}) as response:
+                assert await response.json() == {'ok': True, 'changed': 0, 'unchanged': [job_id, 'missing']}
+    finally:
+        await runner.cleanup()
+        await manager.close()
+        await source.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_control_api_writes_token_file(tmp_path):
+    token_file = tmp_path / 'run' / 'api.token'
+    api = ControlAPI(None, token_file=str(token_file))
+    token = api._generate_token()
+    assert token_file.read_text().strip() == token
+    assert os.stat(token_file).st_mode & 0o777 == 0o600
+    assert api._host_allowed('127.0.0.1:8003') and api._host_allowed('[::1]:8003')
+    assert not api._host_allowed('127.0.0.1.evil.example') and not api._host_allowed(None)
+
+
+def test_parity_command_writes_parity_sources(tmp_path):
+    data = os.urandom(5 * 1024 * 1024 + 17)
+    (tmp_path / 'file.bin').write_bytes(data)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, 'main.py', 'parity', str(tmp_path / 'file.bin'), '--workers', '2'],
+                            cwd=root, check=True, capture_output=True, text=True)
+    parity_files = json.loads(result.stdout)['parity_files']
+    assert [os.path.basename(path) for path in parity_files] == ['shard_4', 'shard_5']
+
+    expected, _ = RSCodec(4, 2).encode_file(str(tmp_path / 'file.bin'), str(tmp_path / 'expected'), 1024 * 1024)
+    for path, expected_path in zip(parity_files, expected[4:]):
+        with open(path, 'rb') as f, open(expected_path, 'rb') as g:
+            assert f.read() == g.read()
+
+    # 每个校验文件每个条带一个带算法前缀的哈希
+    validator = ChunkValidator(1024 * 1024)
+    with open(json.loads(result.stdout)['parity_hashes']) as f:
+        parity_hashes = json.load(f)
+    assert [len(hashes) for hashes in parity_hashes] == [2, 2]
+    for path, hashes in zip(parity_files, parity_hashes):
+        assert hashes == [f'sha256:{digest}' for digest in validator.hash_file_chunks(path, range(2))]
@@ -0,0 +1,225 @@
+import hashlib
+import itertools
+import json
+import os
+import zlib
+
+import numpy as np
+import pytest
+
+from src.main.codec.ChunkValidator import FAST_ALGORITHM, HASH_ALGORITHMS, ChunkValidator
+from src.main.codec.GF256 import small_matrix_multiply
+from src.main.codec.Manifest import Manifest
+from src.main.codec.MerkleTree import MerkleTree
+from src.main.codec.ParallelCodec import ParallelCodec
+from src.main.codec.RSCodec import RSCodec
+
+
+@pytest.mark.parametrize('k, m', [(4, 2), (6, 3), (10, 4)])
+def test_rs_decode_every_erasure_pattern(k, m):
+    codec = RSCodec(k, m)
+    chunk_size = 64
+    # 两个完整条带加一个末尾补零的条带
+    data = os.urandom(2 * k * chunk_size + 100)
+    shards = codec.encode(data, chunk_size)
+    n = k + m
+    assert len(shards) % n == 0
+    assert shards[:k] == [data[i * chunk_size:(i + 1) * chunk_size] for i in range(k)]
+
+    for erased in itertools.combinations(range(n), m):
+        # 每个条带丢失同一组分片
+        indices = [i for i in range(len(shards)) if i % n not in erased]
+        decoded = codec.decode([shards[i] for i in indices], indices, len(data))
+        assert decoded == data, erased
+
+
+def test_rs_decode_mixed_patterns_per_stripe():
+    codec = RSCodec(4, 2)
+    chunk_size = 32
+    data = os.urandom(3 * 4 * chunk_size)
+    shards = codec.encode(data, chunk_size)
+    # 每个条带丢失不同的分片
+    erased = [{0, 1}, {2, 5}, {4}]
+    indices = [i for i in range(len(shards)) if i % 6 not in erased[i // 6]]
+    assert codec.decode([shards[i] for i in indices], indices, len(data)) == data
+
+
+def test_rs_decode_too_many_erasures():
+    codec = RSCodec(4, 2)
+    data = os.urandom(4 * 16)
+    shards = codec.encode(data, 16)
+    indices = [0, 1, 2]
+    assert codec.decode([shards[i] for i in indices], indices, len(data)) is None
+    assert codec.decode_stripe({i: shards[i] for i in indices}) is None
+
+
+def test_rs_decoding_matrix_cache():
+    codec = RSCodec(4, 2, decoding_cache_size=2)
+    chunk_size = 32
+    data = os.urandom(5 * 4 * chunk_size)
+    stripes = codec.encode_stripes(codec._prepare_data(data, chunk_size))
+    expected = stripes[:, :4]
+
+    # 同一丢失组合的所有条带共用一次求逆，连续调用直接命中缓存
+    indices = (0, 2, 4, 5)
+    assert np.array_equal(codec.decode_stripes(stripes[:, list(indices)], indices), expected)
+    assert np.array_equal(codec.decode_stripes(stripes[:, list(indices)], indices), expected)
+    assert (codec.decoding_cache_misses, codec.decoding_cache_hits) == (1, 1)
+    inverse = codec.decoding_matrices[indices]
+    assert np.array_equal(small_matrix_multiply(inverse, codec.encoding_matrix[list(indices)]),
+                          np.eye(4, dtype=np.uint8))
+    # 数据分片齐全时不需要解码矩阵
+    assert codec.decode_stripes(expected, (0, 1, 2, 3)) is expected
+    assert codec.decoding_cache_misses == 1
+
+    # 超过容量时淘汰最久未用的组合
+    for other in ((1, 2, 3, 4), (0, 1, 3, 5)):
+        assert np.array_equal(codec.decode_stripes(stripes[:, list(other)], other), expected)
+    assert list(codec.decoding_matrices) == [(1, 2, 3, 4), (0, 1, 3, 5)]
+    assert codec.decoding_cache_misses == 3
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 5, 7, 8, 13])
+def test_merkle_proofs(n):
+    blocks = [bytes([i]) * 10 for i in range(n)]
+    tree = MerkleTree([MerkleTree.hash_leaf(block) for block in blocks])
+    for i, block in enumerate(blocks):
+        proof = tree.proof(i)
+        assert MerkleTree.verify_proof(block, i, n, proof, tree.root)
+        assert not MerkleTree.verify_proof(block + b'x', i, n, proof, tree.root)
+        if n > 1:
+            # 证明不能挪到别的位置上用
+            assert not MerkleTree.verify_proof(block, (i + 1) % n, n, proof, tree.root)
+
+
+def test_merkle_leaf_domain_separation():
+    leaves = [MerkleTree.hash_leaf(bytes([i])) for i in range(2)]
+    tree = MerkleTree(leaves)
+    assert leaves[0] == hashlib.sha256(b'\x00' + bytes([0])).digest()
+    assert leaves[0] != hashlib.sha256(bytes([0])).digest()
+    # 两个子节点拼起来当作数据块时得不到同一个根
+    assert not MerkleTree.verify_proof(leaves[0] + leaves[1], 0, 1, [], tree.root)
+    assert MerkleTree.hash_leaf(leaves[0] + leaves[1]) != tree.root
+
+
+def test_manifest_blocks_and_round_trip(tmp_path):
+    block_size = 1024
+    data = os.urandom(20 * block_size + 100)
+    path = tmp_path / 'f.bin'
+    path.write_bytes(data)
+    manifest = Manifest.build(str(path), 4 * block_size, block_size)
+    assert manifest.block_count == 21
+    assert list(manifest.chunk_blocks(5)) == [20]
+
+    for index in (0, 7, 20):
+        start, end = manifest.block_range(index)
+        block = data[start:end + 1]
+        assert manifest.verify_block(index, block)
+        assert not manifest.verify_block(index, block[:-1] + b'x')
+        assert Manifest.verify_block_proof(block, index, manifest.block_count,
+                                           manifest.proof(index), manifest.root)
+        assert not Manifest.verify_block_proof(block, index, manifest.block_count,
+                                               manifest.proof(index), '00' * 32)
+
+    loaded = Manifest.from_json(manifest.to_json(), manifest.root.upper())
+    assert loaded.block_hashes == manifest.block_hashes
+    with pytest.raises(ValueError):
+        Manifest.from_json(manifest.to_json(), '00' * 32)
+    document = manifest.to_dict()
+    document['blocks'][3] = '11' * 32
+    with pytest.raises(ValueError):
+        Manifest.from_dict(document)
+    # 版本 1 的叶子没有前缀，不再接受
+    document = manifest.to_dict()
+    document['version'] = 1
+    with pytest.raises(ValueError):
+        Manifest.from_json(json.dumps(document))
+
+
+def test_manifest_verify_file_finds_bad_blocks(tmp_path):
+    block_size = 1024
+    data = bytearray(os.urandom(16 * block_size + 10))
+    path = tmp_path / 'f.bin'
+    path.write_bytes(data)
+    manifest = Manifest.build(str(path), 4 * block_size, block_size)
+    assert manifest.verify_file(str(path)) == {}
+
+    for offset in (5 * block_size + 3, 6 * block_size, 16 * block_size + 9):
+        data[offset] ^= 0xFF
+    path.write_bytes(data)
+    assert manifest.verify_file(str(path)) == {1: [5, 6], 4: [16]}
+    assert manifest.verify_file(str(path), [0, 4]) == {4: [16]}
+    assert manifest.verify_file(str(tmp_path / 'missing.bin'), [2]) == {2: [8, 9, 10, 11]}
+
+
+def test_fast_checksum_selection():
+    # 优先 crc32c，其次 xxh3_64，都没有安装时退回 zlib.crc32
+    preferred = [name for name in ('crc32c', 'xxh3_64', 'crc32') if name in HASH_ALGORITHMS]
+    assert FAST_ALGORITHM == preferred[0]
+    assert ChunkValidator.resolve_algorithm('fast') == FAST_ALGORITHM
+    assert ChunkValidator(algorithm='fast').algorithm == FAST_ALGORITHM
+    assert ChunkValidator.resolve_algorithm('sha256') == 'sha256'
+    with pytest.raises(ValueError):
+        ChunkValidator(algorithm='md5')
+
+
+@pytest.mark.parametrize('algorithm', sorted(HASH_ALGORITHMS))
+def test_checksum_prefixed_hashes(tmp_path, algorithm):
+    data = os.urandom(3 * 1000 + 7)
+    validator = ChunkValidator(1000, max_workers=2)
+    chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+    expected = [f'{algorithm}:{validator.calculate_chunk_hash(chunk, algorithm)}' for chunk in chunks]
+    if algorithm == 'crc32':
+        assert expected[0] == f'crc32:{zlib.crc32(chunks[0]):08x}'
+    # "算法:摘要" 形式的期望值不受默认算法影响
+    assert validator.validate_chunk(chunks[1], expected[1])
+    assert not validator.validate_chunk(chunks[1], expected[2])
+    assert validator.validate_chunk(chunks[0], f'{algorithm}:{validator.calculate_chunk_hash(chunks[0], algorithm).upper()}')
+
+    path = tmp_path / 'f.bin'
+    path.write_bytes(data)
+    assert validator.validate_file_chunks(str(path), expected) == [True] * 4
+    assert validator.validate_file_chunks(str(path), expected, [3, 1]) == [True, True]
+    path.write_bytes(data[:2500])
+    assert validator.validate_file_chunks(str(path), expected) == [True, True, False, False]
+
+
+def _open_files():
+    files = []
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            files.append(os.readlink(f'/proc/self/fd/{fd}'))
+        except OSError:
+            pass
+    return files
+
+
+def test_parallel_codec_matches_rs_codec(tmp_path):
+    chunk_size = 4096
+    data = os.urandom(9 * 4 * chunk_size + 1234)
+    input_path = tmp_path / 'input.bin'
+    input_path.write_bytes(data)
+    expected, _ = RSCodec(4, 2).encode_file(str(input_path), str(tmp_path / 'expected'), chunk_size)
+
+    # 每批两个条带，多个批次在不同进程里处理
+    with ParallelCodec(4, 2, workers=2, batch_bytes=2 * 4 * chunk_size) as codec:
+        shard_paths = codec.encode_file(str(input_path), str(tmp_path / 'shards'), chunk_size)
+        assert [os.path.basename(path) for path in shard_paths] == [f'shard_{i}' for i in range(6)]
+        for path, expected_path in zip(shard_paths, expected):
+            with open(path, 'rb') as f, open(expected_path, 'rb') as g:
+                assert f.read() == g.read()
+        parity_paths = codec.encode_file(str(input_path), str(tmp_path / 'parity'), chunk_size, range(4, 6))
+        assert [os.path.basename(path) for path in parity_paths] == ['shard_4', 'shard_5']
+        assert sorted(os.listdir(tmp_path / 'parity')) == ['shard_4', 'shard_5']
+
+        # 丢失两个数据分片
+        available = [None, shard_paths[1], None, shard_paths[3], shard_paths[4], shard_paths[5]]
+        output_path = tmp_path / 'decoded.bin'
+        assert codec.decode_file(available, len(data), str(output_path), chunk_size)
+        assert output_path.read_bytes() == data
+        assert not codec.decode_file([None, None, None] + shard_paths[3:], len(data), str(output_path), chunk_size)
+
+        if os.path.isdir('/proc/self/fd'):
+            # 任务结束后工作进程不再持有输入和输出文件
+            for files in (codec.executor.submit(_open_files).result() for _ in range(4)):
+                assert not [path for path in files if path.startswith(str(tmp_path))]
@@ -0,0 +1,747 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from aiohttp import web
+
+from src.main.codec.ChunkValidator import ChunkValidator
+from src.main.codec.Manifest import Manifest
+from src.main.codec.RSCodec import RSCodec
+from src.main.download.ChunkDownloader import ChunkDownloader
+from src.main.download.ChunkScheduler import ChunkScheduler
+from src.main.download.ChunkWriter import ChunkWriter
+from src.main.download.DownloadManager import DownloadManager
+from src.main.download.PeerSelector import PeerSelector
+from src.main.download.PieceAvailability import PieceAvailability
+from src.main.download.ResumeJournal import ResumeJournal
+
+
+def test_journal_round_trip(tmp_path):
+    path = str(tmp_path / 'a.journal')
+    journal = ResumeJournal(path)
+    journal.reset('http://host/f', 'out.bin', 10 * 1000 + 1, 1000, etag='"v1"')
+    for chunk_id in (0, 3, 10):
+        journal.mark_complete(chunk_id)
+    journal.mark_partial(5, 123)
+    journal.mark_partial(5, 100)
+    journal.flush()
+
+    loaded = ResumeJournal(path)
+    assert loaded.load()
+    assert loaded.chunk_count == 11
+    assert loaded.completed_chunks() == [0, 3, 10]
+    assert loaded.completed_count == 3
+    assert loaded.partial == {5: 123}
+    assert loaded.missing_chunks() == [1, 2, 4, 5, 6, 7, 8, 9]
+    assert loaded.matches('http://host/f', 10 * 1000 + 1, 1000, etag='"v1"')
+    # 远端文件变化后旧进度作废
+    assert not loaded.matches('http://host/f', 10 * 1000 + 1, 1000, etag='"v2"')
+
+    loaded.mark_complete(5)
+    loaded.mark_missing(3)
+    assert loaded.partial == {}
+    assert loaded.completed_chunks() == [0, 5, 10]
+
+
+def test_journal_rejects_damaged_file(tmp_path):
+    path = str(tmp_path / 'a.journal')
+    journal = ResumeJournal(path)
+    journal.reset('http://host/f', 'out.bin', 64 * 1000, 1000)
+    journal.flush()
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    with open(path, 'wb') as f:
+        f.write(content[:-1])
+    assert not ResumeJournal(path).load()
+    with open(path, 'wb') as f:
+        f.write(b'XXXX' + content[4:])
+    assert not ResumeJournal(path).load()
+    assert not ResumeJournal(str(tmp_path / 'missing.journal')).load()
+
+
+@pytest.mark.asyncio
+async def test_journal_background_flush(tmp_path):
+    path = str(tmp_path / 'a.journal')
+    journal = ResumeJournal(path, flush_every=2, flush_interval=3600)
+    journal.reset('http://host/f', 'out.bin', 8 * 1000, 1000)
+    synced = []
+
+    def sync_data():
+        synced.append(threading.current_thread() is threading.main_thread())
+
+    journal.mark_complete(0)
+    journal.flush_in_background(sync_data)
+    assert journal._flush_task is None
+    journal.mark_complete(1)
+    journal.flush_in_background(sync_data)
+    # 上一次刷盘还没结束时不再启动新的
+    journal.mark_complete(2)
+    journal.mark_complete(3)
+    journal.flush_in_background(sync_data)
+    await journal._flush_task
+    await journal.flush_async(sync_data)
+
+    # 数据同步在线程池里执行
+    assert synced == [False, False]
+    loaded = ResumeJournal(path)
+    assert loaded.load()
+    assert loaded.completed_chunks() == [0, 1, 2, 3]
+
+
+class FakeDownloader(ChunkDownloader):
+    def __init__(self, data: bytes, behaviour):
+        super().__init__()
+        self.data = data
+        self.behaviour = behaviour
+        self.calls = []
+        self.cancelled = []
+
+    async def download_chunk(self, url, chunk_id, start_byte=None, end_byte=None, *args):
+        self.calls.append((url, chunk_id))
+        try:
+            return chunk_id, await self.behaviour(url, chunk_id, self.data[start_byte:end_byte + 1])
+        except asyncio.CancelledError:
+            self.cancelled.append((url, chunk_id))
+            raise
+
+
+def make_chunks(data: bytes, chunk_size: int, urls):
+    return {chunk_id: {'urls': list(urls), 'start': start, 'end': min(start + chunk_size, len(data)) - 1}
+            for chunk_id, start in enumerate(range(0, len(data), chunk_size))}
+
+
+def test_pick_source_weighted_by_throughput():
+    scheduler = ChunkScheduler(ChunkDownloader(), max_workers=2)
+    scheduler._get_source_stats('fast')['throughput'] = 3000.0
+    scheduler._get_source_stats('slow')['throughput'] = 1000.0
+    assert scheduler.pick_source(['slow', 'fast']) == 'fast'
+    # 吞吐量按在途请求数平分：3000 / 2 仍大于 1000，3000 / 3 不再大于
+    scheduler.source_stats['fast']['inflight'] = 1
+    assert scheduler.pick_source(['slow', 'fast']) == 'fast'
+    scheduler.source_stats['fast']['inflight'] = 2
+    assert scheduler.pick_source(['slow', 'fast']) == 'slow'
+    # 未测速的源按最快的源估计，保证能被测到
+    scheduler.source_stats['fast']['inflight'] = 0
+    assert scheduler.pick_source(['new', 'slow']) == 'new'
+    assert scheduler.pick_source(['slow', 'fast'], exclude={'fast'}) == 'slow'
+    scheduler.chunk_downloader.range_unsupported_urls.add('fast')
+    scheduler.source_stats['slow']['inflight'] = 2
+    assert scheduler.pick_source(['slow', 'fast']) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_spreads_chunks_across_sources():
+    data = os.urandom(40 * 100)
+
+    async def behaviour(url, chunk_id, chunk_data):
+        await asyncio.sleep(0.05 if url == 'slow' else 0.005)
+        return chunk_data
+
+    downloader = FakeDownloader(data, behaviour)
+    scheduler = ChunkScheduler(downloader, max_workers=1)
+    results = await asyncio.wait_for(scheduler.run(make_chunks(data, 100, ['slow', 'fast'])), 10.0)
+
+    assert b''.join(results[chunk_id] for chunk_id in range(40)) == data
+    # 两个源同时下载，快的源按吞吐量分到大部分块
+    counts = {url: len([call for call in downloader.calls if call[0] == url]) for url in ('slow', 'fast')}
+    assert counts['slow'] >= 1 and counts['fast'] > 3 * counts['slow']
+    assert scheduler.source_stats['fast']['throughput'] > scheduler.source_stats['slow']['throughput']
+
+
+@pytest.mark.asyncio
+async def test_download_uses_all_mirrors(tmp_path):
+    data = os.urandom(20 * 4096 + 10)
+    hits = {'a': 0, 'b': 0}
+
+    def counting(name):
+        def on_range(start, end, body):
+            hits[name] += 1
+            return body
+        return on_range
+
+    runner, base = await start_server({'/a': range_handler(data, counting('a')),
+                                       '/b': range_handler(data, counting('b')),
+                                       '/other': range_handler(data[:-1])})
+    manager = await new_manager(tmp_path, 4096)
+    output_path = str(tmp_path / 'out.bin')
+    try:
+        # 大小不一致的镜像不使用
+        assert await manager.start_download(f'{base}/a', output_path,
+                                            mirrors=[f'{base}/b', f'{base}/other', f'{base}/a'])
+        with open(output_path, 'rb') as f:
+            assert f.read() == data
+        assert hits['a'] and hits['b']
+    finally:
+        await manager.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_requeues_failed_chunk():
+    data = os.urandom(8 * 100)
+    failures = {'count': 0}
+
+    async def behaviour(url, chunk_id, chunk_data):
+        # 块 2 在第一轮派发时所有源都失败
+        if chunk_id == 2 and failures['count'] < 2:
+            failures['count'] += 1
+            return None
+        return chunk_data
+
+    downloader = FakeDownloader(data, behaviour)
+    availability = PieceAvailability(8)
+    availability.add_peer('a', pieces=range(8))
+    availability.add_peer('b', pieces=range(8))
+    scheduler = ChunkScheduler(downloader, max_workers=1, availability=availability, max_requeues=1)
+    results = await asyncio.wait_for(scheduler.run(make_chunks(data, 100, ['a', 'b'])), 5.0)
+
+    assert b''.join(results[chunk_id] for chunk_id in range(8)) == data
+    assert scheduler.requeue_counts == {2: 1}
+    # 第一轮两个源各失败一次，重新派发后成功
+    assert len([url for url, chunk_id in downloader.calls if chunk_id == 2]) == 3
+    assert availability.in_flight == set()
+    assert availability.pick_rarest() is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_gives_up_after_max_requeues():
+    data = os.urandom(4 * 100)
+
+    async def behaviour(url, chunk_id, chunk_data):
+        return None if chunk_id == 1 else chunk_data
+
+    downloader = FakeDownloader(data, behaviour)
+    availability = PieceAvailability(4)
+    availability.add_peer('a', pieces=range(4))
+    availability.add_peer('b', pieces=range(4))
+    scheduler = ChunkScheduler(downloader, max_workers=1, availability=availability, max_requeues=1)
+    results = await asyncio.wait_for(scheduler.run(make_chunks(data, 100, ['a', 'b'])), 5.0)
+
+    assert sorted(results) == [0, 2, 3]
+    assert scheduler.failed_chunks == {1}
+    # 两个源各试两轮
+    assert sorted(url for url, chunk_id in downloader.calls if chunk_id == 1) == ['a', 'a', 'b', 'b']
+    # 没下载到的块留在索引里，之后还能再派发
+    assert availability.pick_rarest() == 1
+
+
+def test_availability_rarest_first():
+    availability = PieceAvailability(10)
+    availability.add_peer('a', pieces=range(10))
+    availability.add_peer('b', bitfield=bytes([0b11110000, 0]))
+    availability.add_peer('c', pieces=[0, 1, 9])
+    assert availability.pick_rarest() in {4, 5, 6, 7, 8}
+    assert availability.pick_rarest('c') == 9
+    assert not availability.have('a', 3) and not availability.have('a', 10)
+    assert sorted(availability.holders_of(0)) == ['a', 'b', 'c']
+    assert availability.rarest_first([0, 2, 8]) == [8, 2, 0]
+
+    # 对端离开后它持有的块变稀有
+    availability.remove_peer('a')
+    assert availability.availability(9) == 1 and availability.holders_of(5) == []
+    taken = [availability.take_rarest() for _ in range(6)]
+    assert sorted(taken[:3]) == [2, 3, 9] and sorted(taken[3:5]) == [0, 1] and taken[5] is None
+    # 已派发的块不能再取走；没有持有者的块只能按块号取走
+    assert not availability.take(2) and availability.take_rarest() is None
+    availability.requeue(2)
+    availability.mark_complete(9)
+    assert availability.take_rarest() == 2
+    availability.add_peer('d', pieces=[4])
+    assert availability.take(4) and availability.in_flight == {0, 1, 2, 3, 4}
+    assert availability.get_stats() == {'peers': 3, 'wanted': 9, 'in_flight': 5, 'unavailable': 4,
+                                         'min_availability': 0}
+
+
+class RangeFakeDownloader(FakeDownloader):
+    def __init__(self, data: bytes, behaviour, range_behaviour):
+        super().__init__(data, behaviour)
+        self.range_behaviour = range_behaviour
+        self.ranges = []
+
+    async def download_range(self, url, chunks, on_chunk, download_id=None, on_partial=None):
+        self.ranges.append(sorted(chunks))
+        for chunk_id in sorted(chunks):
+            chunk = chunks[chunk_id]
+            if not self.range_behaviour(url, chunk_id):
+                return False
+            await on_chunk(chunk_id, chunk['start'], self.data[chunk['start']:chunk['end'] + 1], True)
+        return True
+
+
+@pytest.mark.asyncio
+async def test_scheduler_coalesced_leftovers_leave_index_and_requeue():
+    data = os.urandom(8 * 100)
+    failures = {'count': 0}
+
+    async def behaviour(url, chunk_id, chunk_data):
+        # 合并请求断在块 3，之后单独请求块 3 时两个源也都失败一次
+        if chunk_id == 3 and failures['count'] < 2:
+            failures['count'] += 1
+            return None
+        return chunk_data
+
+    downloader = RangeFakeDownloader(data, behaviour, lambda url, chunk_id: chunk_id != 3)
+    downloader.source_rtt['a'] = 0.01
+    availability = PieceAvailability(8)
+    availability.add_peer('a', pieces=range(8))
+    # 块 0 最稀有，先派发，后面的块合并进同一个请求；b 只出现在索引里，只有一个工作协程
+    availability.add_peer('b', pieces=range(1, 8))
+    scheduler = ChunkScheduler(downloader, max_workers=1, availability=availability,
+                               max_request_bytes=10000, max_requeues=1)
+    scheduler._get_source_stats('a')['throughput'] = 1e6
+    results = await asyncio.wait_for(scheduler.run(make_chunks(data, 100, ['a'])), 5.0)
+
+    assert b''.join(results[chunk_id] for chunk_id in range(8)) == data
+    assert downloader.ranges == [list(range(8))]
+    # 合并请求领取的块离开索引，不会再被派发；块 3 失败后放回索引重新派发一次
+    assert sorted(chunk_id for url, chunk_id in downloader.calls) == [3, 3, 3, 4, 5, 6, 7]
+    assert scheduler.requeue_counts == {3: 1}
+    assert scheduler.failed_chunks == set() and scheduler.dispatching == set()
+    assert availability.in_flight == set() and availability.wanted == set()
+
+
+def test_request_size_follows_bandwidth_delay_product():
+    downloader = ChunkDownloader()
+    scheduler = ChunkScheduler(downloader, max_request_bytes=1 << 20)
+    # 没有测出吞吐量和时延之前只请求一个块
+    assert scheduler.request_size('a', 4096) == 4096
+    scheduler._get_source_stats('a')['throughput'] = 1e6
+    assert scheduler.request_size('a', 4096) == 4096
+    # 8 个往返的带宽时延积大于 0.25 秒的传输量
+    downloader.source_rtt['a'] = 0.05
+    assert scheduler.request_size('a', 4096) == 400000
+    # 低时延时至少请求 0.25 秒的数据
+    downloader.source_rtt['a'] = 0.001
+    assert scheduler.request_size('a', 4096) == 250000
+    # 高时延时受 2 秒传输量和 max_request_bytes 限制
+    downloader.source_rtt['a'] = 0.5
+    assert scheduler.request_size('a', 4096) == 1 << 20
+    scheduler.max_request_bytes = 4 << 20
+    assert scheduler.request_size('a', 4096) == 2000000
+    # 慢源不小于一个块
+    scheduler.source_stats['a']['throughput'] = 1000
+    assert scheduler.request_size('a', 4096) == 4096
+    assert ChunkScheduler(downloader).request_size('a', 4096) == 4096
+
+
+@pytest.mark.asyncio
+async def test_scheduler_coalesces_adjacent_chunks():
+    data = os.urandom(9 * 100)
+
+    async def behaviour(url, chunk_id, chunk_data):
+        return chunk_data
+
+    downloader = RangeFakeDownloader(data, behaviour, lambda url, chunk_id: True)
+    downloader.source_rtt['a'] = 0.01
+    scheduler = ChunkScheduler(downloader, max_workers=1, max_request_bytes=300)
+    scheduler._get_source_stats('a')['throughput'] = 1e6
+    chunks = make_chunks(data, 100, ['a'])
+    # 有续传前缀的块单独请求剩余字节
+    chunks[4]['prefix'] = data[400:410]
+    results = await asyncio.wait_for(scheduler.run(chunks), 5.0)
+
+    assert b''.join(results[chunk_id] for chunk_id in range(9)) == data
+    assert downloader.ranges == [[0, 1, 2], [5, 6, 7]]
+    assert sorted(chunk_id for url, chunk_id in downloader.calls) == [3, 4, 8]
+    assert scheduler.source_stats['a']['request_size'] == 300
+
+
+@pytest.mark.asyncio
+async def test_scheduler_endgame_duplicates_stalled_chunk():
+    data = os.urandom(6 * 100)
+
+    async def behaviour(url, chunk_id, chunk_data):
+        if url == 'slow':
+            await asyncio.Event().wait()
+        return chunk_data
+
+    downloader = FakeDownloader(data, behaviour)
+    scheduler = ChunkScheduler(downloader, max_workers=1, endgame_threshold=2, endgame_max_duplicates=1)
+    results = await asyncio.wait_for(scheduler.run(make_chunks(data, 100, ['slow', 'fast'])), 5.0)
+
+    assert b''.join(results[chunk_id] for chunk_id in range(6)) == data
+    # 卡住的请求由收尾副本完成后被取消
+    assert len(downloader.cancelled) == 1
+    stalled = downloader.cancelled[0][1]
+    assert ('slow', stalled) in downloader.calls and ('fast', stalled) in downloader.calls
+
+
+@pytest.mark.asyncio
+async def test_partial_chunk_resumes_at_exact_byte(tmp_path):
+    chunk_size = 64 * 1024
+    partial_bytes = 10000
+    data = os.urandom(4 * chunk_size + 1000)
+    ranges = []
+    stalled = asyncio.Event()
+    released = asyncio.Event()
+
+    async def handler(request):
+        headers = {'Content-Length': str(len(data)), 'Accept-Ranges': 'bytes'}
+        if request.method == 'HEAD':
+            return web.Response(headers=headers)
+        start, end = map(int, request.headers['Range'][len('bytes='):].split('-'))
+        ranges.append((start, end))
+        response = web.StreamResponse(status=206, headers={
+            'Content-Range': f'bytes {start}-{end}/{len(data)}', 'Content-Length': str(end - start + 1)})
+        await response.prepare(request)
+        if start == chunk_size and not stalled.is_set():
+            # 块 1 发出一部分后停住，直到客户端暂停
+            await response.write(data[start:start + partial_bytes])
+            stalled.set()
+            await released.wait()
+            return response
+        await response.write(data[start:end + 1])
+        return response
+
+    app = web.Application()
+    app.router.add_route('*', '/f', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    url = f'http://127.0.0.1:{port}/f'
+    output_path = str(tmp_path / 'out.bin')
+
+    manager = DownloadManager(chunk_size=chunk_size)
+    await manager.initialize()
+    manager.temp_path = str(tmp_path / 'temp')
+    manager.max_speed = 0
+    manager.endgame_threshold = 0
+    manager.max_request_size = 0
+    try:
+        job_id = manager.submit(url, output_path)
+        await asyncio.wait_for(stalled.wait(), 5.0)
+        for _ in range(100):
+            if len(ranges) == 5:
+                break
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)
+        assert await manager.pause_job(job_id)
+
+        journal = ResumeJournal(ResumeJournal.journal_path_for(manager.temp_path, url, output_path))
+        assert journal.load()
+        assert journal.completed_chunks() == [0, 2, 3, 4]
+        assert journal.partial == {1: partial_bytes}
+
+        ranges.clear()
+        assert manager.resume_job(job_id)
+        assert await asyncio.wait_for(manager.wait(job_id), 10.0)
+        # 只请求块 1 剩余的字节
+        assert ranges == [(chunk_size + partial_bytes, 2 * chunk_size - 1)]
+        with open(output_path, 'rb') as f:
+            assert f.read() == data
+    finally:
+        released.set()
+        await manager.close()
+        await runner.cleanup()
+
+
+async def start_server(routes):
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_route('*', path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+
+def range_handler(data: bytes, on_range=None):
+    # 按 Range 返回 206；on_range(start, end, body) 可以改写响应内容
+    async def handler(request):
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Length': str(len(data)), 'Accept-Ranges': 'bytes'})
+        start, end = map(int, request.headers['Range'][len('bytes='):].split('-'))
+        body = data[start:end + 1]
+        if on_range:
+            body = on_range(start, end, body)
+        return web.Response(status=206, body=body,
+                            headers={'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+    return handler
+
+
+async def new_manager(tmp_path, chunk_size: int) -> DownloadManager:
+    manager = DownloadManager(chunk_size=chunk_size)
+    await manager.initialize()
+    manager.temp_path = str(tmp_path / 'temp')
+    manager.max_speed = 0
+    manager.endgame_threshold = 0
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_manifest_repairs_corrupted_block(tmp_path):
+    chunk_size = 64 * 1024
+    block_size = 16 * 1024
+    data = os.urandom(6 * chunk_size + 500)
+    source = tmp_path / 'source.bin'
+    source.write_bytes(data)
+    manifest = Manifest.build(str(source), chunk_size, block_size)
+    corrupted = []
+
+    def corrupt_once(start, end, body):
+        # 第一次传输块 2 时损坏其中的第 10 个小块
+        offset = 10 * block_size
+        if start <= offset <= end and not corrupted:
+            corrupted.append((start, end))
+            body = bytearray(body)
+            body[offset - start + 7] ^= 0xFF
+            return bytes(body)
+        return body
+
+    async def manifest_handler(request):
+        return web.Response(text=manifest.to_json())
+
+    runner, base = await start_server({'/f': range_handler(data, corrupt_once), '/m': manifest_handler})
+    manager = await new_manager(tmp_path, chunk_size)
+    output_path = str(tmp_path / 'out.bin')
+    try:
+        assert await manager.start_download(f'{base}/f', output_path, manifest_url=f'{base}/m',
+                                            manifest_root=manifest.root)
+        with open(output_path, 'rb') as f:
+            assert f.read() == data
+        assert corrupted and manager.chunk_downloader.repaired_blocks == 1
+        # 根哈希对不上时不下载
+        assert not await manager.start_download(f'{base}/f', str(tmp_path / 'other.bin'),
+                                                manifest_url=f'{base}/m', manifest_root='ab' * 32)
+    finally:
+        await manager.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_erasure_download_verifies_shards(tmp_path):
+    chunk_size = 16 * 1024
+    data = os.urandom(2 * 4 * chunk_size + 1000)
+    source = tmp_path / 'source.bin'
+    source.write_bytes(data)
+    shard_paths, _ = RSCodec(4, 2).encode_file(str(source), str(tmp_path / 'shards'), chunk_size)
+    parity = [open(path, 'rb').read() for path in shard_paths[4:]]
+    validator = ChunkValidator(chunk_size)
+    chunk_hashes = [validator.calculate_chunk_hash(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    parity_hashes = [[f'sha256:{validator.calculate_chunk_hash(shards[i:i + chunk_size])}'
+                      for i in range(0, len(shards), chunk_size)] for shards in parity]
+    corrupted = {0}
+
+    async def data_handler(request):
+        # 块 1 的数据源不可用，条带 0 只能靠校验分片恢复
+        if request.headers.get('Range', '').startswith(f'bytes={chunk_size}-'):
+            return web.Response(status=503)
+        return await range_handler(data)(request)
+
+    def corrupt(parity_index):
+        def on_range(start, end, body):
+            if start == 0 and parity_index in corrupted:
+                body = bytearray(body)
+                body[5] ^= 0xFF
+            return bytes(body)
+        return on_range
+
+    runner, base = await start_server({'/f': data_handler, '/p0': range_handler(parity[0], corrupt(0)),
+                                       '/p1': range_handler(parity[1], corrupt(1))})
+    manager = await new_manager(tmp_path, chunk_size)
+    manager.chunk_downloader.max_retries = 1
+    parity_urls = [f'{base}/p0', f'{base}/p1']
+    try:
+        # 损坏的校验分片按 parity_hashes 丢弃，改用另一个校验分片恢复
+        output_path = str(tmp_path / 'out.bin')
+        assert await manager.start_download(f'{base}/f', output_path, parity_urls=parity_urls,
+                                            chunk_hashes=chunk_hashes, parity_hashes=parity_hashes)
+        with open(output_path, 'rb') as f:
+            assert f.read() == data
+
+        # 没有 parity_hashes 时两个校验分片都损坏，恢复出的块对不上块哈希，不写入文件
+        corrupted.add(1)
+        output_path = str(tmp_path / 'bad.bin')
+        assert not await manager.start_download(f'{base}/f', output_path, parity_urls=parity_urls,
+                                                chunk_hashes=chunk_hashes)
+        assert not os.path.exists(output_path)
+    finally:
+        await manager.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_chunk_writer_positional_writes(tmp_path):
+    chunk_size = 1000
+    data = os.urandom(10 * chunk_size + 123)
+    output_path = str(tmp_path / 'out.bin')
+    writer = ChunkWriter(output_path, len(data), chunk_size)
+    with pytest.raises(ValueError):
+        writer.write_at(0, b'x')
+    await writer.open_async()
+    try:
+        # 打开时预分配到最终大小，块可以乱序并发写入
+        assert os.path.getsize(writer.temp_path) == len(data)
+        order = [7, 0, 10, 3, 9, 1, 5, 2, 8, 4, 6]
+        await asyncio.gather(*(writer.write(i * chunk_size, data[i * chunk_size:(i + 1) * chunk_size])
+                               for i in order))
+        assert writer.bytes_written == len(data)
+        assert writer.read_at(3 * chunk_size + 10, 20) == data[3 * chunk_size + 10:3 * chunk_size + 30]
+    finally:
+        writer.close()
+
+    # 重新打开不清空已写入的数据；比目标大的临时文件截断到目标大小
+    with open(writer.temp_path, 'ab') as f:
+        f.write(b'garbage')
+    writer = ChunkWriter(output_path, len(data), chunk_size)
+    writer.open()
+    assert os.path.getsize(writer.temp_path) == len(data)
+    assert writer.write_chunk(10, data[10 * chunk_size:]) == 123
+    assert writer.finalize()
+    assert not os.path.exists(writer.temp_path)
+    with open(output_path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_parse_content_range():
+    assert ChunkDownloader.parse_content_range('bytes 100-199/1000') == (100, 199, 1000)
+    assert ChunkDownloader.parse_content_range(' bytes 0-0/*') == (0, 0, None)
+    for header in (None, '', 'bytes */1000', 'items 0-1/2'):
+        assert ChunkDownloader.parse_content_range(header) is None
+
+
+@pytest.mark.asyncio
+async def test_range_requests_validated_and_full_body_fallback(tmp_path):
+    data = os.urandom(50000)
+    requests = []
+
+    async def wrong_range(request):
+        # 声称返回的区间与请求的不一致
+        return web.Response(status=206, body=data[:100], headers={'Content-Range': f'bytes 0-99/{len(data)}'})
+
+    async def short_body(request):
+        return web.Response(status=206, body=data[100:150], headers={'Content-Range': f'bytes 100-199/{len(data)}'})
+
+    async def ignore_range(request):
+        # 忽略 Range，总是返回整个文件
+        requests.append(request.headers.get('Range'))
+        if request.method == 'HEAD':
+            return web.Response(headers={'Content-Length': str(len(data))})
+        return web.Response(body=data)
+
+    runner, base = await start_server({'/f': range_handler(data), '/wrong': wrong_range,
+                                       '/short': short_body, '/full': ignore_range})
+    downloader = ChunkDownloader(max_retries=1)
+    await downloader.initialize()
+    try:
+        assert await downloader.download_chunk(f'{base}/f', 1, 100, 199) == (1, data[100:200])
+        # 续传时只请求前缀之后的字节
+        assert await downloader.download_chunk(f'{base}/f', 1, 100, 199, prefix=data[100:130]) == (1, data[100:200])
+        assert await downloader.download_chunk(f'{base}/wrong', 1, 100, 199) == (1, None)
+        assert await downloader.download_chunk(f'{base}/short', 1, 100, 199) == (1, None)
+        assert f'{base}/wrong' not in downloader.range_unsupported_urls
+
+        assert await downloader.download_chunk(f'{base}/full', 1, 100, 199) == (1, None)
+        assert downloader.range_unsupported_urls == {f'{base}/full'}
+    finally:
+        await downloader.close()
+
+    manager = await new_manager(tmp_path, 8192)
+    output_path = str(tmp_path / 'out.bin')
+    try:
+        # 不支持 Range 的源改走单连接整流下载
+        requests.clear()
+        assert await manager.start_download(f'{base}/full', output_path)
+        with open(output_path, 'rb') as f:
+            assert f.read() == data
+        # 一次 HEAD，一次整流 GET，中间只有并发中已发出的 Range 请求
+        assert requests.count(None) == 2 and requests[-1] is None
+    finally:
+        await manager.close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_job_queue_runs_higher_priority_first(tmp_path):
+    data = os.urandom(4096)
+    gate = asyncio.Event()
+
+    async def blocked(request):
+        # HEAD 立即返回，数据请求等 gate
+        if request.method != 'HEAD':
+            await gate.wait()
+        return await range_handler(data)(request)
+
+    runner, base = await start_server({'/slow': blocked, '/f': range_handler(data)})
+    manager = await new_manager(tmp_path, 1024)
+    manager.set_max_active_jobs(1)
+    try:
+        first = manager.submit(f'{base}/slow', str(tmp_path / 'first.bin'))
+        low = manager.submit(f'{base}/f', str(tmp_path / 'low.bin'), priority=0)
+        high = manager.submit(f'{base}/f', str(tmp_path / 'high.bin'), priority=1)
+        later = manager.submit(f'{base}/f', str(tmp_path / 'later.bin'), priority=0)
+        await asyncio.sleep(0.1)
+        assert [manager.get_job(job_id)['status'] for job_id in (low, high, later)] == ['queued'] * 3
+        # 排队中的任务可以调整优先级
+        assert manager.set_job_priority(later, 2)
+        gate.set()
+        assert await asyncio.wait_for(manager.wait_all(), 10.0) == {first: True, low: True, high: True, later: True}
+        started = sorted((low, high, later), key=lambda job_id: manager.get_job(job_id)['started'])
+        assert started == [later, high, low]
+    finally:
+        await manager.close()
+        await runner.cleanup()
+
+
+def test_peer_selector_decay_and_ranking():
+    selector = PeerSelector(failure_half_life=10.0, eviction_seconds=100.0)
+    selector.record_transfer('a', 1000, 1.0, 0.1)
+    selector.record_transfer('a', 2000, 1.0, 0.2)
+    # 吞吐量和时延都是 EWMA
+    assert selector.get_speed('a') == pytest.approx(1300)
+    assert selector.get_rtt('a') == pytest.approx(0.13)
+
+    for peer, speed in (('b', 5000), ('c', 3000), ('d', 100)):
+        selector.record_transfer(peer, speed, 1.0)
+    # 反复更新只压入新记录，旧记录按版本号跳过，堆的大小有上限
+    for _ in range(200):
+        selector.record_transfer('d', 100, 1.0)
+    assert len(selector._heap) <= 2 * len(selector.peer_stats) + 64
+    assert selector.get_peer_ranking(2) == [('b', 5000), ('c', 3000)]
+    assert [peer for peer, _ in selector.get_peer_ranking()] == ['b', 'c', 'a', 'd']
+
+    # 失败次数按半衰期衰减，短时间内连续失败三次才视为不可靠
+    for _ in range(3):
+        selector.record_failure('b')
+    now = selector.peer_stats['b']['last_failure']
+    assert selector.get_failures('b', now) == pytest.approx(3, rel=1e-3)
+    assert not selector.is_peer_reliable('b', now)
+    assert selector.get_failures('b', now + 10) == pytest.approx(1.5, rel=1e-3)
+    assert selector.is_peer_reliable('b', now + 10)
+    assert selector.get_best_peers(2) == ['c', 'a']
+
+    # 长时间没有消息的对端被淘汰，不再出现在排名里
+    selector.evict_stale(now + 101)
+    assert selector.peer_stats == {} and selector.get_peer_ranking() == []
+    assert not selector.is_peer_reliable('c') and selector.needs_probe('c')
+
+
+@pytest.mark.asyncio
+async def test_peer_selector_probes_only_unknown_peers():
+    data = os.urandom(64 * 1024)
+    probes = []
+
+    def count(start, end, body):
+        probes.append((start, end))
+        return body
+
+    runner, base = await start_server({'/f': range_handler(data, count)})
+    selector = PeerSelector(speed_test_size=4096)
+    await selector.initialize()
+    try:
+        selector.record_transfer('http://known/f', 10 ** 9, 1.0)
+        locations = {0: [f'{base}/f', 'http://known/f'], 1: [f'{base}/f'], 2: ['http://known/f', f'{base}/f']}
+        optimal = await selector.select_optimal_peers(locations, per_chunk=1)
+        # 只探测没有样本的源，结果按最稀有优先、每块取最快的源
+        assert probes == [(0, 4095)]
+        assert list(optimal) == [1, 0, 2]
+        assert optimal == {1: [f'{base}/f'], 0: ['http://known/f'], 2: ['http://known/f']}
+        await selector.select_optimal_peers(locations)
+        assert len(probes) == 1
+    finally:
+        await selector.close()
+        await runner.cleanup()
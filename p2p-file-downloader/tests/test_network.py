@@ -0,0 +1,357 @@
+import asyncio
+import socket
+import time
+
+import aiohttp
+import pytest
+
+from src.main.download.ChunkDownloader import ChunkDownloader
+from src.main.network.BandwidthManager import BandwidthManager
+from src.main.network.PeerConnection import PeerConnection
+from src.main.network.PeerServer import PeerServer
+from src.main.network.TokenBucket import TokenBucket
+from src.main.network.Transport import Transport
+from src.main.network.WeightedFairQueue import WeightedFairQueue
+from src.main.network.WireProtocol import (MSG_BITFIELD, MSG_CANCEL, MSG_HANDSHAKE, MSG_HAVE,
+                                           MSG_KEEPALIVE, MSG_PIECE, MSG_REJECT, MSG_REQUEST,
+                                           WireProtocol)
+
+
+async def open_pair(**options):
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_connect(reader, writer):
+        accepted.set_result(WireProtocol(reader, writer, **options))
+
+    server = await asyncio.start_server(on_connect, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    client = await WireProtocol.open('127.0.0.1', port)
+    return server, client, await accepted
+
+
+async def close_pair(server, client, peer):
+    await client.close()
+    await peer.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_wire_message_framing():
+    server, client, peer = await open_pair()
+    try:
+        client.send_handshake('peer-1', 'file.bin', 65536)
+        client.send_keepalive()
+        client.send_have(7)
+        client.send_bitfield(b'\xf0\x01')
+        client.send_request(3, 16384, 4096)
+        client.send_cancel(3, 16384, 4096)
+        client.send_reject(4, 0, 100)
+        client.send_piece(5, 32, memoryview(b'payload'))
+        client.send_piece_header(6, 0, 3)
+        client.writer.write(b'abc')
+        client.bytes_sent += 3
+        await client.drain()
+
+        msg_id, payload = await peer.read_message()
+        assert msg_id == MSG_HANDSHAKE
+        assert WireProtocol.parse_handshake(payload) == {
+            'peer_id': 'peer-1', 'resource': 'file.bin', 'chunk_size': 65536, 'file_size': 0}
+        assert (await peer.read_message())[0] == MSG_KEEPALIVE
+        msg_id, payload = await peer.read_message()
+        assert (msg_id, WireProtocol.parse_have(payload)) == (MSG_HAVE, 7)
+        msg_id, payload = await peer.read_message()
+        assert (msg_id, bytes(payload)) == (MSG_BITFIELD, b'\xf0\x01')
+        for expected_id, address in ((MSG_REQUEST, (3, 16384, 4096)), (MSG_CANCEL, (3, 16384, 4096)),
+                                     (MSG_REJECT, (4, 0, 100))):
+            msg_id, payload = await peer.read_message()
+            assert (msg_id, WireProtocol.parse_address(payload)) == (expected_id, address)
+        msg_id, payload = await peer.read_message()
+        piece, begin, data = WireProtocol.parse_piece(payload)
+        assert (msg_id, piece, begin, bytes(data)) == (MSG_PIECE, 5, 32, b'payload')
+        msg_id, payload = await peer.read_message()
+        piece, begin, data = WireProtocol.parse_piece(payload)
+        assert (msg_id, piece, begin, bytes(data)) == (MSG_PIECE, 6, 0, b'abc')
+        assert client.bytes_sent == peer.bytes_received
+    finally:
+        await close_pair(server, client, peer)
+
+
+@pytest.mark.asyncio
+async def test_wire_handshake_exchange():
+    server, client, peer = await open_pair()
+    try:
+        async def answer():
+            msg_id, payload = await peer.read_message()
+            request = WireProtocol.parse_handshake(payload)
+            peer.send_handshake('seed', request['resource'], request['chunk_size'], 1000)
+            await peer.drain()
+
+        answer_task = asyncio.create_task(answer())
+        info = await client.handshake('leech', 'file.bin', 4096, timeout=5.0)
+        await answer_task
+        assert info == {'peer_id': 'seed', 'resource': 'file.bin', 'chunk_size': 4096, 'file_size': 1000}
+    finally:
+        await close_pair(server, client, peer)
+
+
+@pytest.mark.asyncio
+async def test_wire_rejects_bad_frames():
+    server, client, peer = await open_pair(max_message_size=1024)
+    try:
+        assert WireProtocol.parse_handshake(memoryview(b'XXXX\x01\x00')) is None
+        client.send_piece(0, 0, b'x' * 2048)
+        await client.drain()
+        with pytest.raises(ValueError):
+            await peer.read_message()
+    finally:
+        await close_pair(server, client, peer)
+
+
+@pytest.mark.asyncio
+async def test_wire_connection_closed_mid_frame():
+    server, client, peer = await open_pair()
+    try:
+        client.writer.write(b'\x00\x00\x00\x10\x07')
+        await client.drain()
+        await client.close()
+        with pytest.raises(asyncio.IncompleteReadError):
+            await peer.read_message()
+    finally:
+        await close_pair(server, client, peer)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_sends_cancel():
+    received = []
+    seen = asyncio.Event()
+
+    async def on_connect(reader, writer):
+        wire = WireProtocol(reader, writer)
+        try:
+            msg_id, payload = await wire.read_message()
+            request = WireProtocol.parse_handshake(payload)
+            wire.send_handshake('seed', request['resource'], request['chunk_size'], 1 << 20)
+            await wire.drain()
+            while True:
+                msg_id, payload = await wire.read_message()
+                received.append((msg_id, WireProtocol.parse_address(payload)))
+                seen.set()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            await wire.close()
+
+    server = await asyncio.start_server(on_connect, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    peer = PeerConnection('seed', '127.0.0.1', 0, wire_port=port, resource='file.bin', chunk_size=4096)
+    try:
+        assert await peer.connect()
+        first = asyncio.create_task(peer.request_piece(1))
+        second = asyncio.create_task(peer.request_piece(1))
+        await asyncio.wait_for(seen.wait(), 5.0)
+        # 同一块还有调用方在等，不撤销请求
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        assert (1, 0, 4096) in peer._pending
+        seen.clear()
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.wait_for(seen.wait(), 5.0)
+        assert peer._pending == {} and peer._waiters == {}
+        assert received == [(MSG_REQUEST, (1, 0, 4096)), (MSG_CANCEL, (1, 0, 4096))]
+    finally:
+        await peer.disconnect()
+        server.close()
+        await server.wait_closed()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_peer_server_throttled_uploads(tmp_path):
+    (tmp_path / 'empty.bin').write_bytes(b'')
+    data = bytes(range(256)) * 20
+    (tmp_path / 'data.bin').write_bytes(data)
+    server = PeerServer(str(tmp_path), port=free_port(), wire_port=free_port(),
+                        bandwidth_manager=BandwidthManager(max_upload_bandwidth=1 << 20))
+    assert await server.start()
+    peer = PeerConnection('seed', '127.0.0.1', server.port, wire_port=server.wire_port,
+                          resource='data.bin', chunk_size=1000)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{server.port}/data/empty.bin') as response:
+                assert response.status == 200
+                assert await response.read() == b''
+            async with session.get(f'http://127.0.0.1:{server.port}/data/data.bin',
+                                   headers={'Range': 'bytes=100-1099'}) as response:
+                assert response.status == 206
+                assert await response.read() == data[100:1100]
+
+        assert await peer.connect()
+        # 不在队列里的取消消息直接忽略
+        for piece in range(100):
+            peer.wire.send_cancel(piece, 0, 1000)
+        assert bytes(await peer.request_piece(2)) == data[2000:3000]
+        assert bytes(await peer.request_piece(5, 0, 120)) == data[5000:5120]
+    finally:
+        await peer.disconnect()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_wire_requests_matched_by_length(tmp_path):
+    data = bytes(range(256)) * 20
+    (tmp_path / 'data.bin').write_bytes(data)
+    server = PeerServer(str(tmp_path), port=free_port(), wire_port=free_port())
+    assert await server.start()
+    peer = PeerConnection('seed', '127.0.0.1', server.port, wire_port=server.wire_port,
+                          resource='data.bin', chunk_size=1000)
+    try:
+        assert await peer.connect() and peer.protocol == 'wire'
+        # 同一偏移、不同长度的请求各自拿到自己的数据
+        short, full = await asyncio.gather(peer.request_piece(3, 0, 100), peer.request_piece(3, 0))
+        assert (bytes(short), bytes(full)) == (data[3000:3100], data[3000:4000])
+        results = await peer.request_pieces([(1, 0, 10), (1, 0, 20), (9, 0, 1000), (1, 500, 2000)])
+        assert {address: payload and bytes(payload) for address, payload in results.items()} == {
+            (1, 0, 10): data[1000:1010], (1, 0, 20): data[1000:1020], (9, 0, 1000): None,
+            (1, 500, 2000): None}
+        assert peer._pending == {}
+        # 二进制连接没有 HTTP 会话
+        assert not await peer.send_data(b'x')
+        assert await peer.receive_data() is None
+        assert (await peer.get_peer_info())['resource'] == 'data.bin'
+    finally:
+        await peer.disconnect()
+        await server.stop()
+
+
+@pytest.mark.asyncio
+async def test_peer_server_throttles_wire_pieces_per_slice(tmp_path):
+    data = bytes(range(256)) * 20
+    (tmp_path / 'data.bin').write_bytes(data)
+    server = PeerServer(str(tmp_path), port=free_port(), wire_port=free_port(), read_size=256,
+                        bandwidth_manager=BandwidthManager(max_upload_bandwidth=1 << 20))
+    throttled = []
+    throttle = server._throttle
+
+    async def record(nbytes, peer):
+        throttled.append(nbytes)
+        await throttle(nbytes, peer)
+
+    server._throttle = record
+    assert await server.start()
+    peer = PeerConnection('seed', '127.0.0.1', server.port, wire_port=server.wire_port,
+                          resource='data.bin', chunk_size=1000)
+    try:
+        assert await peer.connect() and peer.protocol == 'wire'
+        assert bytes(await peer.request_piece(4)) == data[4000:5000]
+        # 整块不会一次取走令牌，而是和 HTTP 一样按 read_size 分片
+        assert throttled == [256, 256, 256, 232]
+        assert server.stats['bytes_uploaded'] == 1000
+    finally:
+        await peer.disconnect()
+        await server.stop()
+
+
+def test_token_bucket_debt_and_refill():
+    bucket = TokenBucket(1000, burst=100)
+    now = bucket.last_refill
+    # 满桶时不等待，之后按欠款 / 速率计算等待时间
+    assert bucket.take(100, now) == 0
+    assert bucket.take(500, now) == pytest.approx(0.5)
+    assert bucket.take(0, now + 0.5) == pytest.approx(0)
+    # 空闲再久也只积累 burst 个令牌
+    assert bucket.take(300, now + 10) == pytest.approx(0.2)
+    # 提高速率时保留欠款
+    bucket.set_rate(2000)
+    assert bucket.tokens < 0 and bucket.burst == pytest.approx(200)
+    assert TokenBucket(0).take(1 << 30) == 0 and TokenBucket(float('inf')).unlimited
+
+
+@pytest.mark.asyncio
+async def test_bandwidth_caps_hold_measured_rate():
+    rate = 200_000
+    for download_limit in (False, True):
+        manager = BandwidthManager(max_bandwidth=float('inf') if download_limit else rate)
+        if download_limit:
+            manager.set_download_limit('job', rate)
+        started = time.monotonic()
+        for _ in range(64):
+            await manager.consume(1000, 'job', 'http://peer/f')
+        elapsed = time.monotonic() - started
+        # 初始的 burst（0.1 秒的量）之后按速率放行
+        expected = (64 * 1000 - rate * 0.1) / rate
+        assert expected * 0.9 <= elapsed < expected + 0.2, (download_limit, elapsed)
+
+
+@pytest.mark.asyncio
+async def test_fair_queue_splits_by_weight():
+    rate = 400_000
+    queue = WeightedFairQueue(TokenBucket(rate))
+    queue.set_weight('heavy', 3)
+    queue.set_weight('light', 1)
+    received = {'heavy': 0, 'light': 0}
+
+    async def flow(name):
+        while True:
+            await queue.acquire(name, 1000)
+            received[name] += 1000
+
+    tasks = [asyncio.create_task(flow(name)) for name in received]
+    started = time.monotonic()
+    await asyncio.sleep(0.5)
+    elapsed = time.monotonic() - started
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # 两个任务都在排队时按 3:1 分带宽，合计不超过令牌桶的速率
+    assert 2.5 < received['heavy'] / received['light'] < 3.5
+    assert sum(received.values()) <= rate * elapsed + rate * 0.1 + 2000
+    # 只剩一个任务时它拿到全部带宽
+    queue.remove_flow('heavy')
+    assert queue.pending == 0
+    started = time.monotonic()
+    for _ in range(40):
+        await queue.acquire('light', 1000)
+    assert time.monotonic() - started < 0.2
+
+
+@pytest.mark.asyncio
+async def test_transport_shared_and_reused(tmp_path):
+    data = bytes(range(256)) * 40
+    (tmp_path / 'data.bin').write_bytes(data)
+    server = PeerServer(str(tmp_path), port=free_port(), wire_port=free_port())
+    assert await server.start()
+    url = f'http://localhost:{server.port}/data/data.bin'
+    transport = Transport(limit_per_host=2)
+    try:
+        async with transport:
+            first = ChunkDownloader(transport=transport)
+            second = ChunkDownloader(transport=transport)
+            await first.initialize()
+            await second.initialize()
+            assert first.session is second.session is transport.session
+
+            results = await asyncio.gather(*((first if i % 2 else second).download_chunk(url, i, i * 100, i * 100 + 99)
+                                             for i in range(20)))
+            assert [chunk for _, chunk in results] == [data[i * 100:(i + 1) * 100] for i in range(20)]
+            # 每个主机最多两条连接，其余请求复用保持的连接，主机名只解析一次
+            stats = transport.get_stats()
+            assert stats['requests'] == 20
+            assert stats['connections_created'] <= 2
+            assert stats['connections_reused'] == 20 - stats['connections_created']
+            assert stats['dns_resolutions'] == 1
+
+            # 共享的传输层由调用方关闭，下载器关闭时不受影响
+            await first.close()
+            assert transport.is_open
+            assert (await second.download_chunk(url, 0, 0, 99))[1] == data[:100]
+        assert not transport.is_open
+    finally:
+        await server.stop()
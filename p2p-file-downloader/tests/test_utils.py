@@ -0,0 +1,51 @@
+import threading
+
+from src.main.utils.ProgressBridge import ProgressBridge
+
+
+def test_progress_bridge_coalesces_updates():
+    bridge = ProgressBridge()
+    bridge.publish('a', progress=0.1, speed=100)
+    bridge.publish('a', progress=0.2)
+    bridge.publish('b', status='downloading')
+    # 同一任务的多次更新合并成一条，字段取最新值
+    assert bridge.drain() == {'a': {'progress': 0.2, 'speed': 100}, 'b': {'status': 'downloading'}}
+    assert bridge.drain() == {}
+    assert bridge.get_stats() == {'published': 3, 'delivered': 2, 'coalesced': 1}
+
+
+def test_progress_bridge_publish_from_threads():
+    bridge = ProgressBridge()
+    updates = 2000
+    latest = {}
+    stop = threading.Event()
+
+    def publisher(key: str):
+        for i in range(updates):
+            bridge.publish(key, progress=i)
+
+    def consumer():
+        # 模拟界面线程按节拍取进度
+        while not stop.is_set():
+            for key, fields in bridge.drain().items():
+                assert fields['progress'] >= latest.get(key, -1)
+                latest[key] = fields['progress']
+
+    keys = [f'job-{i}' for i in range(4)]
+    drainer = threading.Thread(target=consumer)
+    drainer.start()
+    publishers = [threading.Thread(target=publisher, args=(key,)) for key in keys]
+    for thread in publishers:
+        thread.start()
+    for thread in publishers:
+        thread.join()
+    stop.set()
+    drainer.join()
+    for key, fields in bridge.drain().items():
+        latest[key] = fields['progress']
+
+    # 每个任务最后一次更新都送到了，送出的条数不超过发布的次数
+    assert latest == {key: updates - 1 for key in keys}
+    stats = bridge.get_stats()
+    assert stats['published'] == len(keys) * updates
+    assert stats['delivered'] <= stats['published']